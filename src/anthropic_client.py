@@ -1,25 +1,267 @@
 # anthropic_client.py
 
 import anthropic
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import os
+import random
+import threading
+import time
+from typing import AsyncIterator
+
+# Set to "fake" to answer with FakeAnthropicClient, e.g. for tests and local development.
+anthropic_client_kind = os.getenv("ANTHROPIC_CLIENT", "anthropic")
+# Maximum number of Claude requests in flight across the process, retries of a rate limited
+# request, and the base and cap of their exponential backoff in seconds.
+anthropic_max_in_flight = int(os.getenv("ANTHROPIC_MAX_IN_FLIGHT", "4"))
+anthropic_max_retries = int(os.getenv("ANTHROPIC_MAX_RETRIES", "5"))
+anthropic_backoff_base = float(os.getenv("ANTHROPIC_BACKOFF_BASE", "1"))
+anthropic_backoff_max = float(os.getenv("ANTHROPIC_BACKOFF_MAX", "30"))
+# How long idle connections to the API are kept open for reuse.
+anthropic_keepalive_seconds = float(os.getenv("ANTHROPIC_KEEPALIVE_SECONDS", "300"))
+
+DEFAULT_MODEL = "claude-3-haiku-20240307"
+DEFAULT_MAX_TOKENS = 1000
+
+
+def build_prompt(docs, question):
+    return (
+        f"{anthropic.HUMAN_PROMPT}\
+        I want you to answer the following question: {question}. I will provide you with a list of documents that are useful to answer this question.\
+        \n Each document will be provided in the format. TITLE: <paper_title> DOI: <doi> DOCUMENT <document> \
+        \n Think of yourself as a machine learning expert who already knew everything present in these documents. Carefully analyze the above documents and answer the following question.\
+        \n Please also cite any of the documents that were given to you as context but do not make any mention of documents being provided to you. To cite a document, you would use it's DOI.\
+        \n Here are the documents\n{docs}\
+        \n Here is your question\n \
+        Question: {question}{anthropic.AI_PROMPT}"
+    )
+
+
+class ClientMetrics:
+    """Counts the calls of a client and keeps the latencies of the most recent ones."""
+
+    def __init__(self, window: int = 1000) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self._latencies = deque(maxlen=window)
+        self._first_token = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def record(self, latency: float, first_token: float = None, error: bool = False) -> None:
+        with self._lock:
+            self.calls += 1
+            self.errors += error
+            if not error:
+                self._latencies.append(latency)
+                if first_token is not None:
+                    self._first_token.append(first_token)
+
+    @staticmethod
+    def _percentile(values, q: float) -> float:
+        if not values:
+            return None
+        values = sorted(values)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def stats(self) -> dict:
+        """Returns the call counters and the p50/p95 latency and time to first token in seconds."""
+        with self._lock:
+            latencies, first_token = list(self._latencies), list(self._first_token)
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "retries": self.retries,
+                "latency_p50": self._percentile(latencies, 0.5),
+                "latency_p95": self._percentile(latencies, 0.95),
+                "first_token_p50": self._percentile(first_token, 0.5),
+                "first_token_p95": self._percentile(first_token, 0.95),
+            }
+
+
+def _is_retryable(error: Exception) -> bool:
+    # 429 rate limited, or 529 overloaded
+    return isinstance(error, anthropic.RateLimitError) or (
+        isinstance(error, anthropic.APIStatusError) and error.status_code == 529)
+
+
+def _backoff(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, but never shorter than the server's retry-after."""
+    delay = random.uniform(0, min(anthropic_backoff_max, anthropic_backoff_base * 2 ** attempt))
+    try:
+        delay = max(delay, float(error.response.headers.get("retry-after")))
+    except (AttributeError, TypeError, ValueError):
+        pass
+    return delay
+
+
+# Shared by all clients, so bursts of questions never have more than this many requests in flight.
+_limiter = threading.BoundedSemaphore(anthropic_max_in_flight)
+# Async callers wait for a slot on these threads rather than the loop's default executor, which
+# `asyncio.to_thread` shares with the document preparation and downloads of the same query.
+_limiter_executor = ThreadPoolExecutor(max_workers=anthropic_max_in_flight, thread_name_prefix="claude-limiter")
+
+
+async def _acquire_limiter() -> None:
+    """Waits for a slot of the shared limiter on a dedicated thread, without blocking the event loop."""
+    if _limiter.acquire(blocking=False):
+        return
+    acquired = asyncio.get_running_loop().run_in_executor(_limiter_executor, _limiter.acquire)
+    try:
+        await asyncio.shield(acquired)
+    except asyncio.CancelledError:
+        # The worker thread still gets the slot, hand it back as soon as it does.
+        acquired.add_done_callback(lambda _: _limiter.release())
+        raise
+
 
 class AnthropicClient:
-    def __init__(self, api_key):
-        self.client = anthropic.Client(api_key=api_key)
-
-    def get_response(self, docs, question, model="claude-3-haiku-20240307", max_tokens=1000):
-        prompt = (
-            f"{anthropic.HUMAN_PROMPT}\
-            I want you to answer the following question: {question}. I will provide you with a list of documents that are useful to answer this question.\
-            \n Each document will be provided in the format. TITLE: <paper_title> DOI: <doi> DOCUMENT <document> \
-            \n Think of yourself as a machine learning expert who already knew everything present in these documents. Carefully analyze the above documents and answer the following question.\
-            \n Please also cite any of the documents that were given to you as context but do not make any mention of documents being provided to you. To cite a document, you would use it's DOI.\
-            \n Here is your question\n \
-            Question: {question}{anthropic.AI_PROMPT}"
-        )
-        
-        response = self.client.messages.create(
-            model=model,
-            max_tokens=max_tokens,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.content[0].text
\ No newline at end of file
+    """
+    A Claude client meant to be shared by the whole process, see `get_client`.
+
+    Connections are kept alive and reused between calls. At most ANTHROPIC_MAX_IN_FLIGHT
+    requests run at once, rate limited requests are retried with jittered exponential backoff,
+    and the latency of every call is recorded in `metrics`.
+    """
+
+    def __init__(self, api_key, max_retries: int = None):
+        self.api_key = api_key
+        self.max_retries = anthropic_max_retries if max_retries is None else max_retries
+        self.metrics = ClientMetrics()
+        # Retries are handled here, so the SDK's own retries are disabled.
+        self.client = anthropic.Client(api_key=api_key, max_retries=0, http_client=anthropic.DefaultHttpxClient(
+            limits=self._limits()))
+        # The async client's connections belong to the event loop it was first used on.
+        self._async_client: anthropic.AsyncAnthropic = None
+        self._async_client_loop: asyncio.AbstractEventLoop = None
+
+    @staticmethod
+    def _limits() -> httpx.Limits:
+        return httpx.Limits(max_connections=2 * anthropic_max_in_flight,
+                            max_keepalive_connections=anthropic_max_in_flight,
+                            keepalive_expiry=anthropic_keepalive_seconds)
+
+    def _get_async_client(self) -> anthropic.AsyncAnthropic:
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            self._async_client = anthropic.AsyncAnthropic(api_key=self.api_key, max_retries=0,
+                                                          http_client=anthropic.DefaultAsyncHttpxClient(limits=self._limits()))
+            self._async_client_loop = loop
+        return self._async_client
+
+    def get_response(self, docs, question, model=DEFAULT_MODEL, max_tokens=DEFAULT_MAX_TOKENS):
+        start = time.perf_counter()
+        with _limiter:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = self.client.messages.create(
+                        model=model,
+                        max_tokens=max_tokens,
+                        messages=[{"role": "user", "content": build_prompt(docs, question)}]
+                    )
+                    break
+                except Exception as e:
+                    if not _is_retryable(e) or attempt == self.max_retries:
+                        self.metrics.record(time.perf_counter() - start, error=True)
+                        raise
+                    self.metrics.record_retry()
+                    delay = _backoff(attempt, e)
+                    print(f"Claude is rate limited, retrying in {delay:.1f}s")
+                    time.sleep(delay)
+        latency = time.perf_counter() - start
+        self.metrics.record(latency)
+        print(f"Claude answered in {latency:.2f}s")
+        return response.content[0].text
+
+    async def stream_response(self, docs, question, model=DEFAULT_MODEL, max_tokens=DEFAULT_MAX_TOKENS) -> AsyncIterator[str]:
+        """
+        Streams the answer to `question` as it is generated.
+
+        A request is only retried if it was rate limited before any text was received.
+
+        Yields:
+            str: The text deltas of the response, in order. Joined, they equal `get_response`.
+        """
+        start = time.perf_counter()
+        first_token = None
+        await _acquire_limiter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    async with self._get_async_client().messages.stream(
+                        model=model,
+                        max_tokens=max_tokens,
+                        messages=[{"role": "user", "content": build_prompt(docs, question)}]
+                    ) as stream:
+                        async for text in stream.text_stream:
+                            if first_token is None:
+                                first_token = time.perf_counter() - start
+                            yield text
+                    break
+                except Exception as e:
+                    if first_token is not None or not _is_retryable(e) or attempt == self.max_retries:
+                        self.metrics.record(time.perf_counter() - start, error=True)
+                        raise
+                    self.metrics.record_retry()
+                    delay = _backoff(attempt, e)
+                    print(f"Claude is rate limited, retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+        finally:
+            _limiter.release()
+        latency = time.perf_counter() - start
+        self.metrics.record(latency, first_token)
+        print(f"Claude answered in {latency:.2f}s, first token after {first_token or latency:.2f}s")
+
+
+class FakeAnthropicClient:
+    """
+    A local stand-in for AnthropicClient that answers without any network request.
+
+    It answers every question with `response` (by default a short summary of the prompt),
+    streamed word by word with `delay` seconds between the deltas.
+    """
+
+    def __init__(self, api_key=None, response: str = None, delay: float = 0.0):
+        self.api_key = api_key
+        self.response = response
+        self.delay = delay
+        self.prompts = []
+
+    def _answer(self, docs, question) -> str:
+        self.prompts.append(build_prompt(docs, question))
+        if self.response is not None:
+            return self.response
+        return f"This is a fake answer to: {question}. The context had {len(docs)} characters."
+
+    def get_response(self, docs, question, model=DEFAULT_MODEL, max_tokens=DEFAULT_MAX_TOKENS):
+        return self._answer(docs, question)
+
+    async def stream_response(self, docs, question, model=DEFAULT_MODEL, max_tokens=DEFAULT_MAX_TOKENS) -> AsyncIterator[str]:
+        words = self._answer(docs, question).split(" ")
+        for i, word in enumerate(words):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield word if i == 0 else " " + word
+
+
+_clients: dict = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key=None):
+    """
+    Returns the process-wide Claude client for an API key (CLAUDE_API_KEY by default).
+
+    The kind of client is selected by the ANTHROPIC_CLIENT environment variable.
+    """
+    api_key = api_key or os.getenv("CLAUDE_API_KEY")
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = FakeAnthropicClient(api_key) if anthropic_client_kind == "fake" else AnthropicClient(api_key)
+        return _clients[api_key]
@@ -0,0 +1,182 @@
+# citation_index.py
+
+import csv
+import glob
+import numpy as np
+
+
+class CitationGraph:
+    """
+    Compact in-memory index over the `citations` table.
+
+    DOIs are interned to dense integer ids and the edges are stored twice in CSR form: once
+    grouped by the citing paper (`references`) and once grouped by the cited paper (`cited_by`).
+    Looking up the neighbours of a paper is a slice, so a traversal is linear in the number of
+    nodes and edges it visits instead of rescanning every citation per node.
+
+    Each edge keeps its position in the original record order, so neighbours are visited in the
+    same order as the rows of the table and the original citation dicts can be rebuilt.
+
+    Citations added after the build are kept in a small per-node delta on top of the CSR arrays
+    (see `add_citations`) and folded back in by `compact` once the delta grows too large.
+    `watermark` records the highest `citations.id` the graph reflects, if the table has one.
+    """
+
+    # Fold the delta back into the CSR arrays once it holds this fraction of all edges.
+    compact_ratio = 0.1
+
+    def __init__(self, sources: np.ndarray, citing: np.ndarray, dois: list[str], watermark: int = None) -> None:
+        self.dois: list[str] = dois
+        self.doi_to_id: dict[str, int] = {doi: i for i, doi in enumerate(dois)}
+        self.watermark: int = watermark
+        self._build(sources, citing)
+
+    def _build(self, sources: np.ndarray, citing: np.ndarray) -> None:
+        self.sources: np.ndarray = sources
+        self.citing: np.ndarray = citing
+        self._ref_indptr, self._ref_edges = self._build_csr(citing, len(self.dois))
+        self._cite_indptr, self._cite_edges = self._build_csr(sources, len(self.dois))
+        self._delta_sources: list[int] = []
+        self._delta_citing: list[int] = []
+        self._delta_refs: dict[int, list[int]] = {}
+        self._delta_cites: dict[int, list[int]] = {}
+
+    @staticmethod
+    def _build_csr(keys: np.ndarray, nbr_nodes: int) -> tuple[np.ndarray, np.ndarray]:
+        # A stable sort keeps the edges of each node in record order.
+        edges = np.argsort(keys, kind="stable").astype(np.int32)
+        indptr = np.zeros(nbr_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=nbr_nodes), out=indptr[1:])
+        return indptr, edges
+
+    @classmethod
+    def from_records(cls, citations: list[dict]) -> "CitationGraph":
+        """
+        Builds the index from citation records as returned by `_fetch_all_citations`.
+
+        Args:
+            citations (list[dict]): Records with the keys 'source_paper' and 'cited_by', and
+                                    optionally the table's 'id', which sets the watermark.
+        """
+        graph = cls.from_pairs((c["source_paper"], c["cited_by"]) for c in citations)
+        ids = [c["id"] for c in citations if c.get("id") is not None]
+        graph.watermark = max(ids) if ids else None
+        return graph
+
+    @classmethod
+    def from_pairs(cls, pairs) -> "CitationGraph":
+        """Builds the index from an iterable of (source_paper, cited_by) DOI pairs."""
+        doi_to_id = {}
+        sources, citing = [], []
+        for source_paper, cited_by in pairs:
+            if not source_paper or not cited_by:
+                continue
+            sources.append(doi_to_id.setdefault(source_paper, len(doi_to_id)))
+            citing.append(doi_to_id.setdefault(cited_by, len(doi_to_id)))
+        return cls(np.array(sources, dtype=np.int32), np.array(citing, dtype=np.int32), list(doi_to_id))
+
+    @classmethod
+    def from_csv(cls, pattern: str = "data/citation_connections_*.csv") -> "CitationGraph":
+        """
+        Builds the index from the citation shards written by `document_extraction/citation_search.py`.
+
+        Args:
+            pattern (str): Glob matching the shard files. Shards are read in sorted order.
+        """
+        def pairs():
+            for path in sorted(glob.glob(pattern)):
+                with open(path, newline="") as f:
+                    for row in csv.DictReader(f):
+                        yield row.get("source_paper"), row.get("cited_by")
+        return cls.from_pairs(pairs())
+
+    def __len__(self) -> int:
+        return len(self.dois)
+
+    @property
+    def nbr_citations(self) -> int:
+        return len(self.sources) + len(self._delta_sources)
+
+    def _intern(self, doi: str) -> int:
+        node = self.doi_to_id.get(doi)
+        if node is None:
+            node = self.doi_to_id[doi] = len(self.dois)
+            self.dois.append(doi)
+        return node
+
+    def add_citations(self, citations: list[dict]) -> int:
+        """
+        Applies new citation records to the graph without rebuilding it.
+
+        Args:
+            citations (list[dict]): Records with the keys 'source_paper' and 'cited_by', and
+                                    optionally 'id', which advances the watermark.
+
+        Returns:
+            int: The number of edges added.
+        """
+        added = 0
+        for c in citations:
+            if c.get("id") is not None:
+                self.watermark = c["id"] if self.watermark is None else max(self.watermark, c["id"])
+            if not c["source_paper"] or not c["cited_by"]:
+                continue
+            source, citing = self._intern(c["source_paper"]), self._intern(c["cited_by"])
+            edge = self.nbr_citations
+            self._delta_sources.append(source)
+            self._delta_citing.append(citing)
+            self._delta_refs.setdefault(citing, []).append(edge)
+            self._delta_cites.setdefault(source, []).append(edge)
+            added += 1
+
+        if len(self._delta_sources) > self.compact_ratio * max(len(self.sources), 1):
+            self.compact()
+        return added
+
+    def compact(self) -> None:
+        """Folds the delta edges into the CSR arrays."""
+        if not self._delta_sources:
+            return
+        self._build(
+            np.concatenate([self.sources, np.array(self._delta_sources, dtype=np.int32)]),
+            np.concatenate([self.citing, np.array(self._delta_citing, dtype=np.int32)]),
+        )
+
+    def _endpoints(self, edges: list[int]) -> tuple[list[int], list[int]]:
+        # Edge ids past the CSR arrays live in the delta.
+        n = len(self.sources)
+        sources = [self.sources[e] if e < n else self._delta_sources[e - n] for e in edges]
+        citing = [self.citing[e] if e < n else self._delta_citing[e - n] for e in edges]
+        return sources, citing
+
+    def references(self, node: int) -> list[tuple[int, int]]:
+        """Returns (edge, source_paper) pairs for the papers cited by `node`."""
+        if node < len(self._ref_indptr) - 1:
+            edges = self._ref_edges[self._ref_indptr[node]:self._ref_indptr[node + 1]].tolist()
+            pairs = list(zip(edges, self.sources[edges].tolist()))
+        else:
+            pairs = []
+        delta = self._delta_refs.get(node)
+        if delta:
+            pairs += zip(delta, self._endpoints(delta)[0])
+        return pairs
+
+    def cited_by(self, node: int) -> list[tuple[int, int]]:
+        """Returns (edge, cited_by) pairs for the papers citing `node`."""
+        if node < len(self._cite_indptr) - 1:
+            edges = self._cite_edges[self._cite_indptr[node]:self._cite_indptr[node + 1]].tolist()
+            pairs = list(zip(edges, self.citing[edges].tolist()))
+        else:
+            pairs = []
+        delta = self._delta_cites.get(node)
+        if delta:
+            pairs += zip(delta, self._endpoints(delta)[1])
+        return pairs
+
+    def citation(self, edge: int) -> dict:
+        """Rebuilds the citation record of an edge in the shape used by `_fetch_all_citations`."""
+        sources, citing = self._endpoints([edge])
+        return {
+            "source_paper": self.dois[sources[0]],
+            "cited_by": self.dois[citing[0]],
+        }
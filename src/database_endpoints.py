@@ -1,50 +1,50 @@
-from pgvector.asyncpg import register_vector
 import asyncio
-import asyncpg
-from google.cloud.sql.connector import Connector
+from citation_index import CitationGraph
+from collections import deque
+from database_indexes import search_params
+from database_pool import acquire, close_pool
+from embedding_cache import cache_embedding, get_cached_embedding
+from embedding_model import model_key
+from embedding_service import get_embedding_service
+from fuzzy_titles import FuzzyTitleIndex
+from latex_text import Chunk, get_chunk_cache
 import numpy as np
-import torch
-from transformers import AutoTokenizer, AutoModel
+from paper import Paper
 import os
+import time
+from tiered_cache import TieredCache
 from typing import Union
-
-tokenizer = AutoTokenizer.from_pretrained('jinaai/jina-embeddings-v3')
-model = AutoModel.from_pretrained('jinaai/jina-embeddings-v3', trust_remote_code=True)
-
-project_id = os.getenv("PROJECT_ID")
-database_password = os.getenv('DATABASE_PASSWORD')
-region = "us-central1"
-instance_name = "research-paper-db"
-database_name = "research-papers"
-database_user = os.getenv("DATABASE_USER")
-
-class Paper:
-    def __init__(self, doi, id:str=None, title:str=None, abstract:str=None, similarity:float=None, title_similarity:float=None, date:str=None, content:str=None) -> None:
-        self.id: str = id
-        self.doi: str = doi
-        self.title: str = title
-        self.abstract: str = abstract
-        self.similarity: float = similarity
-        self.title_similarity: float = title_similarity
-        self.date = date
-        self.content: str = content
-    
-    def from_dict(object: dict) -> None:
-        return Paper(doi=object.get('doi'),
-                       id=object.get('id', None),
-                       abstract=object.get('abstract', None),
-                       title=object.get('title', None),
-                       similarity=object.get('similarity', None),
-                       title_similarity=object.get('title_similarity', None),
-                       content=object.get('content', None),
-                       date=object.get('date', None)
-        )
-
-    def __str__(self) -> str:
-        return f"doi: {self.doi}"
-    
-    def __repr__(self):
-        return f"doi: {self.doi}, id: {self.id}, title: {self.title}\n"
+from text_search import SEARCH_VECTOR_SQL, LocalTextIndex
+from vector_search import LocalVectorIndex, VectorIndex
+
+# Optional glob of citation CSV shards to build the citation graph from instead of the database.
+citation_graph_csv = os.getenv("CITATION_GRAPH_CSV")
+# How often the cached citation graph is checked for new rows in the `citations` table.
+citation_refresh_interval = float(os.getenv("CITATION_REFRESH_SECONDS", "60"))
+_citation_graph: CitationGraph = None
+_citation_graph_checked: float = 0.0
+# Locks that let only one task at a time build or update shared state, see `_lock`.
+_locks: dict[str, tuple[asyncio.AbstractEventLoop, asyncio.Lock]] = {}
+
+# Similarity search backend, "pgvector" or "local" (see `get_vector_index`).
+vector_backend = os.getenv("VECTOR_BACKEND", "pgvector")
+local_vector_index_path = os.getenv("LOCAL_VECTOR_INDEX", "data/vector_index")
+_vector_index: VectorIndex = None
+_text_index: LocalTextIndex = None
+_fuzzy_title_index: FuzzyTitleIndex = None
+
+# How `get_papers` ranks papers, "vector" (embedding similarity) or "hybrid" (see `get_papers_hybrid`),
+# and the reciprocal rank fusion constant and number of candidates per signal of the hybrid mode.
+retrieval_mode = os.getenv("RETRIEVAL_MODE", "vector")
+hybrid_rrf_k = int(os.getenv("HYBRID_RRF_K", "60"))
+hybrid_candidates = int(os.getenv("HYBRID_CANDIDATES", "50"))
+# Fusion weights of the vector, full text, relevance and title similarity rankings, comma separated.
+hybrid_weights = tuple(float(w) for w in os.getenv("HYBRID_WEIGHTS", "1,1,0,0").split(","))
+
+# Upper bound on the estimated tokens of the paper passages put into the prompt.
+context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# Whether passage embeddings are kept in the `paper_chunks` table, None until first checked.
+_chunk_store_enabled: bool = None
 
 async def test_connection():
     """
@@ -60,43 +60,35 @@ async def test_connection():
     Example:
         await test_connection()
     """
-    loop = asyncio.get_running_loop()
-    # initialize Connector object as async context manager
-    async with Connector(loop=loop) as connector:
-        # create connection to Cloud SQL database
-        conn: asyncpg.Connection = await connector.connect_async(
-            f"{project_id}:{region}:{instance_name}",  # Cloud SQL instance connection name
-            "asyncpg",
-            user=f"{database_user}",
-            password=f"{database_password}",
-            db=f"{database_name}"
-            # ... additional database driver args
-        )
-
+    # borrow a connection from the shared pool
+    async with acquire() as conn:
         # query Cloud SQL database
         results = await conn.fetch("SELECT version()")
         print(results[0]["version"])
 
-        # close asyncpg connection
-        await conn.close()
-
-async def _fetch_similarity(embeding: np.ndarray, nbr_articles=3, DESC=True) -> list[Paper]:
+async def _fetch_similarity(embeding: np.ndarray, nbr_articles=6, DESC=True, offset=0, ef_search:int=None, probes:int=None) -> list[Paper]:
     """
     Fetch similar articles from the database based on a given embedding vector.
 
-    This method connects to a Cloud SQL database and retrieves a specified number
-    of articles that are most similar to the provided embedding. Similarity is 
-    calculated using cosine similarity over the vector embeddings stored in the 
-    'papers' table. 
+    This method retrieves a page of articles ranked by their similarity to the provided
+    embedding in a single query. Similarity is calculated using cosine similarity over the
+    vector embeddings stored in the 'papers' table. The query orders by the cosine distance
+    `embedding <=> $1` itself rather than by a computed alias, so it can be served by a
+    pgvector index, and pages are taken with LIMIT/OFFSET instead of re-running the scan.
 
     Parameters:
     - embedding (np.ndarray): The embedding vector representing the query article.
-    - nbr_articles (int, optional): The number of similar articles to retrieve. Default is 2.
+    - nbr_articles (int, optional): The number of similar articles to retrieve. Default is 6.
     - DESC (bool, optional): Whether to sort the results in descending order of similarity. 
                              Default is True.
+    - offset (int, optional): The number of top ranked articles to skip. Default is 0.
+    - ef_search (int, optional): hnsw.ef_search for this query, see `database_indexes.search_params`.
+                                 Raised to `offset + nbr_articles` when lower, so with an HNSW index
+                                 pages are complete up to the 1000th article.
+    - probes (int, optional): ivfflat.probes for this query, see `database_indexes.search_params`.
 
     Returns:
-    - List[dict]: A list of dictionaries, each containing the following keys:
+    - list[Paper]: The matched papers, with the following fields set:
         - "doi": Digital Object Identifier for the article.
         - "id": Identifier for the article.
         - "title": Title of the similar article.
@@ -105,66 +97,37 @@ async def _fetch_similarity(embeding: np.ndarray, nbr_articles=3, DESC=True) ->
         - "title_similarity": Similarity score based on title embeddings.
 
     Raises:
-    - Exception: If no results are found, an exception is raised indicating to adjust 
-                 the query parameters.
+    - Exception: If no results are found for the first page, an exception is raised indicating
+                 to adjust the query parameters. Later pages past the end return an empty list.
 
     Note:
     Ensure that the pgvector extension is registered for proper handling of vector 
     embeddings.
     """
-    loop = asyncio.get_running_loop()
-    async with Connector(loop=loop) as connector:
-        # Create connection to Cloud SQL database.
-        conn: asyncpg.Connection = await connector.connect_async(
-            f"{project_id}:{region}:{instance_name}",  # Cloud SQL instance connection name
-            "asyncpg",
-            user=f"{database_user}",
-            password=f"{database_password}",
-            db=f"{database_name}",
-        )
-
-        await register_vector(conn)
-        # Find similar products to the query using cosine similarity search
+    # The index scan must produce every row up to the end of the page, see `search_params`.
+    async with acquire() as conn, search_params(conn, ef_search=ef_search, probes=probes, min_rows=nbr_articles + offset):
+        # Find similar papers to the query using cosine similarity search
         # over all vector embeddings. This new feature is provided by `pgvector`.
-        results1 = await conn.fetch(
-            f"""
-            SELECT doi, id, title, 1 - (embedding <=> $1) AS similarity, abstract, 1 - (title_embedding <=> $1) AS title_similarity 
-            FROM papers
-            ORDER BY similarity {"DESC" if DESC else ""}
-            LIMIT $2
-            """,
-            embeding,
-            nbr_articles
-        )
-
-        results2 = await conn.fetch(
+        results = await conn.fetch(
             f"""
-
             SELECT doi, id, title, 1 - (embedding <=> $1) AS similarity, abstract, 
                 1 - (title_embedding <=> $1) AS title_similarity
             FROM papers
-            WHERE doi NOT IN (
-                SELECT doi
-                FROM papers
-                ORDER BY 1 - (embedding <=> $1) {"DESC" if DESC else ""}
-                LIMIT $2
-            )
-            ORDER BY similarity {"DESC" if DESC else ""}
-            LIMIT $2;
-
+            ORDER BY embedding <=> $1 {"" if DESC else "DESC"}
+            LIMIT $2 OFFSET $3
             """,
             embeding,
-            nbr_articles
+            nbr_articles,
+            offset
         )
 
-        if len(results1) + len(results2) == 0:
+        if len(results) == 0 and offset == 0:
             raise Exception("Did not find any results. Adjust the query parameters.")
         matches = []
-        for r in results1 + results2:
+        for r in results:
             # Collect the description for all the matched similar toy products.
             matches.append(Paper.from_dict(r))
 
-        await conn.close()
         return matches
     
 async def _fetch_similarity_from_list(embedding: np.ndarray, bois: list[str], DESC=True) -> list[Paper]:
@@ -189,18 +152,7 @@ async def _fetch_similarity_from_list(embedding: np.ndarray, bois: list[str], DE
         Exception: Raises an exception if no results are found.
     """
     if not bois: return []
-    loop = asyncio.get_running_loop()
-    async with Connector(loop=loop) as connector:
-        # Create connection to Cloud SQL database.
-        conn: asyncpg.Connection = await connector.connect_async(
-            f"{project_id}:{region}:{instance_name}",  # Cloud SQL instance connection name
-            "asyncpg",
-            user=f"{database_user}",
-            password=f"{database_password}",
-            db=f"{database_name}",
-        )
-
-        await register_vector(conn)
+    async with acquire() as conn:
         # Find similar products to the query using cosine similarity search
         # over all vector embeddings. This new feature is provided by `pgvector`.
         # Assuming `doi_list` is your list of DOI values to filter on
@@ -227,10 +179,73 @@ async def _fetch_similarity_from_list(embedding: np.ndarray, bois: list[str], DE
             # Collect the description for all the matched similar toy products.
             matches.append(Paper.from_dict(r))
 
-        await conn.close()
         return matches
 
-async def get_papers(query: str, nbr_of_dois:int=3) -> list[Paper]:
+class PgVectorIndex(VectorIndex):
+    """Similarity search served by pgvector in the `papers` table."""
+
+    async def search(self, embedding, k: int, offset: int = 0, ef_search: int = None, probes: int = None, **kwargs) -> list[Paper]:
+        return await _fetch_similarity(embedding, nbr_articles=k, DESC=True, offset=offset,
+                                       ef_search=ef_search, probes=probes)
+
+    async def similarity_for(self, embedding, dois: list[str]) -> list[Paper]:
+        return await _fetch_similarity_from_list(embedding, dois)
+
+def get_vector_index() -> VectorIndex:
+    """
+    Returns the similarity search backend selected by the VECTOR_BACKEND environment variable.
+
+    "pgvector" (the default) searches the database. "local" serves searches from the index
+    directory at LOCAL_VECTOR_INDEX (see `export_local_vector_index`) without any database
+    round-trip; it is loaded once and memory-mapped.
+    """
+    global _vector_index
+    if _vector_index is None:
+        if vector_backend == "local":
+            _vector_index = LocalVectorIndex.load(local_vector_index_path)
+        elif vector_backend == "pgvector":
+            _vector_index = PgVectorIndex()
+        else:
+            raise ValueError(f"Unknown VECTOR_BACKEND: {vector_backend}")
+    return _vector_index
+
+async def export_local_vector_index(path: str = None, dtype: str = "float16", nlist: int = None) -> LocalVectorIndex:
+    """
+    Exports the papers and their embeddings from the database into a local index directory.
+
+    Args:
+        path (str, optional): The index directory. Defaults to LOCAL_VECTOR_INDEX.
+        dtype (str, optional): The storage type of the embedding matrices. Defaults to "float16".
+        nlist (int, optional): If given, also trains an IVF quantizer with this many lists.
+
+    Returns:
+        LocalVectorIndex: The exported index, memory-mapped from disk.
+    """
+    path = path or local_vector_index_path
+    async with acquire() as conn:
+        results = await conn.fetch(
+            """
+            SELECT doi, id, title, abstract, relevance, embedding, title_embedding
+            FROM papers
+            WHERE embedding IS NOT NULL
+            ORDER BY doi
+            """
+        )
+
+    papers = [{"doi": r["doi"], "id": r["id"], "title": r["title"], "abstract": r["abstract"], "relevance": r["relevance"]}
+              for r in results]
+    embeddings = np.stack([r["embedding"] for r in results])
+    title_embeddings = None
+    if all(r["title_embedding"] is not None for r in results):
+        title_embeddings = np.stack([r["title_embedding"] for r in results])
+    LocalVectorIndex.save(path, papers, embeddings, title_embeddings, dtype=dtype)
+
+    index = LocalVectorIndex.load(path)
+    if nlist:
+        index.build_ivf(nlist, path=path)
+    return index
+
+async def get_papers(query: str, nbr_of_dois:int=3, page:int=0, offset:int=None, overfetch:int=2, ef_search:int=None, probes:int=None) -> list[Paper]:
     """
     Retrieve Papers of relevancy based on the provided query.
 
@@ -238,10 +253,21 @@ async def get_papers(query: str, nbr_of_dois:int=3) -> list[Paper]:
     that are relevant to the query. The function is designed to interface with a database or
     an external API that contains academic paper metadata.
 
+    Each call returns one page of `nbr_of_dois * overfetch` papers, fetched in a single
+    ordered query. With the defaults this is the top 6 papers, as before.
+
     Args:
         query (str): A search query string that specifies the topic or keywords to search for.
                      The query should be formulated in a way that is compatible with the underlying 
                      search mechanism (e.g., keyword-based search, boolean operators, etc.).
+        nbr_of_dois (int, optional): The number of papers wanted. Defaults to 3.
+        page (int, optional): The zero-based page of results to return. Defaults to 0.
+        offset (int, optional): The number of top ranked papers to skip. Overrides `page` when given.
+        overfetch (int, optional): How many times `nbr_of_dois` papers to return per page. Defaults to 2.
+        ef_search (int, optional): HNSW search breadth for this query. Defaults to VECTOR_EF_SEARCH.
+        probes (int, optional): IVFFlat lists probed for this query. Defaults to VECTOR_PROBES.
+
+    With RETRIEVAL_MODE=hybrid, papers are ranked by `get_papers_hybrid` with the HYBRID_WEIGHTS.
 
     Returns:
         list[Paper]: A list of instances of paper corresponding to the relevant papers found.
@@ -256,10 +282,145 @@ async def get_papers(query: str, nbr_of_dois:int=3) -> list[Paper]:
           API credentials) to perform the query.
         - This function may involve asynchronous operations depending on the implementation.
     """
+    page_size = nbr_of_dois * overfetch
+    if offset is None:
+        offset = page * page_size
+    if retrieval_mode == "hybrid":
+        vector_weight, text_weight, relevance_weight, title_weight = hybrid_weights
+        return await get_papers_hybrid(query, limit=page_size, offset=offset, vector_weight=vector_weight,
+                                       text_weight=text_weight, relevance_weight=relevance_weight,
+                                       title_weight=title_weight, ef_search=ef_search, probes=probes)
     query_embedding = await _get_embeding(query=query)
-    return await _fetch_similarity(query_embedding, nbr_articles=nbr_of_dois, DESC=True)
+    return await get_vector_index().search(query_embedding, page_size, offset=offset,
+                                           ef_search=ef_search, probes=probes)
+
+def _fuse_rankings(papers: dict[str, Paper], rankings: list[tuple[list[str], float]], rrf_k: int) -> list[Paper]:
+    """Scores papers by weighted reciprocal rank fusion: the sum of weight / (rrf_k + rank) over the rankings."""
+    for paper in papers.values():
+        paper.hybrid_score = 0.0
+    for ranking, weight in rankings:
+        if weight:
+            for rank, doi in enumerate(ranking, start=1):
+                papers[doi].hybrid_score += weight / (rrf_k + rank)
+    return sorted(papers.values(), key=lambda p: (-p.hybrid_score, p.doi))
+
+async def _hybrid_local(query: str, embedding: np.ndarray, candidates: int, weights: tuple, rrf_k: int) -> list[Paper]:
+    vector_index, text_index = get_vector_index(), get_text_index()
+    vector_hits = await vector_index.search(embedding, candidates)
+    text_hits = text_index.search(query, candidates)
+    text_ranks = {text_index.papers[row]["doi"]: score for row, score in text_hits}
+
+    papers = {p.doi: p for p in vector_hits}
+    missing = [doi for doi in text_ranks if doi not in papers]
+    papers.update({p.doi: p for p in await vector_index.similarity_for(embedding, missing)})
+    for paper in papers.values():
+        paper.text_rank = text_ranks.get(paper.doi)
+        paper.relevance = vector_index.papers[vector_index.doi_to_row[paper.doi]].get("relevance")
+
+    by_relevance = sorted(papers, key=lambda d: (papers[d].relevance is None, -(papers[d].relevance or 0)))
+    by_title = sorted(papers, key=lambda d: (papers[d].title_similarity is None, -(papers[d].title_similarity or 0)))
+    return _fuse_rankings(papers, [
+        ([p.doi for p in vector_hits], weights[0]),
+        (list(text_ranks), weights[1]),
+        (by_relevance, weights[2]),
+        (by_title, weights[3]),
+    ], rrf_k)
+
+async def get_papers_hybrid(query: str, limit: int = 6, offset: int = 0, vector_weight: float = 1.0, text_weight: float = 1.0,
+                            relevance_weight: float = 0.0, title_weight: float = 0.0, candidates: int = None,
+                            rrf_k: int = None, ef_search: int = None, probes: int = None) -> list[Paper]:
+    """
+    Retrieves papers by fusing embedding similarity with full text search (and optionally other signals).
+
+    The top `candidates` papers by embedding similarity and the top `candidates` papers by full
+    text rank are retrieved, then merged with weighted reciprocal rank fusion: every paper
+    scores `weight / (rrf_k + rank)` for each ranking it appears in. The `relevance` (PageRank)
+    and `title_similarity` of the candidates can be fused in as extra rankings. Rank fusion needs
+    no calibration between the very differently scaled signals.
+
+    With pgvector, both candidate queries, the fusion and the pagination run in a single SQL
+    statement, so this is one database round-trip. With VECTOR_BACKEND=local, the same fusion
+    is done in memory over the local vector and text indexes.
+
+    Args:
+        query (str): The search query, embedded for similarity and parsed as web search syntax
+                     for full text search.
+        limit (int, optional): The page size. Defaults to 6.
+        offset (int, optional): The number of top ranked papers to skip. Defaults to 0.
+        vector_weight (float, optional): Weight of the embedding similarity ranking. Defaults to 1.
+        text_weight (float, optional): Weight of the full text ranking. Defaults to 1.
+        relevance_weight (float, optional): Weight of the ranking by stored relevance. Defaults to 0.
+        title_weight (float, optional): Weight of the ranking by title similarity. Defaults to 0.
+        candidates (int, optional): Candidates retrieved per signal. Defaults to HYBRID_CANDIDATES.
+        rrf_k (int, optional): The fusion constant, larger values flatten the rank differences.
+                               Defaults to HYBRID_RRF_K.
+        ef_search (int, optional): HNSW search breadth for the vector candidates. Raised to the
+                                   number of candidates when lower (up to 1000).
+        probes (int, optional): IVFFlat lists probed for the vector candidates.
+
+    Returns:
+        list[Paper]: One page of papers by decreasing `hybrid_score`, each with its `similarity`,
+                     `title_similarity`, `text_rank` (None without a text match) and `relevance`.
+    """
+    candidates = max(candidates or hybrid_candidates, limit + offset)
+    rrf_k = rrf_k or hybrid_rrf_k
+    weights = (vector_weight, text_weight, relevance_weight, title_weight)
+    embedding = await _get_embeding(query=query)
+
+    if vector_backend == "local":
+        papers = await _hybrid_local(query, embedding, candidates, weights, rrf_k)
+        return papers[offset:offset + limit]
+
+    async with acquire() as conn:
+        # The HNSW scan of the vector candidates must reach all of them, see `search_params`.
+        async with search_params(conn, ef_search=ef_search, probes=probes, min_rows=candidates):
+            results = await conn.fetch(
+                f"""
+                WITH vector_hits AS (
+                    SELECT doi, row_number() OVER (ORDER BY distance, doi) AS vector_position
+                    FROM (
+                        SELECT doi, embedding <=> $1 AS distance
+                        FROM papers
+                        ORDER BY embedding <=> $1
+                        LIMIT $3
+                    ) AS v
+                ),
+                text_hits AS (
+                    SELECT doi, text_rank, row_number() OVER (ORDER BY text_rank DESC, doi) AS text_position
+                    FROM (
+                        SELECT doi, ts_rank_cd({SEARCH_VECTOR_SQL}, q) AS text_rank
+                        FROM papers, websearch_to_tsquery('english', $2) AS q
+                        WHERE {SEARCH_VECTOR_SQL} @@ q
+                        ORDER BY text_rank DESC, doi
+                        LIMIT $3
+                    ) AS t
+                ),
+                candidates AS (
+                    SELECT doi, p.id, p.title, p.abstract, p.relevance, h.vector_position, h.text_position, h.text_rank,
+                        1 - (p.embedding <=> $1) AS similarity, 1 - (p.title_embedding <=> $1) AS title_similarity
+                    FROM (vector_hits FULL OUTER JOIN text_hits USING (doi)) AS h
+                    JOIN papers AS p USING (doi)
+                ),
+                scored AS (
+                    SELECT *,
+                        coalesce($5::float8 / ($4::float8 + vector_position), 0)
+                        + coalesce($6::float8 / ($4::float8 + text_position), 0)
+                        + $7::float8 / ($4::float8 + row_number() OVER (ORDER BY relevance DESC NULLS LAST, doi))
+                        + $8::float8 / ($4::float8 + row_number() OVER (ORDER BY title_similarity DESC NULLS LAST, doi))
+                        AS hybrid_score
+                    FROM candidates
+                )
+                SELECT doi, id, title, abstract, relevance, similarity, title_similarity, text_rank, hybrid_score
+                FROM scored
+                ORDER BY hybrid_score DESC, doi
+                LIMIT $9 OFFSET $10
+                """,
+                embedding, query, candidates, rrf_k, *weights, limit, offset
+            )
 
-async def _get_embeding(query: str) -> torch.Tensor:
+    return [Paper.from_dict(r) for r in results]
+
+async def _get_embeding(query: str) -> np.ndarray:
     """
     Embed a query sentence using the Jina embedding model.
 
@@ -287,24 +448,21 @@ async def _get_embeding(query: str) -> torch.Tensor:
         (768,)
 
     Notes:
-        - Ensure that the Jina embedding model is properly initialized and accessible before 
-          calling this function.
+        - The Jina embedding model is loaded on the first call (see `embedding_model`) unless
+          it has been prewarmed.
         - This function is asynchronous and should be awaited in an asynchronous context.
+        - Embeddings are cached by normalized query text, model and task (see `embedding_cache`),
+          so repeated queries skip the forward pass. The returned array is read-only.
     """
-    # Tokenize the input text
-    inputs = tokenizer(query, return_tensors='pt', padding=True, truncation=True)
-
-    # Forward pass to get the embeddings
-    with torch.no_grad():
-        outputs = model(**inputs, task="retrieval.query")
-
-    # Extract the last hidden states (embeddings)
-    last_hidden_states = outputs.last_hidden_state
+    task = "retrieval.query"
+    cached = get_cached_embedding(query, model_key(), task)
+    if cached is not None:
+        return cached
 
-    # Optionally, get the embeddings for the [CLS] token
-    cls_embedding = last_hidden_states[:, 0, :]
+    # Embed the query on the embedding service's worker thread, batched with concurrent queries
+    cls_embedding = await get_embedding_service().embed(query, task=task)
 
-    return cls_embedding[0]
+    return cache_embedding(query, model_key(), task, cls_embedding)
 
 async def _fetch_all_citations():
     """
@@ -318,6 +476,8 @@ async def _fetch_all_citations():
         list[dict]: A list of dictionaries, each representing a citation record with the following keys:
             - 'source_paper' (str): The DOI of the paper being cited.
             - 'cited_by' (str): The DOI of the paper that cites the source paper.
+            - 'id' (int): The row's change-tracking id, or None if the table has not been
+                          migrated with `ensure_citation_tracking`.
 
     If no citation records are found, the function returns an empty list.
 
@@ -325,17 +485,7 @@ async def _fetch_all_citations():
         This function uses the pgvector extension to enable advanced vector operations,
         although it does not perform any vector-based queries in this implementation.
     """
-    loop = asyncio.get_running_loop()
-    async with Connector(loop=loop) as connector:
-        # Create connection to Cloud SQL database.
-        conn: asyncpg.Connection = await connector.connect_async(
-            f"{project_id}:{region}:{instance_name}",  # Cloud SQL instance connection name
-            "asyncpg",
-            user=f"{database_user}",
-            password=f"{database_password}",
-            db=f"{database_name}",
-        )
-
+    async with acquire() as conn:
         results = await conn.fetch(
             """
             SELECT *
@@ -352,59 +502,164 @@ async def _fetch_all_citations():
                 {
                     "source_paper": r["source_paper"],
                     "cited_by": r["cited_by"],
+                    "id": r.get("id"),
                 }
             )
 
-        await conn.close()
         return matches
 
-def _bfs(dois: list[str], citations: list[dict], max_papers=17) -> Union[list[str], list[dict]]:
+async def _fetch_citations_since(watermark: int) -> Union[list[dict], int]:
+    """
+    Fetches the citation records added after a change-tracking watermark.
+
+    Args:
+        watermark (int): The highest `citations.id` already applied to the in-memory graph.
+
+    Returns:
+        list[dict]: The new citation records, in insertion order, with the keys 'source_paper',
+                    'cited_by' and 'id'.
+        int: The number of non-empty citation rows currently in the table, used to detect drift
+             (deleted rows, or rows committed out of id order) between the table and the graph.
+    """
+    async with acquire() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            results = await conn.fetch(
+                """
+                SELECT id, source_paper, cited_by
+                FROM citations
+                WHERE id > $1
+                ORDER BY id
+                """,
+                watermark
+            )
+            total = await conn.fetchval(
+                """
+                SELECT count(*)
+                FROM citations
+                WHERE source_paper <> '' AND cited_by <> ''
+                """
+            )
+
+        return [dict(r) for r in results], total
+
+async def ensure_citation_tracking():
+    """
+    Adds the change-tracking column the incremental citation graph refresh relies on.
+
+    Every citation row gets a monotonically increasing `id`, including rows that already exist,
+    so the app can fetch only the rows added after the last refresh. This is idempotent and is
+    meant to be run once after deploying, before loading new citation shards.
+    """
+    async with acquire() as conn:
+        await conn.execute("ALTER TABLE citations ADD COLUMN IF NOT EXISTS id BIGSERIAL")
+        await conn.execute("CREATE INDEX IF NOT EXISTS citations_id_idx ON citations (id)")
+
+def _bfs(dois: list[str], graph: CitationGraph, max_papers=17) -> Union[list[str], list[dict]]:
     """
     Performs a breadth-first search (BFS) to explore related papers based on citations.
 
-    This function takes a list of base of interest (BOI) papers and a list of citation data to find
-    additional papers that are cited by or cite the BOI papers. The search continues until it reaches 
-    a specified maximum number of papers.
+    This function takes a list of base of interest (BOI) papers and the citation graph index to find
+    additional papers that are cited by or cite the BOI papers. It first walks the references of the
+    BOI papers (the work they are based on) and then the papers citing them (future work), until it
+    reaches a specified maximum number of papers. Each edge is visited at most once per direction, so
+    the search is linear in the size of the explored part of the graph.
 
     Parameters:
-    - bois (list[str]): A list of DOIs (or identifiers) representing the base papers of interest.
-    - citations (list[dict]): A list of citation records, where each record is a dictionary containing:
-        - 'cited_by' (str): The DOI of the paper that is citing another paper.
-        - 'source_paper' (str): The DOI of the paper being cited.
+    - dois (list[str]): A list of DOIs representing the base papers of interest.
+    - graph (CitationGraph): The in-memory citation index, see `_get_citation_graph`.
     - max_papers (int): The maximum number of papers to return, including the base papers and 
-                        their related papers. Default is 10.
+                        their related papers. Default is 17.
 
     Returns:
-    - list[str]: A list of DOIs representing the base papers and any additional papers found 
-                 through citations, up to the maximum specified.
+    - list[str]: A list of DOIs of the papers found through citations, excluding the base papers.
+    - list[dict]: The citation records that were followed, with the keys 'source_paper' and 'cited_by'.
 
     Note:
     The search stops once the total number of identified papers reaches the `max_papers` limit.
     """
-    based_on = set(dois)
-    future_work = set(dois)
-    queue = [i for i in dois]
+    seeds = [graph.doi_to_id[doi] for doi in dict.fromkeys(dois) if doi in graph.doi_to_id]
+    # Base papers that are not in the graph still count towards the limit.
+    nbr_base = len(set(dois))
+    based_on = set(seeds)
+    future_work = set(seeds)
     citations_utalized = []
-    for boi in queue:
-        for citation in citations:
-            if citation['cited_by'] == boi and citation['source_paper'] not in based_on:
-                queue.append(citation['source_paper'])
-                based_on.add(citation['source_paper'])
-                citations_utalized.append(citation)
-            if len(dois) + len(based_on) >= max_papers: break
-        if len(dois) + len(based_on) >= max_papers: break
-
-    queue = [i for i in dois]
-    for boi in queue:
-        for citation in citations:
-            if citation['source_paper'] == boi  and citation['cited_by'] not in future_work:
-                queue.append(citation['cited_by'])
-                future_work.add(citation['cited_by'])
-                citations_utalized.append(citation)
-            if len(dois) + len(based_on) + len(future_work) >= max_papers: break
-        if len(dois) + len(based_on) + len(future_work) >= max_papers: break
-        
-    return list(set(list(based_on) + list(future_work)).difference(set(dois))), citations_utalized
+
+    def traverse(neighbours, visited: set, is_full) -> None:
+        queue = deque(seeds)
+        while queue and not is_full():
+            for edge, paper in neighbours(queue.popleft()):
+                if paper in visited:
+                    continue
+                queue.append(paper)
+                visited.add(paper)
+                citations_utalized.append(graph.citation(edge))
+                if is_full(): return
+
+    traverse(graph.references, based_on,
+             lambda: len(dois) + nbr_base + len(based_on) - len(seeds) >= max_papers)
+    traverse(graph.cited_by, future_work,
+             lambda: len(dois) + 2 * (nbr_base - len(seeds)) + len(based_on) + len(future_work) >= max_papers)
+
+    related = (based_on | future_work).difference(seeds)
+    return [graph.dois[i] for i in related], citations_utalized
+
+def _lock(name: str) -> asyncio.Lock:
+    """
+    Returns the lock called `name` for the running event loop.
+
+    An asyncio.Lock can only be used on one event loop, so a new one is created when the lock is
+    requested from another loop (for example after `asyncio.run` started a new one).
+    """
+    loop = asyncio.get_running_loop()
+    owner, lock = _locks.get(name, (None, None))
+    if owner is not loop:
+        lock = asyncio.Lock()
+        _locks[name] = (loop, lock)
+    return lock
+
+def _citation_graph_stale() -> bool:
+    return (not citation_graph_csv and _citation_graph.watermark is not None
+            and time.monotonic() - _citation_graph_checked >= citation_refresh_interval)
+
+async def _get_citation_graph() -> CitationGraph:
+    """
+    Returns the in-memory citation graph index, building it on first use.
+
+    The index is built once per process, from the `citations` table or, when the CITATION_GRAPH_CSV
+    environment variable holds a glob, from the `data/citation_connections_*.csv` shards. A graph
+    built from the table is kept in sync by `_refresh_citation_graph` at most every
+    CITATION_REFRESH_SECONDS. Concurrent callers wait for a build or refresh already in progress
+    instead of starting their own.
+    """
+    global _citation_graph, _citation_graph_checked
+    if _citation_graph is not None and not _citation_graph_stale():
+        return _citation_graph
+    async with _lock("citation_graph"):
+        # Another task may have built or refreshed the graph while this one was waiting.
+        if _citation_graph is None:
+            if citation_graph_csv:
+                _citation_graph = CitationGraph.from_csv(citation_graph_csv)
+            else:
+                _citation_graph = CitationGraph.from_records(await _fetch_all_citations())
+            _citation_graph_checked = time.monotonic()
+        elif _citation_graph_stale():
+            _citation_graph_checked = time.monotonic()
+            await _refresh_citation_graph()
+    return _citation_graph
+
+async def _refresh_citation_graph() -> None:
+    """
+    Applies the citations added since the graph's watermark as deltas.
+
+    Only the new rows are read. If the table then holds a different number of citations than the
+    graph, rows were deleted or committed out of id order, and the graph is rebuilt from scratch.
+    """
+    global _citation_graph
+    new_citations, total = await _fetch_citations_since(_citation_graph.watermark)
+    _citation_graph.add_citations(new_citations)
+    if total != _citation_graph.nbr_citations:
+        print(f"Citation graph drifted ({_citation_graph.nbr_citations} edges, {total} rows), rebuilding")
+        _citation_graph = CitationGraph.from_records(await _fetch_all_citations())
     
 async def get_related_papers(query, papers: list[Paper]) -> Union[list[Paper], list[dict]]:
     """
@@ -423,71 +678,304 @@ async def get_related_papers(query, papers: list[Paper]) -> Union[list[Paper], l
                     or are cited by them.
 
     Note:
-        This function calls an internal BFS function (_bfs) and fetches all
-        citation data from the database using the _fetch_all_citations function.
+        This function calls an internal BFS function (_bfs) over the cached citation
+        graph index, which is only loaded from the database on first use.
     """
     dois = [p.doi for p in papers]
     embedding = await _get_embeding(query)
-    citations = await _fetch_all_citations()
-    dois, used_citations = _bfs(dois, citations)
-    papers_bfs = await _fetch_similarity_from_list(embedding, dois)
+    graph = await _get_citation_graph()
+    dois, used_citations = _bfs(dois, graph)
+    papers_bfs = await get_vector_index().similarity_for(embedding, dois)
     papers_bfs.sort(key=lambda p: p.similarity)
     return papers + papers_bfs , used_citations
 
-async def fetch_substring_match(query: str) -> list[Paper]:
+async def ensure_chunk_table():
+    """
+    Creates the `paper_chunks` table the passage embeddings of full texts are stored in.
+
+    Each row is one chunk of a paper (see `latex_text.prepare_document`) with its embedding.
+    `source_hash` identifies the chunked text and the embedding model, so the chunks of a paper
+    are re-embedded when either changes. This is idempotent.
+    """
+    async with acquire() as conn:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS paper_chunks (
+                doi TEXT REFERENCES papers(doi) ON DELETE CASCADE,
+                chunk_index INTEGER,
+                section TEXT,
+                content TEXT,
+                tokens INTEGER,
+                source_hash TEXT,
+                embedding vector(1024),
+                PRIMARY KEY (doi, chunk_index)
+            )
+            """
+        )
+
+async def _chunk_store_available() -> bool:
+    """
+    Whether the `paper_chunks` table can be used, creating it on first use.
+
+    With another backend than pgvector, or once the table failed to be created or accessed,
+    passage embeddings are only kept in the chunk cache for the rest of the process. The papers
+    of a query check this concurrently, so the table is created under a lock, exactly once.
+    """
+    global _chunk_store_enabled
+    if _chunk_store_enabled is not None:
+        return _chunk_store_enabled
+    async with _lock("chunk_store"):
+        if _chunk_store_enabled is None:
+            if vector_backend != "pgvector":
+                _chunk_store_enabled = False
+            else:
+                try:
+                    await ensure_chunk_table()
+                    _chunk_store_enabled = True
+                except Exception as e:
+                    _disable_chunk_store(e)
+    return _chunk_store_enabled
+
+def _disable_chunk_store(error: Exception) -> None:
+    global _chunk_store_enabled
+    if _chunk_store_enabled is not False:
+        print(f"Passage embeddings are not stored in paper_chunks: {error}")
+    _chunk_store_enabled = False
+
+async def _fetch_chunk_embeddings(doi: str, source_hash: str, nbr_chunks: int) -> np.ndarray:
+    async with acquire() as conn:
+        results = await conn.fetch(
+            """
+            SELECT embedding
+            FROM paper_chunks
+            WHERE doi = $1 AND source_hash = $2
+            ORDER BY chunk_index
+            """,
+            doi, source_hash
+        )
+    if len(results) != nbr_chunks:
+        return None
+    return np.stack([r["embedding"] for r in results]).astype(np.float32)
+
+async def _store_chunk_embeddings(doi: str, source_hash: str, chunks: list[Chunk], embeddings: np.ndarray) -> None:
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM paper_chunks WHERE doi = $1", doi)
+            await conn.executemany(
+                """
+                INSERT INTO paper_chunks (doi, chunk_index, section, content, tokens, source_hash, embedding)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+                """,
+                [(doi, c.index, c.section, c.text, c.tokens, source_hash, e) for c, e in zip(chunks, embeddings)]
+            )
+
+async def get_chunk_embeddings(doi: str, chunks: list[Chunk]) -> np.ndarray:
+    """
+    Returns the passage embeddings of the chunks of a paper, one row per chunk.
+
+    They are looked up in the chunk cache, then in the `paper_chunks` table (pgvector backend
+    only, see `_chunk_store_available`), and embedded with the "retrieval.passage" task only
+    if neither has them.
+    """
+    source_hash = TieredCache.make_key("chunk_embeddings", model_key(), *(c.text for c in chunks))
+    cache = get_chunk_cache()
+    embeddings = cache.get(source_hash)
+    if embeddings is not None:
+        return embeddings
+
+    if await _chunk_store_available():
+        try:
+            embeddings = await _fetch_chunk_embeddings(doi, source_hash, len(chunks))
+        except Exception as e:
+            _disable_chunk_store(e)
+    if embeddings is None:
+        service = get_embedding_service()
+        embeddings = np.stack(await asyncio.gather(*(service.embed(c.text, task="retrieval.passage") for c in chunks)))
+        if await _chunk_store_available():
+            try:
+                await _store_chunk_embeddings(doi, source_hash, chunks, embeddings)
+            except Exception as e:
+                _disable_chunk_store(e)
+    cache.set(source_hash, embeddings)
+    return embeddings
+
+async def get_relevant_passages(query: str, papers: list[Paper], chunks: dict[str, list[Chunk]], token_budget: int = None) -> dict[str, list[Chunk]]:
+    """
+    Selects the passages of the fetched papers that are most relevant to the query.
+
+    Every chunk is scored by the cosine similarity of its passage embedding to the query
+    embedding, and the best chunks are taken until the token budget is used up. The size of
+    the prompt is therefore bounded by the budget, not by the length of the papers.
+
+    Args:
+        query (str): The question of the user.
+        papers (list[Paper]): The papers the chunks belong to, in ranking order.
+        chunks (dict[str, list[Chunk]]): The chunks of each paper keyed by paper id, as returned
+                                         by `latex_text.prepare_documents`.
+        token_budget (int, optional): The maximum estimated tokens of all selected passages.
+                                      Defaults to CONTEXT_TOKEN_BUDGET.
+
+    Returns:
+        dict[str, list[Chunk]]: The selected chunks keyed by paper id. Papers keep their ranking
+                                order and chunks their reading order. Papers without any
+                                selected chunk are left out.
+    """
+    token_budget = token_budget or context_token_budget
+    papers = [p for p in papers if chunks.get(p.id)]
+    if not papers:
+        return {}
+    query_embedding = await _get_embeding(query)
+    embeddings = await asyncio.gather(*(get_chunk_embeddings(p.doi, chunks[p.id]) for p in papers))
+
+    query_embedding = query_embedding / np.linalg.norm(query_embedding)
+    scored = []
+    for paper, paper_embeddings in zip(papers, embeddings):
+        similarities = paper_embeddings @ query_embedding / np.maximum(np.linalg.norm(paper_embeddings, axis=1), 1e-12)
+        scored.extend(zip(similarities.tolist(), chunks[paper.id]))
+    scored.sort(key=lambda s: -s[0])
+
+    selected = set()
+    remaining = token_budget
+    for _, chunk in scored:
+        if chunk.tokens <= remaining:
+            selected.add((chunk.paper_id, chunk.index))
+            remaining -= chunk.tokens
+
+    passages = {}
+    for paper in papers:
+        paper_passages = [c for c in chunks[paper.id] if (c.paper_id, c.index) in selected]
+        if paper_passages:
+            passages[paper.id] = paper_passages
+    return passages
+
+def get_text_index() -> LocalTextIndex:
+    """Returns the in-memory text index over the papers of the local vector index, built on first use."""
+    global _text_index
+    if _text_index is None:
+        _text_index = LocalTextIndex(get_vector_index().papers)
+    return _text_index
+
+def _escape_like(query: str) -> str:
+    return query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+async def fetch_substring_match(query: str, limit: int = 50, offset: int = 0) -> list[Paper]:
     """
     Fetches all papers from the database that have a title containing a specific substring.
 
-    This method establishes an asynchronous connection to the Cloud SQL database, 
-    executes a query to find all entries in the `papers` table where the `title` 
-    column contains the specified substring (case-insensitive). The results are 
-    returned as a list of `Paper` objects.
+    This method executes a query to find all entries in the `papers` table where the `title`
+    column contains the specified substring (case-insensitive). The substring is passed as a
+    query parameter and matched literally, and the match is served by the trigram index (see
+    `database_indexes.create_text_indexes`). The results are returned as a list of `Paper` objects.
+    With VECTOR_BACKEND=local, the titles are searched in memory instead (see `get_text_index`).
 
     Args:
         query (str): The substring to search for in the title of the papers.
+        limit (int, optional): The page size. Defaults to 50.
+        offset (int, optional): The number of matches to skip. Defaults to 0.
 
     Returns:
-        list[Paper]: A list of `Paper` objects that match the query. 
+        list[Paper]: One page of the `Paper` objects that match the query, by decreasing relevance.
                      Returns an empty list if no matches are found.
 
     Raises:
         Exception: Any exceptions related to database connection or query execution 
                    will propagate to the caller.
     """
-    loop = asyncio.get_running_loop()
-    async with Connector(loop=loop) as connector:
-        # Create connection to Cloud SQL database.
-        conn: asyncpg.Connection = await connector.connect_async(
-            f"{project_id}:{region}:{instance_name}",  # Cloud SQL instance connection name
-            "asyncpg",
-            user=f"{database_user}",
-            password=f"{database_password}",
-            db=f"{database_name}",
+    if not query:
+        return []
+    if vector_backend == "local":
+        index = get_text_index()
+        return [Paper.from_dict(index.papers[row]) for row in index.substring(query, limit, offset)]
+
+    async with acquire() as conn:
+        results = await conn.fetch(
+            """
+            SELECT doi, id, title, abstract
+            FROM papers
+            WHERE title ILIKE $1 ESCAPE '\\'
+            ORDER BY relevance DESC NULLS LAST, doi
+            LIMIT $2 OFFSET $3
+            """,
+            f"%{_escape_like(query)}%", limit, offset
         )
 
-        await register_vector(conn)
-        # Find similar products to the query using cosine similarity search
-        # over all vector embeddings. This new feature is provided by `pgvector`.
+    return [Paper.from_dict(r) for r in results]
+
+async def fetch_full_text_match(query: str, limit: int = 50, offset: int = 0) -> list[Paper]:
+    """
+    Searches the titles and abstracts of the papers for the words of a query, best matches first.
+
+    The query accepts web search syntax ("quoted phrases", OR, -excluded words) and is matched
+    against the weighted title and abstract `tsvector`, served by its GIN index (see
+    `database_indexes.create_text_indexes`). Matches are ranked with `ts_rank_cd`, title words
+    weighing more than abstract words. With VECTOR_BACKEND=local, the papers are ranked by BM25
+    in memory instead (see `get_text_index`).
+
+    Args:
+        query (str): The words to search for.
+        limit (int, optional): The page size. Defaults to 50.
+        offset (int, optional): The number of matches to skip. Defaults to 0.
+
+    Returns:
+        list[Paper]: One page of matching papers, with their score in `text_rank`.
+    """
+    if not query:
+        return []
+    if vector_backend == "local":
+        index = get_text_index()
+        return [Paper.from_dict({**index.papers[row], "text_rank": score}) for row, score in index.search(query, limit, offset)]
+
+    async with acquire() as conn:
         results = await conn.fetch(
             f"""
-            SELECT *
-            FROM papers
-            WHERE title ILIKE '%{query}%'
-            ORDER BY relevance DESC;
-            """
+            SELECT doi, id, title, abstract, ts_rank_cd({SEARCH_VECTOR_SQL}, q) AS text_rank
+            FROM papers, websearch_to_tsquery('english', $1) AS q
+            WHERE {SEARCH_VECTOR_SQL} @@ q
+            ORDER BY text_rank DESC, doi
+            LIMIT $2 OFFSET $3
+            """,
+            query, limit, offset
         )
 
-        if len(results) == 0:
-            return []
-        matches = []
-        for r in results:
-            # Collect the description for all the matched similar toy products.
-            matches.append(
-                Paper.from_dict(r)
-            )
+    return [Paper.from_dict(r) for r in results]
 
-        await conn.close()
-        return matches
+async def get_fuzzy_title_index() -> FuzzyTitleIndex:
+    """
+    Returns the in-memory fuzzy title index, built on first use.
+
+    With VECTOR_BACKEND=local it indexes the papers of the local vector index, otherwise the
+    titles, abstracts and relevance of all papers are fetched once from the database.
+    """
+    global _fuzzy_title_index
+    if _fuzzy_title_index is None:
+        if vector_backend == "local":
+            papers = get_vector_index().papers
+        else:
+            async with acquire() as conn:
+                results = await conn.fetch("SELECT doi, id, title, abstract, relevance FROM papers")
+            papers = [dict(r) for r in results]
+        _fuzzy_title_index = FuzzyTitleIndex(papers)
+    return _fuzzy_title_index
+
+async def fetch_fuzzy_title_match(query: str, limit: int = 50, offset: int = 0) -> list[Paper]:
+    """
+    Finds the papers whose title approximately matches a query, tolerating typos and accents.
+
+    The matching runs in memory on `get_fuzzy_title_index`, so after the index is built a
+    search costs no database round-trip.
+
+    Args:
+        query (str): The approximate title, or part of it.
+        limit (int, optional): The page size. Defaults to 50.
+        offset (int, optional): The number of matches to skip. Defaults to 0.
+
+    Returns:
+        list[Paper]: One page of matching papers, best first, with their similarity (0-100) in `text_rank`.
+    """
+    if not query:
+        return []
+    index = await get_fuzzy_title_index()
+    return [Paper.from_dict({**index.papers[row], "text_rank": score}) for row, score in index.search(query, limit, offset)]
 
 async def main():
     await test_connection()
@@ -500,6 +988,7 @@ async def main():
     # print(related)
     res = await fetch_substring_match(query)
     print(res)
+    await close_pool()
 
 if __name__ == "__main__":
     # Run the main function
@@ -1,22 +1,13 @@
-from pgvector.asyncpg import register_vector
 import asyncio
-import asyncpg
-from google.cloud.sql.connector import Connector
+# The citation graph is cached and kept up to date by `database_endpoints`, shared with this module.
+from database_endpoints import _bfs, _get_citation_graph
+from database_pool import acquire, close_pool
+from embedding_cache import cache_embedding, get_cached_embedding
+from embedding_model import model_key
+from embedding_service import get_embedding_service
 import numpy as np
-import torch
-from transformers import AutoTokenizer, AutoModel
-import os
 from typing import Union
 
-tokenizer = AutoTokenizer.from_pretrained('jinaai/jina-embeddings-v3')
-model = AutoModel.from_pretrained('jinaai/jina-embeddings-v3', trust_remote_code=True)
-
-project_id = os.getenv("PROJECT_ID")
-database_password = os.getenv('DATABASE_PASSWORD')
-region = "us-central1"
-instance_name = "research-paper-db"
-database_name = "research-papers"
-database_user = os.getenv("DATABASE_USER")
 
 class Paper:
     def __init__(self, doi, id:str=None, title:str=None, abstract:str=None, similarity:float=None, title_similarity:float=None, date:str=None, content:str=None) -> None:
@@ -49,43 +40,31 @@ async def test_connection():
     Example:
         await test_connection()
     """
-    loop = asyncio.get_running_loop()
-    # initialize Connector object as async context manager
-    async with Connector(loop=loop) as connector:
-        # create connection to Cloud SQL database
-        conn: asyncpg.Connection = await connector.connect_async(
-            f"{project_id}:{region}:{instance_name}",  # Cloud SQL instance connection name
-            "asyncpg",
-            user=f"{database_user}",
-            password=f"{database_password}",
-            db=f"{database_name}"
-            # ... additional database driver args
-        )
-
+    # borrow a connection from the shared pool
+    async with acquire() as conn:
         # query Cloud SQL database
         results = await conn.fetch("SELECT version()")
         print(results[0]["version"])
 
-        # close asyncpg connection
-        await conn.close()
-
-async def _fetch_similarity(embeding: np.ndarray, nbr_articles=3, DESC=True) -> list[Paper]:
+async def _fetch_similarity(embeding: np.ndarray, nbr_articles=6, DESC=True, offset=0) -> list[Paper]:
     """
     Fetch similar articles from the database based on a given embedding vector.
 
-    This method connects to a Cloud SQL database and retrieves a specified number
-    of articles that are most similar to the provided embedding. Similarity is 
-    calculated using cosine similarity over the vector embeddings stored in the 
-    'papers' table. 
+    This method retrieves a page of articles ranked by their similarity to the provided
+    embedding in a single query. Similarity is calculated using cosine similarity over the
+    vector embeddings stored in the 'papers' table. The query orders by the cosine distance
+    `embedding <=> $1` itself rather than by a computed alias, so it can be served by a
+    pgvector index, and pages are taken with LIMIT/OFFSET instead of re-running the scan.
 
     Parameters:
     - embedding (np.ndarray): The embedding vector representing the query article.
-    - nbr_articles (int, optional): The number of similar articles to retrieve. Default is 2.
+    - nbr_articles (int, optional): The number of similar articles to retrieve. Default is 6.
     - DESC (bool, optional): Whether to sort the results in descending order of similarity. 
                              Default is True.
+    - offset (int, optional): The number of top ranked articles to skip. Default is 0.
 
     Returns:
-    - List[dict]: A list of dictionaries, each containing the following keys:
+    - list[Paper]: The matched papers, with the following fields set:
         - "doi": Digital Object Identifier for the article.
         - "id": Identifier for the article.
         - "title": Title of the similar article.
@@ -94,66 +73,36 @@ async def _fetch_similarity(embeding: np.ndarray, nbr_articles=3, DESC=True) ->
         - "title_similarity": Similarity score based on title embeddings.
 
     Raises:
-    - Exception: If no results are found, an exception is raised indicating to adjust 
-                 the query parameters.
+    - Exception: If no results are found for the first page, an exception is raised indicating
+                 to adjust the query parameters. Later pages past the end return an empty list.
 
     Note:
     Ensure that the pgvector extension is registered for proper handling of vector 
     embeddings.
     """
-    loop = asyncio.get_running_loop()
-    async with Connector(loop=loop) as connector:
-        # Create connection to Cloud SQL database.
-        conn: asyncpg.Connection = await connector.connect_async(
-            f"{project_id}:{region}:{instance_name}",  # Cloud SQL instance connection name
-            "asyncpg",
-            user=f"{database_user}",
-            password=f"{database_password}",
-            db=f"{database_name}",
-        )
-
-        await register_vector(conn)
-        # Find similar products to the query using cosine similarity search
+    async with acquire() as conn:
+        # Find similar papers to the query using cosine similarity search
         # over all vector embeddings. This new feature is provided by `pgvector`.
-        results1 = await conn.fetch(
-            f"""
-            SELECT doi, id, title, 1 - (embedding <=> $1) AS similarity, abstract, 1 - (title_embedding <=> $1) AS title_similarity 
-            FROM papers
-            ORDER BY similarity {"DESC" if DESC else ""}
-            LIMIT $2
-            """,
-            embeding,
-            nbr_articles
-        )
-
-        results2 = await conn.fetch(
+        results = await conn.fetch(
             f"""
-
             SELECT doi, id, title, 1 - (embedding <=> $1) AS similarity, abstract, 
                 1 - (title_embedding <=> $1) AS title_similarity
             FROM papers
-            WHERE doi NOT IN (
-                SELECT doi
-                FROM papers
-                ORDER BY 1 - (embedding <=> $1) {"DESC" if DESC else ""}
-                LIMIT $2
-            )
-            ORDER BY similarity {"DESC" if DESC else ""}
-            LIMIT $2;
-
+            ORDER BY embedding <=> $1 {"" if DESC else "DESC"}
+            LIMIT $2 OFFSET $3
             """,
             embeding,
-            nbr_articles
+            nbr_articles,
+            offset
         )
 
-        if len(results1) + len(results2) == 0:
+        if len(results) == 0 and offset == 0:
             raise Exception("Did not find any results. Adjust the query parameters.")
         matches = []
-        for r in results1 + results2:
+        for r in results:
             # Collect the description for all the matched similar toy products.
             matches.append(Paper(*r))
 
-        await conn.close()
         return matches
     
 async def _fetch_similarity_from_list(embedding: np.ndarray, bois: list[str], DESC=True) -> list[Paper]:
@@ -178,18 +127,7 @@ async def _fetch_similarity_from_list(embedding: np.ndarray, bois: list[str], DE
         Exception: Raises an exception if no results are found.
     """
     if not bois: return []
-    loop = asyncio.get_running_loop()
-    async with Connector(loop=loop) as connector:
-        # Create connection to Cloud SQL database.
-        conn: asyncpg.Connection = await connector.connect_async(
-            f"{project_id}:{region}:{instance_name}",  # Cloud SQL instance connection name
-            "asyncpg",
-            user=f"{database_user}",
-            password=f"{database_password}",
-            db=f"{database_name}",
-        )
-
-        await register_vector(conn)
+    async with acquire() as conn:
         # Find similar products to the query using cosine similarity search
         # over all vector embeddings. This new feature is provided by `pgvector`.
         # Assuming `doi_list` is your list of DOI values to filter on
@@ -216,10 +154,9 @@ async def _fetch_similarity_from_list(embedding: np.ndarray, bois: list[str], DE
             # Collect the description for all the matched similar toy products.
             matches.append(Paper(*r))
 
-        await conn.close()
         return matches
 
-async def get_papers(query: str, nbr_of_dois:int=3) -> list[Paper]:
+async def get_papers(query: str, nbr_of_dois:int=3, page:int=0, offset:int=None, overfetch:int=2) -> list[Paper]:
     """
     Retrieve Papers of relevancy based on the provided query.
 
@@ -227,10 +164,17 @@ async def get_papers(query: str, nbr_of_dois:int=3) -> list[Paper]:
     that are relevant to the query. The function is designed to interface with a database or
     an external API that contains academic paper metadata.
 
+    Each call returns one page of `nbr_of_dois * overfetch` papers, fetched in a single
+    ordered query. With the defaults this is the top 6 papers, as before.
+
     Args:
         query (str): A search query string that specifies the topic or keywords to search for.
                      The query should be formulated in a way that is compatible with the underlying 
                      search mechanism (e.g., keyword-based search, boolean operators, etc.).
+        nbr_of_dois (int, optional): The number of papers wanted. Defaults to 3.
+        page (int, optional): The zero-based page of results to return. Defaults to 0.
+        offset (int, optional): The number of top ranked papers to skip. Overrides `page` when given.
+        overfetch (int, optional): How many times `nbr_of_dois` papers to return per page. Defaults to 2.
 
     Returns:
         list[Paper]: A list of instances of paper corresponding to the relevant papers found.
@@ -245,10 +189,13 @@ async def get_papers(query: str, nbr_of_dois:int=3) -> list[Paper]:
           API credentials) to perform the query.
         - This function may involve asynchronous operations depending on the implementation.
     """
+    page_size = nbr_of_dois * overfetch
+    if offset is None:
+        offset = page * page_size
     query_embedding = await _get_embeding(query=query)
-    return await _fetch_similarity(query_embedding, nbr_articles=nbr_of_dois, DESC=True)
+    return await _fetch_similarity(query_embedding, nbr_articles=page_size, DESC=True, offset=offset)
 
-async def _get_embeding(query: str) -> torch.Tensor:
+async def _get_embeding(query: str) -> np.ndarray:
     """
     Embed a query sentence using the Jina embedding model.
 
@@ -276,125 +223,22 @@ async def _get_embeding(query: str) -> torch.Tensor:
         (768,)
 
     Notes:
-        - Ensure that the Jina embedding model is properly initialized and accessible before 
-          calling this function.
+        - The Jina embedding model is loaded on the first call (see `embedding_model`) unless
+          it has been prewarmed.
         - This function is asynchronous and should be awaited in an asynchronous context.
+        - Embeddings are cached by normalized query text, model and task (see `embedding_cache`),
+          so repeated queries skip the forward pass. The returned array is read-only.
     """
-    # Tokenize the input text
-    inputs = tokenizer(query, return_tensors='pt', padding=True, truncation=True)
-
-    # Forward pass to get the embeddings
-    with torch.no_grad():
-        outputs = model(**inputs, task="retrieval.query")
-
-    # Extract the last hidden states (embeddings)
-    last_hidden_states = outputs.last_hidden_state
-
-    # Optionally, get the embeddings for the [CLS] token
-    cls_embedding = last_hidden_states[:, 0, :]
-
-    return cls_embedding[0]
-
-async def _fetch_all_citations():
-    """
-    Fetches all citation records from the Cloud SQL database.
-
-    This asynchronous function connects to the Cloud SQL database and retrieves 
-    all entries from the citations table. Each entry includes the source paper 
-    and the papers that cite it.
-
-    Returns:
-        list[dict]: A list of dictionaries, each representing a citation record with the following keys:
-            - 'source_paper' (str): The DOI of the paper being cited.
-            - 'cited_by' (str): The DOI of the paper that cites the source paper.
+    task = "retrieval.query"
+    cached = get_cached_embedding(query, model_key(), task)
+    if cached is not None:
+        return cached
 
-    If no citation records are found, the function returns an empty list.
-
-    Note:
-        This function uses the pgvector extension to enable advanced vector operations,
-        although it does not perform any vector-based queries in this implementation.
-    """
-    loop = asyncio.get_running_loop()
-    async with Connector(loop=loop) as connector:
-        # Create connection to Cloud SQL database.
-        conn: asyncpg.Connection = await connector.connect_async(
-            f"{project_id}:{region}:{instance_name}",  # Cloud SQL instance connection name
-            "asyncpg",
-            user=f"{database_user}",
-            password=f"{database_password}",
-            db=f"{database_name}",
-        )
+    # Embed the query on the embedding service's worker thread, batched with concurrent queries
+    cls_embedding = await get_embedding_service().embed(query, task=task)
 
-        results = await conn.fetch(
-            """
-            SELECT *
-            FROM citations
-            """
-        )
+    return cache_embedding(query, model_key(), task, cls_embedding)
 
-        if len(results) == 0:
-            return []
-        matches = []
-        for r in results:
-            # Collect the description for all the matched similar toy products.
-            matches.append(
-                {
-                    "source_paper": r["source_paper"],
-                    "cited_by": r["cited_by"],
-                }
-            )
-
-        await conn.close()
-        return matches
-
-def _bfs(dois: list[str], citations: list[dict], max_papers=10000) -> Union[list[str], list[dict]]:
-    """
-    Performs a breadth-first search (BFS) to explore related papers based on citations.
-
-    This function takes a list of base of interest (BOI) papers and a list of citation data to find
-    additional papers that are cited by or cite the BOI papers. The search continues until it reaches 
-    a specified maximum number of papers.
-
-    Parameters:
-    - bois (list[str]): A list of DOIs (or identifiers) representing the base papers of interest.
-    - citations (list[dict]): A list of citation records, where each record is a dictionary containing:
-        - 'cited_by' (str): The DOI of the paper that is citing another paper.
-        - 'source_paper' (str): The DOI of the paper being cited.
-    - max_papers (int): The maximum number of papers to return, including the base papers and 
-                        their related papers. Default is 10.
-
-    Returns:
-    - list[str]: A list of DOIs representing the base papers and any additional papers found 
-                 through citations, up to the maximum specified.
-
-    Note:
-    The search stops once the total number of identified papers reaches the `max_papers` limit.
-    """
-    based_on = set(dois)
-    future_work = set(dois)
-    queue = [i for i in dois]
-    citations_utalized = []
-    for boi in queue:
-        for citation in citations:
-            if citation['cited_by'] == boi and citation['source_paper'] not in based_on:
-                queue.append(citation['source_paper'])
-                based_on.add(citation['source_paper'])
-                citations_utalized.append(citation)
-            if len(dois) + len(based_on) >= max_papers: break
-        if len(dois) + len(based_on) >= max_papers: break
-
-    queue = [i for i in dois]
-    for boi in queue:
-        for citation in citations:
-            if citation['source_paper'] == boi  and citation['cited_by'] not in future_work:
-                queue.append(citation['cited_by'])
-                future_work.add(citation['cited_by'])
-                citations_utalized.append(citation)
-            if len(dois) + len(based_on) + len(future_work) >= max_papers: break
-        if len(dois) + len(based_on) + len(future_work) >= max_papers: break
-        
-    return list(set(list(based_on) + list(future_work)).difference(set(dois))), citations_utalized
-    
 async def get_related_papers(query, papers: list[Paper]) -> Union[list[Paper], list[dict]]:
     """
     Retrieves related papers based on the provided list of DOIs (bois).
@@ -412,13 +256,14 @@ async def get_related_papers(query, papers: list[Paper]) -> Union[list[Paper], l
                     or are cited by them.
 
     Note:
-        This function calls an internal BFS function (_bfs) and fetches all
-        citation data from the database using the _fetch_all_citations function.
+        This function calls the BFS of `database_endpoints` (_bfs) over the cached citation
+        graph index, which is only loaded from the database on first use, without the
+        limit of the Query page (up to 10000 papers).
     """
     dois = [p.doi for p in papers]
     embedding = await _get_embeding(query)
-    citations = await _fetch_all_citations()
-    dois, used_citations = _bfs(dois, citations)
+    graph = await _get_citation_graph()
+    dois, used_citations = _bfs(dois, graph, max_papers=10000)
     papers_bfs = await _fetch_similarity_from_list(embedding, dois)
     papers_bfs.sort(key=lambda p: p.similarity)
     return papers + papers_bfs , used_citations
@@ -431,6 +276,7 @@ async def main():
     print(papers)
     related, citations = await get_related_papers(query, papers)
     print(related)
+    await close_pool()
 
 if __name__ == "__main__":
     # Run the main function
@@ -0,0 +1,287 @@
+# database_indexes.py
+
+import argparse
+import asyncio
+import asyncpg
+from contextlib import asynccontextmanager
+from database_pool import acquire, close_pool
+import math
+import os
+from text_search import SEARCH_VECTOR_SQL
+import time
+
+VECTOR_COLUMNS = ("embedding", "title_embedding")
+TEXT_INDEXES = ("papers_title_trgm_idx", "papers_search_vector_idx")
+
+# Default per-query search knobs, used when a caller does not pass its own.
+# hnsw.ef_search trades recall for speed on HNSW indexes (pgvector default 40),
+# ivfflat.probes does the same on IVFFlat indexes (pgvector default 1).
+default_ef_search = int(os.getenv("VECTOR_EF_SEARCH", "0")) or None
+default_probes = int(os.getenv("VECTOR_PROBES", "0")) or None
+# pgvector's default and maximum hnsw.ef_search.
+HNSW_DEFAULT_EF_SEARCH = 40
+HNSW_MAX_EF_SEARCH = 1000
+
+
+def _index_name(column: str, method: str) -> str:
+    return f"papers_{column}_{method}_idx"
+
+
+async def create_vector_indexes(method: str = "hnsw", columns=VECTOR_COLUMNS, m: int = 16,
+                                ef_construction: int = 64, lists: int = None) -> list[str]:
+    """
+    Creates pgvector ANN indexes on the embedding columns of the `papers` table.
+
+    Indexes are built with cosine distance (`vector_cosine_ops`), which is what the similarity
+    queries order by. They are created CONCURRENTLY so searches keep working during the build.
+
+    Args:
+        method (str): Either "hnsw" or "ivfflat". HNSW gives better recall/latency and needs no
+                      training data, IVFFlat builds faster and uses less memory.
+        columns (tuple[str]): The vector columns to index. Defaults to both embedding columns.
+        m (int): HNSW only, the max number of connections per layer. Defaults to 16.
+        ef_construction (int): HNSW only, the candidate list size during the build. Defaults to 64.
+        lists (int, optional): IVFFlat only, the number of inverted lists. Defaults to rows / 1000
+                               (at least 10) up to 1M rows and sqrt(rows) above, as pgvector recommends.
+
+    Returns:
+        list[str]: The names of the indexes.
+    """
+    if method not in ("hnsw", "ivfflat"):
+        raise ValueError(f"Unknown vector index method: {method}")
+
+    names = []
+    async with acquire() as conn:
+        await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        if method == "hnsw":
+            options = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+        else:
+            if lists is None:
+                rows = await conn.fetchval("SELECT count(*) FROM papers")
+                lists = max(rows // 1000, 10) if rows <= 1_000_000 else int(math.sqrt(rows))
+            options = f"lists = {int(lists)}"
+
+        for column in columns:
+            name = _index_name(column, method)
+            print(f"Building {name} ({options})")
+            await conn.execute(
+                f"""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS {name}
+                ON papers USING {method} ({column} vector_cosine_ops)
+                WITH ({options})
+                """
+            )
+            names.append(name)
+        await conn.execute("ANALYZE papers")
+    return names
+
+
+async def drop_vector_indexes(method: str = None, columns=VECTOR_COLUMNS) -> None:
+    """Drops the ANN indexes created by `create_vector_indexes`, for one method or both."""
+    methods = [method] if method else ["hnsw", "ivfflat"]
+    async with acquire() as conn:
+        for m in methods:
+            for column in columns:
+                await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {_index_name(column, m)}")
+
+
+async def reindex_vector_indexes() -> None:
+    """
+    Rebuilds the existing ANN indexes.
+
+    IVFFlat lists are trained on the rows present at build time, so recall degrades as the corpus
+    grows. Run this after large ingestions; it is cheap to keep HNSW indexes as they are.
+    """
+    for index in await list_vector_indexes():
+        async with acquire() as conn:
+            print(f"Reindexing {index['name']}")
+            await conn.execute(f"REINDEX INDEX CONCURRENTLY {index['name']}")
+    async with acquire() as conn:
+        await conn.execute("ANALYZE papers")
+
+
+async def list_vector_indexes() -> list[dict]:
+    """Lists the hnsw/ivfflat indexes on `papers` with their definition and size."""
+    async with acquire() as conn:
+        results = await conn.fetch(
+            """
+            SELECT indexname, indexdef, pg_size_pretty(pg_relation_size(indexname::regclass)) AS size
+            FROM pg_indexes
+            WHERE tablename = 'papers' AND (indexdef ILIKE '%USING hnsw%' OR indexdef ILIKE '%USING ivfflat%')
+            """
+        )
+    return [{"name": r["indexname"], "definition": r["indexdef"], "size": r["size"]} for r in results]
+
+
+async def create_text_indexes() -> list[str]:
+    """
+    Creates the GIN indexes behind the title substring search and the full text search.
+
+    `papers_title_trgm_idx` is a `pg_trgm` index on `title`, which serves `ILIKE '%...%'` for
+    patterns of three characters or more. `papers_search_vector_idx` indexes the weighted
+    title and abstract `tsvector` (see `text_search.SEARCH_VECTOR_SQL`) used for ranked full
+    text search. Both are created CONCURRENTLY so searches keep working during the build.
+
+    Returns:
+        list[str]: The names of the indexes.
+    """
+    async with acquire() as conn:
+        await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        print(f"Building {TEXT_INDEXES[0]}")
+        await conn.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {TEXT_INDEXES[0]} ON papers USING gin (title gin_trgm_ops)"
+        )
+        print(f"Building {TEXT_INDEXES[1]}")
+        await conn.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {TEXT_INDEXES[1]} ON papers USING gin ({SEARCH_VECTOR_SQL})"
+        )
+        await conn.execute("ANALYZE papers")
+    return list(TEXT_INDEXES)
+
+
+async def drop_text_indexes() -> None:
+    """Drops the indexes created by `create_text_indexes`."""
+    async with acquire() as conn:
+        for name in TEXT_INDEXES:
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+@asynccontextmanager
+async def search_params(conn: asyncpg.Connection, ef_search: int = None, probes: int = None, min_rows: int = None):
+    """
+    Applies per-query ANN search knobs for the duration of the block.
+
+    The settings are set with `set_config(..., is_local => true)` inside a transaction, so they
+    never leak to other users of the pooled connection. Without any knob this is a no-op and no
+    transaction is opened.
+
+    An HNSW scan returns at most `hnsw.ef_search` rows, so a query reading `min_rows` rows (its
+    LIMIT plus OFFSET) raises `ef_search` to at least that, up to pgvector's maximum of 1000.
+    Rows past the 1000th cannot be reached through an HNSW index. An IVFFlat scan returns only
+    the rows of its `probes` lists, so deep pages need more probes.
+
+    Example:
+        async with acquire() as conn:
+            async with search_params(conn, ef_search=100):
+                await conn.fetch(...)
+    """
+    ef_search = ef_search or default_ef_search
+    probes = probes or default_probes
+    if min_rows and min_rows > (ef_search or HNSW_DEFAULT_EF_SEARCH):
+        ef_search = min(min_rows, HNSW_MAX_EF_SEARCH)
+    if not ef_search and not probes:
+        yield conn
+        return
+
+    async with conn.transaction():
+        if ef_search:
+            await conn.execute("SELECT set_config('hnsw.ef_search', $1, true)", str(int(ef_search)))
+        if probes:
+            await conn.execute("SELECT set_config('ivfflat.probes', $1, true)", str(int(probes)))
+        yield conn
+
+
+async def _top_k(conn: asyncpg.Connection, embedding, column: str, k: int) -> list[str]:
+    results = await conn.fetch(
+        f"""
+        SELECT doi
+        FROM papers
+        ORDER BY {column} <=> $1
+        LIMIT $2
+        """,
+        embedding,
+        k
+    )
+    return [r["doi"] for r in results]
+
+
+async def measure_recall(k: int = 10, nbr_queries: int = 50, column: str = "embedding",
+                         ef_search: int = None, probes: int = None) -> dict:
+    """
+    Reports the recall of the ANN index against exact search.
+
+    A sample of stored paper embeddings is used as queries. Each one is searched once through the
+    index with the given knobs and once exactly, with index scans disabled for the transaction.
+
+    Args:
+        k (int): The number of neighbours compared per query. Defaults to 10.
+        nbr_queries (int): The number of sampled queries. Defaults to 50.
+        column (str): The vector column to evaluate. Defaults to "embedding".
+        ef_search (int, optional): hnsw.ef_search used for the approximate search.
+        probes (int, optional): ivfflat.probes used for the approximate search.
+
+    Returns:
+        dict: 'recall' (mean recall@k), and 'ann_ms' / 'exact_ms' (mean latency per query).
+    """
+    if column not in VECTOR_COLUMNS:
+        raise ValueError(f"Unknown vector column: {column}")
+
+    recalls, ann_times, exact_times = [], [], []
+    async with acquire() as conn:
+        queries = await conn.fetch(
+            f"SELECT {column} AS embedding FROM papers WHERE {column} IS NOT NULL ORDER BY random() LIMIT $1",
+            nbr_queries
+        )
+        for q in queries:
+            start = time.perf_counter()
+            async with search_params(conn, ef_search=ef_search, probes=probes):
+                approximate = await _top_k(conn, q["embedding"], column, k)
+            ann_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            async with conn.transaction():
+                await conn.execute("SET LOCAL enable_indexscan = off")
+                exact = await _top_k(conn, q["embedding"], column, k)
+            exact_times.append(time.perf_counter() - start)
+
+            if exact:
+                recalls.append(len(set(approximate) & set(exact)) / len(exact))
+
+    return {
+        "recall": sum(recalls) / len(recalls) if recalls else None,
+        "ann_ms": 1000 * sum(ann_times) / max(len(ann_times), 1),
+        "exact_ms": 1000 * sum(exact_times) / max(len(exact_times), 1),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Manage the pgvector ANN and text search indexes on the papers table.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    create = sub.add_parser("create", help="create the ANN indexes")
+    create.add_argument("--method", choices=["hnsw", "ivfflat"], default="hnsw")
+    create.add_argument("--m", type=int, default=16)
+    create.add_argument("--ef-construction", type=int, default=64)
+    create.add_argument("--lists", type=int, default=None)
+    drop = sub.add_parser("drop", help="drop the ANN indexes")
+    drop.add_argument("--method", choices=["hnsw", "ivfflat"], default=None)
+    sub.add_parser("reindex", help="rebuild the existing ANN indexes")
+    sub.add_parser("list", help="list the existing ANN indexes")
+    sub.add_parser("create-text", help="create the trigram and full text indexes")
+    sub.add_parser("drop-text", help="drop the trigram and full text indexes")
+    recall = sub.add_parser("recall", help="report recall against exact search")
+    recall.add_argument("--k", type=int, default=10)
+    recall.add_argument("--queries", type=int, default=50)
+    recall.add_argument("--column", choices=VECTOR_COLUMNS, default="embedding")
+    recall.add_argument("--ef-search", type=int, default=None)
+    recall.add_argument("--probes", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "create":
+        print(await create_vector_indexes(args.method, m=args.m, ef_construction=args.ef_construction, lists=args.lists))
+    elif args.command == "drop":
+        await drop_vector_indexes(args.method)
+    elif args.command == "reindex":
+        await reindex_vector_indexes()
+    elif args.command == "list":
+        for index in await list_vector_indexes():
+            print(f"{index['name']} ({index['size']}): {index['definition']}")
+    elif args.command == "create-text":
+        print(await create_text_indexes())
+    elif args.command == "drop-text":
+        await drop_text_indexes()
+    elif args.command == "recall":
+        print(await measure_recall(args.k, args.queries, args.column, args.ef_search, args.probes))
+    await close_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
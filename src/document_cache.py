@@ -0,0 +1,152 @@
+# document_cache.py
+
+import glob
+import os
+import re
+import tempfile
+import threading
+import time
+
+# Where the extracted LaTeX of each paper is kept, and how large the cache may grow.
+document_cache_dir = os.getenv("DOCUMENT_CACHE_DIR", "./data/document_cache")
+document_cache_max_mb = float(os.getenv("DOCUMENT_CACHE_MAX_MB", "1024"))
+# How long a paper without usable LaTeX source is not downloaded again, in seconds (a week).
+document_cache_missing_ttl = float(os.getenv("DOCUMENT_CACHE_MISSING_TTL", "604800"))
+
+
+class DocumentCache:
+    """
+    A persistent cache of the concatenated LaTeX source of arXiv papers.
+
+    Entries are keyed by arXiv id and version. A version of a paper never changes on arXiv, so
+    an entry never needs to be invalidated. Writes go to a temporary file that is atomically
+    renamed into place, so concurrent sessions and processes never see partial documents.
+    Reads refresh an entry's modification time, and the least recently used entries are
+    deleted once the cache grows past `max_bytes`.
+
+    Papers without a usable source (PDF-only submissions, empty archives) get an empty
+    `.missing` marker instead, so they are not downloaded again for `missing_ttl` seconds.
+    """
+
+    def __init__(self, root: str = None, max_bytes: int = None, missing_ttl: float = None) -> None:
+        self.root = root or document_cache_dir
+        self.max_bytes = max_bytes or int(document_cache_max_mb * 1024 * 1024)
+        self.missing_ttl = document_cache_missing_ttl if missing_ttl is None else missing_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def _name(arxiv_id: str) -> str:
+        # Old style ids contain a slash, e.g. math/0501001v2
+        return arxiv_id.replace("/", "_")
+
+    def path(self, arxiv_id: str, suffix: str = ".tex") -> str:
+        """Returns the path an entry for a versioned arXiv id is stored at."""
+        return os.path.join(self.root, f"{self._name(arxiv_id)}{suffix}")
+
+    def _find(self, arxiv_id: str, suffix: str) -> str:
+        # An id without version matches its newest stored version.
+        if re.search(r"v\d+$", arxiv_id):
+            path = self.path(arxiv_id, suffix)
+            return path if os.path.exists(path) else None
+        pattern = os.path.join(glob.escape(self.root), f"{glob.escape(self._name(arxiv_id))}v*{suffix}")
+        versions = [(int(m.group(1)), c) for c in glob.glob(pattern) if (m := re.search(rf"v(\d+){re.escape(suffix)}$", c))]
+        return max(versions)[1] if versions else None
+
+    def lookup(self, arxiv_id: str) -> str:
+        """
+        Returns the path of the cached document, or None.
+
+        For an id without version, the newest cached version is returned.
+        """
+        path = self._find(arxiv_id, ".tex")
+        if path is None:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def read(self, arxiv_id: str) -> str:
+        """Returns the cached document text, or None."""
+        path = self.lookup(arxiv_id)
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, arxiv_id: str, text: str) -> str:
+        """
+        Atomically stores the document of a versioned arXiv id and returns its path.
+        """
+        path = self.path(arxiv_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp-", suffix=".tex")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+        return path
+
+    def put_missing(self, arxiv_id: str) -> None:
+        """Records that a versioned arXiv id has no usable LaTeX source."""
+        with open(self.path(arxiv_id, ".missing"), "w"):
+            pass
+
+    def is_missing(self, arxiv_id: str) -> bool:
+        """Whether the paper was recorded as having no source less than `missing_ttl` seconds ago."""
+        path = self._find(arxiv_id, ".missing")
+        if path is None:
+            return False
+        try:
+            if time.time() - os.stat(path).st_mtime < self.missing_ttl:
+                return True
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return False
+
+    def evict(self) -> None:
+        """Deletes the least recently used documents until the cache fits in `max_bytes`."""
+        with self._lock:
+            entries = []
+            for path in glob.glob(os.path.join(glob.escape(self.root), "*.tex")):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+_document_cache: DocumentCache = None
+
+
+def get_document_cache() -> DocumentCache:
+    """Returns the process-wide document cache, configured from DOCUMENT_CACHE_DIR and DOCUMENT_CACHE_MAX_MB."""
+    global _document_cache
+    if _document_cache is None:
+        _document_cache = DocumentCache()
+    return _document_cache
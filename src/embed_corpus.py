@@ -0,0 +1,223 @@
+# embed_corpus.py
+
+import argparse
+import embedding_model
+from embedding_model import model_key
+from ingest import read_papers
+import json
+import multiprocessing
+import numpy as np
+import os
+import time
+
+# Upper bounds on the texts of one forward pass and on their padded size in estimated tokens.
+embed_batch_size = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+embed_batch_tokens = int(os.getenv("EMBED_BATCH_TOKENS", "8192"))
+# Papers per checkpointed shard, and the worker processes and threads per worker of the job.
+embed_shard_size = int(os.getenv("EMBED_SHARD_SIZE", "2000"))
+embed_workers = int(os.getenv("EMBED_WORKERS", str(max(1, (os.cpu_count() or 1) // 4))))
+embed_worker_threads = int(os.getenv("EMBED_WORKER_THREADS", "0")) or None
+
+CHARS_PER_TOKEN = 4
+# The paper fields embedded, and the file of the consolidated embeddings of each.
+FIELDS = {"abstract": "embeddings.npy", "title": "title_embeddings.npy"}
+TASK = "retrieval.passage"
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 2
+
+
+def make_batches(texts: list[str], rows: list[int], batch_size: int = None, batch_tokens: int = None) -> list[list[int]]:
+    """
+    Groups `rows` into batches of texts of similar length.
+
+    Rows are sorted by text length, so each batch is padded to barely more than its shortest
+    text. A batch closes at `batch_size` texts, or earlier once padding all its texts to the
+    longest would exceed `batch_tokens`, so batches of long abstracts hold fewer texts.
+    """
+    batch_size = batch_size or embed_batch_size
+    batch_tokens = batch_tokens or embed_batch_tokens
+    batches, batch = [], []
+    for row in sorted(rows, key=lambda r: len(texts[r])):
+        # Sorted by length, so the new text is the longest of the batch.
+        if batch and (len(batch) == batch_size or (len(batch) + 1) * estimate_tokens(texts[row]) > batch_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(row)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _init_worker(threads: int) -> None:
+    # Each worker loads its own copy of the model, with `threads` intra-op threads.
+    embedding_model.embedding_num_threads = threads
+
+
+def _encode_batch(job: tuple) -> tuple:
+    field, rows, texts = job
+    return field, rows, embedding_model.encode(texts, task=TASK)
+
+
+class CorpusEmbedder:
+    """
+    Embeds the abstracts and titles of a papers file into `.npy` files, resumably.
+
+    Papers are processed in shards of `shard_size` records. Each shard of each field is written
+    to a memory-mapped `<field>_<shard>.npy.partial` file and renamed to `<field>_<shard>.npy`
+    once complete, then recorded in `manifest.json`. A rerun skips the recorded shards, so an
+    interrupted job loses at most the shards in progress. Batches of length-sorted texts (see
+    `make_batches`) are spread over a pool of worker processes. Once every shard is done, they
+    are concatenated into `embeddings.npy` and `title_embeddings.npy`, whose row i belongs to
+    the i-th record of the papers file, as `ingest.py` expects.
+    """
+
+    def __init__(self, papers_path: str, output_dir: str, shard_size: int = None) -> None:
+        self.papers_path = papers_path
+        self.output_dir = output_dir
+        self.shard_size = shard_size or embed_shard_size
+        self.texts = {field: [] for field in FIELDS}
+        self.rows = []
+        for row, paper in enumerate(read_papers(papers_path)):
+            for field in FIELDS:
+                self.texts[field].append(paper.get(field) or "")
+            # `ingest.py` skips the records without a doi, their rows are left as zeros.
+            if paper.get("doi"):
+                self.rows.append(row)
+        self.count = len(self.texts["abstract"])
+        self.nbr_shards = -(-self.count // self.shard_size)
+        os.makedirs(output_dir, exist_ok=True)
+        self.manifest_path = os.path.join(output_dir, "manifest.json")
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> dict:
+        expected = {"papers": os.path.realpath(self.papers_path), "count": self.count,
+                    "shard_size": self.shard_size, "model": model_key(), "task": TASK}
+        if not os.path.exists(self.manifest_path):
+            return {**expected, "dimensions": None, "done": {field: [] for field in FIELDS}}
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        for key, value in expected.items():
+            if manifest.get(key) != value:
+                raise ValueError(f"{self.manifest_path} was written for {key}={manifest.get(key)!r}, not {value!r}. "
+                                 "Use another output directory to start over.")
+        return manifest
+
+    def _save_manifest(self) -> None:
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def shard_path(self, field: str, shard: int) -> str:
+        return os.path.join(self.output_dir, f"{field}_{shard:05d}.npy")
+
+    def _shard_rows(self, shard: int) -> tuple[int, int, list[int]]:
+        start, end = shard * self.shard_size, min((shard + 1) * self.shard_size, self.count)
+        rows = self.rows[np.searchsorted(self.rows, start):np.searchsorted(self.rows, end)]
+        return start, end, rows
+
+    def pending(self) -> list[tuple[str, int]]:
+        """The (field, shard) pairs still to embed."""
+        return [(field, shard) for shard in range(self.nbr_shards) for field in FIELDS
+                if shard not in self.manifest["done"][field]]
+
+    def run(self, workers: int = None, threads: int = None, batch_size: int = None, batch_tokens: int = None) -> None:
+        """
+        Embeds the pending shards, then writes the consolidated files.
+
+        Args:
+            workers (int, optional): Worker processes, each with its own model. 0 embeds in this
+                                     process. Defaults to EMBED_WORKERS.
+            threads (int, optional): Torch threads per worker. Defaults to EMBED_WORKER_THREADS,
+                                     or the CPU count divided by the workers.
+            batch_size (int, optional): Maximum texts per batch. Defaults to EMBED_BATCH_SIZE.
+            batch_tokens (int, optional): Maximum padded tokens per batch. Defaults to EMBED_BATCH_TOKENS.
+        """
+        workers = embed_workers if workers is None else workers
+        threads = threads or embed_worker_threads or max(1, (os.cpu_count() or 1) // max(workers, 1))
+        pending = self.pending()
+        print(f"{self.count} papers, {len(pending)} of {self.nbr_shards * len(FIELDS)} shards to embed")
+
+        pool = None
+        if pending and workers:
+            pool = multiprocessing.get_context("spawn").Pool(workers, initializer=_init_worker, initargs=(threads,))
+            imap = pool.imap_unordered
+        else:
+            _init_worker(threads)
+            imap = map
+        try:
+            for field, shard in pending:
+                self._embed_shard(field, shard, imap, batch_size, batch_tokens)
+        finally:
+            # Every result of the shards done has been consumed, anything left is abandoned.
+            if pool is not None:
+                pool.terminate()
+        self.consolidate()
+
+    def _embed_shard(self, field: str, shard: int, imap, batch_size: int, batch_tokens: int) -> None:
+        started = time.perf_counter()
+        start, end, rows = self._shard_rows(shard)
+        texts = self.texts[field]
+        jobs = [(field, batch, [texts[row] for row in batch])
+                for batch in make_batches(texts, rows, batch_size, batch_tokens)]
+
+        path = self.shard_path(field, shard)
+        shard_embeddings = None
+        for _, batch, embeddings in imap(_encode_batch, jobs):
+            if shard_embeddings is None:
+                self.manifest["dimensions"] = self.manifest["dimensions"] or embeddings.shape[1]
+                shard_embeddings = np.lib.format.open_memmap(path + ".partial", mode="w+", dtype=np.float32,
+                                                             shape=(end - start, self.manifest["dimensions"]))
+            shard_embeddings[np.asarray(batch) - start] = embeddings
+        # A shard without any paper to embed has no file, its rows stay zeros.
+        if shard_embeddings is not None:
+            shard_embeddings.flush()
+            del shard_embeddings
+            os.replace(path + ".partial", path)
+
+        self.manifest["done"][field].append(shard)
+        self._save_manifest()
+        elapsed = time.perf_counter() - started
+        print(f"{field} shard {shard + 1}/{self.nbr_shards}: {len(rows)} papers in {elapsed:.1f}s ({len(rows) / max(elapsed, 1e-9):.0f}/s)")
+
+    def consolidate(self) -> dict[str, str]:
+        """Concatenates the shards of each field into one `.npy` file. Returns the paths by field."""
+        paths = {}
+        if self.pending():
+            return paths
+        dimensions = self.manifest["dimensions"] or 0
+        for field, name in FIELDS.items():
+            path = os.path.join(self.output_dir, name)
+            paths[field] = path
+            if os.path.exists(path):
+                continue
+            out = np.lib.format.open_memmap(path + ".partial", mode="w+", dtype=np.float32, shape=(self.count, dimensions))
+            for shard in range(self.nbr_shards):
+                start, end, _ = self._shard_rows(shard)
+                if os.path.exists(self.shard_path(field, shard)):
+                    out[start:end] = np.load(self.shard_path(field, shard), mmap_mode="r")
+            out.flush()
+            del out
+            os.replace(path + ".partial", path)
+            print(f"Wrote {path}")
+        return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed the abstracts and titles of a papers file, resumably.")
+    parser.add_argument("papers", help="papers JSON, e.g. data/ml_papers.json")
+    parser.add_argument("--output", default="data/embeddings", help="directory of the shards, manifest and .npy files")
+    parser.add_argument("--shard-size", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, 0 to embed in this process")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per worker")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--batch-tokens", type=int, default=None)
+    args = parser.parse_args()
+
+    embedder = CorpusEmbedder(args.papers, args.output, args.shard_size)
+    embedder.run(args.workers, args.threads, args.batch_size, args.batch_tokens)
+
+if __name__ == "__main__":
+    main()
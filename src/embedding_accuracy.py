@@ -0,0 +1,64 @@
+# embedding_accuracy.py
+
+import argparse
+import csv
+from embedding_model import BACKENDS, encode
+import numpy as np
+import os
+import sys
+import time
+
+default_sample_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "ml_100_abstracts.csv")
+
+
+def load_abstracts(path: str = default_sample_path, limit: int = None) -> list[str]:
+    """Reads the 'Abstract' column of a CSV such as data/ml_100_abstracts.csv."""
+    with open(path, newline="") as f:
+        abstracts = [" ".join(row["Abstract"].split()) for row in csv.DictReader(f) if row.get("Abstract")]
+    return abstracts[:limit] if limit else abstracts
+
+
+def compare_backends(texts: list[str], backend: str, reference: str = "fp32", task: str = "retrieval.query",
+                     batch_size: int = 16) -> dict:
+    """
+    Embeds `texts` with two backends and compares the outputs.
+
+    Returns:
+        dict: 'min_cosine' and 'mean_cosine' between the row pairs, and the total encode time
+              of each backend in seconds.
+    """
+    results = {}
+    for name in (reference, backend):
+        start = time.perf_counter()
+        results[name] = np.vstack([encode(texts[i:i + batch_size], task=task, backend=name)
+                                   for i in range(0, len(texts), batch_size)])
+        results[f"{name}_seconds"] = time.perf_counter() - start
+
+    a, b = results[reference], results[backend]
+    cosines = np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        f"{reference}_seconds": results[f"{reference}_seconds"],
+        f"{backend}_seconds": results[f"{backend}_seconds"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check an embedding backend against the fp32 model.")
+    parser.add_argument("backend", choices=[b for b in BACKENDS if b != "fp32"])
+    parser.add_argument("--data", default=default_sample_path)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--min-cosine", type=float, default=0.99,
+                        help="fail if any embedding is less similar than this to its fp32 counterpart")
+    args = parser.parse_args()
+
+    report = compare_backends(load_abstracts(args.data, args.limit), args.backend)
+    for key, value in report.items():
+        print(f"{key}: {value:.4f}")
+    if report["min_cosine"] < args.min_cosine:
+        print(f"{args.backend} is below the accuracy bound of {args.min_cosine}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# embedding_cache.py
+
+import numpy as np
+import os
+from tiered_cache import TieredCache
+import unicodedata
+
+# In-memory entries (a 1024-d float32 embedding is 4 KB), lifetime in seconds (0 keeps entries
+# until evicted) and an optional SQLite file shared across restarts and processes.
+embedding_cache_size = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+embedding_cache_ttl = float(os.getenv("EMBEDDING_CACHE_TTL", "0")) or None
+embedding_cache_path = os.getenv("EMBEDDING_CACHE_PATH")
+
+_embedding_cache: TieredCache = None
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normalizes query text so trivially different spellings share a cache entry.
+
+    Only Unicode forms and whitespace are folded. Case is kept, because the embedding model is
+    case-sensitive ("GAN" and "gan" embed differently).
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def get_embedding_cache() -> TieredCache:
+    """Returns the process-wide embedding cache, configured from the EMBEDDING_CACHE_* variables."""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = TieredCache(embedding_cache_size, ttl=embedding_cache_ttl, path=embedding_cache_path)
+    return _embedding_cache
+
+
+def get_cached_embedding(text: str, model: str, task: str) -> np.ndarray:
+    """Returns the cached embedding of `text` for this model and task, or None."""
+    embedding = get_embedding_cache().get(TieredCache.make_key(model, task, normalize_query(text)))
+    if embedding is not None:
+        embedding.flags.writeable = False
+    return embedding
+
+
+def cache_embedding(text: str, model: str, task: str, embedding: np.ndarray) -> np.ndarray:
+    """
+    Stores an embedding and returns it as a read-only float32 array, so callers sharing the
+    cached value cannot modify it in place.
+    """
+    embedding = np.array(embedding, dtype=np.float32)
+    embedding.flags.writeable = False
+    get_embedding_cache().set(TieredCache.make_key(model, task, normalize_query(text)), embedding)
+    return embedding
@@ -0,0 +1,159 @@
+# embedding_model.py
+
+import numpy as np
+import os
+import threading
+
+embedding_model_name = 'jinaai/jina-embeddings-v3'
+
+# Inference backend for the embedding model:
+#   "fp32"  the full precision PyTorch model (default)
+#   "onnx"  the ONNX export published with the model, run with onnxruntime
+embedding_backend = os.getenv("EMBEDDING_BACKEND", "fp32")
+# Number of CPU threads used by the forward pass. Library default if unset.
+embedding_num_threads = int(os.getenv("EMBEDDING_NUM_THREADS", "0")) or None
+
+BACKENDS = ("fp32", "onnx")
+
+
+class ModelHolder:
+    """
+    Loads a Hugging Face tokenizer and model on first use, at most once per process.
+
+    `torch` and `transformers` (or `onnxruntime`) are only imported when the model is first
+    needed, so importing the modules that embed text stays cheap. `prewarm` starts the load in a
+    background thread, and any caller of `get` during the load simply waits for it to finish.
+    """
+
+    def __init__(self, name: str, backend: str = "fp32", num_threads: int = None) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown embedding backend: {backend}")
+        self.name = name
+        self.backend = backend
+        self.num_threads = num_threads
+        self._tokenizer = None
+        self._model = None
+        self._lock = threading.Lock()
+        self._prewarm_thread: threading.Thread = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def get(self):
+        """Returns the (tokenizer, model) pair, loading it if needed. For "onnx" the model is an InferenceSession."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from transformers import AutoTokenizer
+                    tokenizer = AutoTokenizer.from_pretrained(self.name)
+                    model = self._load_onnx() if self.backend == "onnx" else self._load_torch()
+                    self._tokenizer, self._model = tokenizer, model
+        return self._tokenizer, self._model
+
+    def _load_torch(self):
+        import torch
+        from transformers import AutoModel
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        model = AutoModel.from_pretrained(self.name, trust_remote_code=True)
+        model.eval()
+        return model
+
+    def _load_onnx(self):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("The onnx embedding backend requires onnxruntime: pip install onnxruntime") from e
+        from huggingface_hub import hf_hub_download
+        from transformers import AutoConfig
+        path = hf_hub_download(self.name, "onnx/model.onnx")
+        try:
+            # Large exports keep their weights next to the graph.
+            hf_hub_download(self.name, "onnx/model.onnx_data")
+        except Exception:
+            pass
+        options = onnxruntime.SessionOptions()
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+        session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        # The export selects the task adapter through a `task_id` input.
+        self.tasks = list(AutoConfig.from_pretrained(self.name, trust_remote_code=True).lora_adaptations)
+        return session
+
+    def prewarm(self) -> threading.Thread:
+        """Starts loading the model in a daemon thread. Calling it again is a no-op."""
+        with self._lock:
+            if self._prewarm_thread is None and self._model is None:
+                self._prewarm_thread = threading.Thread(target=self._prewarm, name=f"prewarm-{self.name}", daemon=True)
+                self._prewarm_thread.start()
+        return self._prewarm_thread
+
+    def _prewarm(self) -> None:
+        try:
+            self.get()
+            print(f"Loaded {self.name} ({self.backend})")
+        except Exception as e:
+            # The next call to `get` retries and raises to its caller.
+            print(f"Error prewarming {self.name}: {e}")
+
+
+_holders: dict[str, ModelHolder] = {}
+_holders_lock = threading.Lock()
+
+
+def get_model_holder(backend: str = None) -> ModelHolder:
+    """Returns the process-wide holder of the embedding model for a backend (EMBEDDING_BACKEND by default)."""
+    backend = backend or embedding_backend
+    with _holders_lock:
+        if backend not in _holders:
+            _holders[backend] = ModelHolder(embedding_model_name, backend, embedding_num_threads)
+        return _holders[backend]
+
+
+def model_key(backend: str = None) -> str:
+    """Identifies the model and backend, e.g. for cache keys. ONNX outputs differ slightly from fp32."""
+    backend = backend or embedding_backend
+    return embedding_model_name if backend == "fp32" else f"{embedding_model_name}@{backend}"
+
+
+def prewarm() -> threading.Thread:
+    """Starts loading the embedding model in the background, e.g. at server start."""
+    return get_model_holder().prewarm()
+
+
+def encode(texts: list[str], task: str = "retrieval.query", backend: str = None) -> np.ndarray:
+    """
+    Embeds a batch of texts with the Jina model and returns their [CLS] embeddings.
+
+    Args:
+        texts (list[str]): The texts to embed. They are padded to the longest one in the batch.
+        task (str): The Jina task adapter, "retrieval.query" for queries and "retrieval.passage"
+                    for the documents they are matched against.
+        backend (str, optional): The inference backend. Defaults to EMBEDDING_BACKEND.
+
+    Returns:
+        np.ndarray: A float32 array of shape (len(texts), hidden size).
+    """
+    holder = get_model_holder(backend)
+    tokenizer, model = holder.get()
+
+    if holder.backend == "onnx":
+        inputs = tokenizer(texts, return_tensors='np', padding=True, truncation=True)
+        outputs = model.run(None, {
+            "input_ids": inputs["input_ids"].astype(np.int64),
+            "attention_mask": inputs["attention_mask"].astype(np.int64),
+            "task_id": np.array(holder.tasks.index(task), dtype=np.int64),
+        })
+        return np.asarray(outputs[0][:, 0, :], dtype=np.float32)
+
+    import torch
+    # Tokenize the input text
+    inputs = tokenizer(texts, return_tensors='pt', padding=True, truncation=True)
+
+    # Forward pass to get the embeddings
+    with torch.no_grad():
+        outputs = model(**inputs, task=task)
+
+    # Get the embeddings for the [CLS] token of the last hidden states
+    return outputs.last_hidden_state[:, 0, :].float().numpy()
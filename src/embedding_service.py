@@ -0,0 +1,109 @@
+# embedding_service.py
+
+import asyncio
+from concurrent.futures import Future
+from embedding_model import encode
+import numpy as np
+import os
+import queue
+import threading
+import time
+
+# Upper bounds on how many texts are embedded in one forward pass, and on how long the first
+# request of a batch waits for others to join it.
+embedding_batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+embedding_batch_wait_ms = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+
+
+class EmbeddingService:
+    """
+    Coalesces concurrent embedding requests into batched forward passes on a worker thread.
+
+    Callers get a future per text. The worker takes the first pending request, waits up to
+    `max_wait_ms` for up to `max_batch_size` requests in total, pads them into one model call per
+    task and resolves every future. Running the model on its own thread means an asyncio loop
+    awaiting `embed` never blocks on `torch`.
+    """
+
+    def __init__(self, encode_fn=encode, max_batch_size: int = None, max_wait_ms: float = None) -> None:
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size or embedding_batch_size
+        self.max_wait = (embedding_batch_wait_ms if max_wait_ms is None else max_wait_ms) / 1000
+        self.batches = 0
+        self.requests = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str, task: str = "retrieval.query") -> Future:
+        """Queues `text` for embedding and returns a future resolving to its float32 embedding."""
+        future = Future()
+        self._queue.put((text, task, future))
+        return future
+
+    async def embed(self, text: str, task: str = "retrieval.query") -> np.ndarray:
+        """Embeds `text` without blocking the running event loop."""
+        return await asyncio.wrap_future(self.submit(text, task))
+
+    def close(self) -> None:
+        """Stops the worker once the requests queued so far are served."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self) -> list:
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Serve what was collected, then stop.
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            # Skip requests whose caller gave up while they were queued.
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            by_task: dict[str, list] = {}
+            for text, task, future in batch:
+                by_task.setdefault(task, []).append((text, future))
+
+            for task, items in by_task.items():
+                texts = list(dict.fromkeys(text for text, _ in items))
+                try:
+                    embeddings = self.encode_fn(texts, task=task)
+                except Exception as e:
+                    for _, future in items:
+                        future.set_exception(e)
+                    continue
+                rows = {text: i for i, text in enumerate(texts)}
+                for text, future in items:
+                    future.set_result(np.asarray(embeddings[rows[text]], dtype=np.float32))
+                self.batches += 1
+                self.requests += len(items)
+
+
+_service: EmbeddingService = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """Returns the process-wide embedding service, starting its worker on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService()
+    return _service
@@ -0,0 +1,73 @@
+# event_loop.py
+
+import asyncio
+from concurrent.futures import Future
+import threading
+from typing import AsyncIterator, Coroutine, Iterator
+
+_loop: asyncio.AbstractEventLoop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the process-wide event loop, starting it on a daemon thread on first use.
+
+    The loop lives as long as the process, so everything bound to it (the database pool, the
+    async Claude client, ...) is reused across Streamlit reruns and sessions instead of being
+    rebuilt by an `asyncio.run` per interaction.
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                threading.Thread(target=run, name="event-loop", daemon=True).start()
+                ready.wait()
+                _loop = loop
+    return _loop
+
+
+def submit(coro: Coroutine) -> Future:
+    """Schedules a coroutine on the shared loop from any thread and returns a future for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def run(coro: Coroutine, timeout: float = None):
+    """
+    Runs a coroutine on the shared loop and waits for its result, e.g. from a Streamlit callback.
+
+    The coroutine must not call Streamlit itself: it runs on the loop's thread, which has no
+    script context. Raises whatever the coroutine raises.
+    """
+    future = submit(coro)
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def iterate(agen: AsyncIterator) -> Iterator:
+    """
+    Consumes an async generator on the shared loop, yielding its items in the calling thread.
+
+    This lets a Streamlit script render a stream (such as Claude's answer) item by item.
+    """
+    try:
+        while True:
+            try:
+                yield run(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        aclose = getattr(agen, "aclose", None)
+        if aclose is not None:
+            run(aclose())
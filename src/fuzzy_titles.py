@@ -0,0 +1,103 @@
+# fuzzy_titles.py
+
+import numpy as np
+import os
+from rapidfuzz import fuzz, process
+import re
+from text_search import STOPWORDS
+from unidecode import unidecode
+
+# Minimum similarity (0-100) of a fuzzy title match, and the maximum number of titles a query
+# is compared to (see `FuzzyTitleIndex`).
+fuzzy_score_cutoff = float(os.getenv("FUZZY_SCORE_CUTOFF", "70"))
+fuzzy_max_candidates = int(os.getenv("FUZZY_MAX_CANDIDATES", "2000"))
+
+
+def normalize_title(title: str) -> str:
+    """Transliterates `title` to ASCII, lowercases it and keeps only its words, single spaced."""
+    return " ".join(re.findall(r"[a-z0-9]+", unidecode(title or "").lower()))
+
+
+def title_grams(title: str) -> set[str]:
+    """The trigrams of the words of a normalized title except stopwords, padded like `pg_trgm`."""
+    grams = set()
+    for word in title.split():
+        if word not in STOPWORDS:
+            padded = f"  {word} "
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class FuzzyTitleIndex:
+    """
+    Typo-tolerant title lookup in memory, with rapidfuzz.
+
+    Titles are normalized once (see `normalize_title`) and indexed by the trigrams of their
+    words (q-gram blocking). A query is only compared to the titles sharing at least one
+    trigram with it, and at most `max_candidates` of them, those sharing the most trigrams.
+    A typo changes only the few trigrams around it, so the right title keeps most of its
+    trigrams in common with the query. The candidates are scored in one `process.cdist` call
+    spread over all cores. The work per query is bounded by the candidate cap whatever the
+    size of the collection, and every page of a query is cut from the same candidates.
+    """
+
+    def __init__(self, papers: list[dict], max_candidates: int = None, scorer=fuzz.WRatio) -> None:
+        """
+        Args:
+            papers (list[dict]): The papers, with at least 'title' and optionally 'relevance'.
+                                 Search results are row numbers into this list.
+            max_candidates (int): The maximum number of titles a query is compared to. Defaults
+                                  to FUZZY_MAX_CANDIDATES.
+            scorer: The rapidfuzz scorer. Defaults to `fuzz.WRatio`, which tolerates both typos
+                    and a query that is only part of the title.
+        """
+        self.papers = papers
+        self.max_candidates = max_candidates or fuzzy_max_candidates
+        self.scorer = scorer
+        self.titles = [normalize_title(p.get("title")) for p in papers]
+        self.relevance = np.array([p.get("relevance") or 0.0 for p in papers], dtype=np.float32)
+
+        blocks: dict[str, list[int]] = {}
+        for row, title in enumerate(self.titles):
+            for gram in title_grams(title):
+                blocks.setdefault(gram, []).append(row)
+        self.blocks = {gram: np.array(rows, dtype=np.int64) for gram, rows in blocks.items()}
+
+    def _candidates(self, query: str) -> np.ndarray:
+        """The rows of the titles sharing the most trigrams with `query`, at most `max_candidates`."""
+        postings = [self.blocks[gram] for gram in title_grams(query) if gram in self.blocks]
+        if not postings:
+            return np.empty(0, dtype=np.int64)
+        rows, shared = np.unique(np.concatenate(postings), return_counts=True)
+        if len(rows) > self.max_candidates:
+            rows = np.sort(rows[np.lexsort((rows, -shared))[:self.max_candidates]])
+        return rows
+
+    def _score(self, query: str, rows: np.ndarray, score_cutoff: float) -> tuple[np.ndarray, np.ndarray]:
+        scores = process.cdist([query], [self.titles[row] for row in rows], scorer=self.scorer,
+                               score_cutoff=score_cutoff, dtype=np.float32, workers=-1)[0]
+        keep = scores >= score_cutoff
+        return rows[keep], scores[keep]
+
+    def search(self, query: str, k: int = 20, offset: int = 0, score_cutoff: float = None) -> list[tuple[int, float]]:
+        """
+        Finds the papers whose title is similar to `query`, despite typos, accents or case.
+
+        Args:
+            query (str): The (approximate) title or part of a title.
+            k (int): The page size.
+            offset (int): The number of matches to skip.
+            score_cutoff (float): The minimum similarity, from 0 to 100. Defaults to FUZZY_SCORE_CUTOFF.
+
+        Returns:
+            list[tuple[int, float]]: (row, score) pairs of one page of matches, by decreasing
+                                     score, then decreasing relevance.
+        """
+        query = normalize_title(query)
+        score_cutoff = fuzzy_score_cutoff if score_cutoff is None else score_cutoff
+        rows = self._candidates(query)
+        if not len(rows):
+            return []
+        rows, scores = self._score(query, rows, score_cutoff)
+        order = np.lexsort((rows, -self.relevance[rows], -scores))[offset:offset + k]
+        return [(int(rows[i]), float(scores[i])) for i in order]
@@ -0,0 +1,64 @@
+# import_budget.py
+
+import argparse
+import os
+import subprocess
+import sys
+
+# The modules main_page.py imports, directly or when a page is opened.
+DEFAULT_MODULES = ["embedding_model", "query_page", "text_matching_page", "python_sample_graph_app"]
+
+# Cumulative import time allowed for all of them, in milliseconds.
+default_budget_ms = float(os.getenv("IMPORT_BUDGET_MS", "3000"))
+
+
+def measure_import_times(modules: list[str]) -> list[tuple[str, float]]:
+    """
+    Imports `modules` in a fresh interpreter with `python -X importtime`.
+
+    Returns:
+        list[tuple[str, float]]: (module, cumulative milliseconds) for every top-level import,
+                                 slowest first.
+    """
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+        cwd=src_dir, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {modules} failed:\n{result.stderr[-2000:]}")
+
+    times = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented, keep the ones made directly by the -c statement.
+        if not name.startswith(" ") or name.startswith("  "):
+            continue
+        times.append((name.strip(), int(cumulative) / 1000))
+    return sorted(times, key=lambda t: t[1], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the Streamlit entry point against a budget.")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--budget-ms", type=float, default=default_budget_ms)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    times = measure_import_times(args.modules)
+    total = sum(t for _, t in times)
+    for name, ms in times[:args.top]:
+        print(f"{ms:10.1f} ms  {name}")
+    print(f"{total:10.1f} ms  total (budget {args.budget_ms:.0f} ms)")
+
+    heavy = [name for name, _ in times if name.split(".")[0] in ("torch", "transformers")]
+    if heavy:
+        print(f"Model libraries imported eagerly: {', '.join(heavy)}")
+    if total > args.budget_ms or heavy:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
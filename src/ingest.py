@@ -0,0 +1,353 @@
+# ingest.py
+
+import argparse
+import asyncio
+import csv
+from database_indexes import create_text_indexes, create_vector_indexes, drop_text_indexes, drop_vector_indexes
+from database_pool import acquire, close_pool
+import glob
+from itertools import islice
+import json
+import numpy as np
+import os
+import re
+import time
+from typing import Iterator
+
+# Source rows loaded per COPY and transaction. Progress is checkpointed after every chunk.
+ingest_chunk_rows = int(os.getenv("INGEST_CHUNK_ROWS", "5000"))
+
+PAPER_COLUMNS = ["doi", "id", "title", "abstract", "relevance", "embedding", "title_embedding"]
+CITATION_COLUMNS = ["source_paper", "cited_by"]
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def _iter_json_array(f, chunk_size: int = 1 << 20) -> Iterator:
+    """
+    Yields the elements of the JSON array in the text file `f`, decoding the file chunk by chunk.
+
+    Only the element being decoded and about one chunk of the file are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+
+    def fill() -> None:
+        nonlocal buffer, pos, eof
+        chunk = f.read(chunk_size)
+        buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+
+    def next_char() -> str:
+        # The next non-whitespace character, which `pos` is moved to.
+        nonlocal pos
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if eof:
+                raise json.JSONDecodeError("Unterminated array", buffer, pos)
+            fill()
+
+    if next_char() != "[":
+        raise json.JSONDecodeError("Expecting '['", buffer, pos)
+    pos += 1
+    if next_char() == "]":
+        return
+    while True:
+        next_char()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # A number cut by the end of the chunk decodes too, so the value is only complete
+                # once its delimiter has been read.
+                after = WHITESPACE.match(buffer, end).end()
+                if eof or buffer[after:after + 1] in (",", "]"):
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+        pos = end
+        yield value
+        delimiter = next_char()
+        pos += 1
+        if delimiter == "]":
+            return
+        if delimiter != ",":
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos - 1)
+
+
+def _records(data) -> Iterator[dict]:
+    # A pandas `to_json` dump holds one dict per column, anything else is a single record.
+    columns = [c for c in data.values() if isinstance(c, dict)]
+    if not data or len(columns) != len(data):
+        yield data
+        return
+    for index in columns[0]:
+        yield {name: column.get(index) for name, column in data.items()}
+
+
+def read_papers(path: str) -> Iterator[dict]:
+    """
+    Reads paper records from a JSON file, without loading the whole file for the large formats.
+
+    Accepts a JSON array of records, JSON lines (one record per line), or a pandas `to_json`
+    dump ({column: {index: value}}). Arrays are decoded incrementally and JSON lines line by
+    line. A pandas dump has to be decoded at once, so it is only suitable for small files.
+    Records are yielded in file order, which is also the row order of the embedding files (see
+    `ingest_papers`).
+    """
+    with open(path) as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            yield from _iter_json_array(f)
+            return
+
+        lines = (line for line in f if line.strip())
+        line = next(lines, None)
+        if line is None:
+            return
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError:
+            # A single value spread over several lines.
+            f.seek(0)
+            yield from _records(json.load(f))
+            return
+        line = next(lines, None)
+        if line is None:
+            # A single line: one record or a compact pandas dump.
+            yield from _records(data)
+            return
+        yield data
+        yield json.loads(line)
+        yield from (json.loads(line) for line in lines)
+
+
+def read_pagerank(path: str) -> dict[str, float]:
+    """Reads the `Paper,PageRank` CSV written by the citation analysis into a doi -> relevance dict."""
+    with open(path, newline="") as f:
+        return {row["Paper"]: float(row["PageRank"] or 0) for row in csv.DictReader(f)}
+
+
+def _chunks(rows: Iterator, size: int) -> Iterator[list]:
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+async def ensure_ingest_tables(conn, dimensions: int = 1024) -> None:
+    """Creates the `papers`, `citations` and `ingest_checkpoints` tables if they do not exist."""
+    await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    await conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS papers(
+            doi TEXT PRIMARY KEY,
+            id TEXT,
+            title TEXT,
+            abstract TEXT,
+            content TEXT,
+            citation_text TEXT,
+            embedding vector({int(dimensions)}),
+            title_embedding vector({int(dimensions)}),
+            relevance REAL)
+        """
+    )
+    await conn.execute("CREATE TABLE IF NOT EXISTS citations(source_paper TEXT, cited_by TEXT)")
+    # The change-tracking column of `database_endpoints.ensure_citation_tracking`.
+    await conn.execute("ALTER TABLE citations ADD COLUMN IF NOT EXISTS id BIGSERIAL")
+    await conn.execute("CREATE INDEX IF NOT EXISTS citations_id_idx ON citations (id)")
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ingest_checkpoints(
+            source TEXT PRIMARY KEY,
+            rows_done BIGINT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now())
+        """
+    )
+
+
+async def _get_checkpoint(conn, source: str) -> int:
+    return await conn.fetchval("SELECT rows_done FROM ingest_checkpoints WHERE source = $1", source) or 0
+
+
+async def _set_checkpoint(conn, source: str, rows_done: int) -> None:
+    await conn.execute(
+        """
+        INSERT INTO ingest_checkpoints (source, rows_done) VALUES ($1, $2)
+        ON CONFLICT (source) DO UPDATE SET rows_done = EXCLUDED.rows_done, updated_at = now()
+        """,
+        source, rows_done
+    )
+
+
+def _report(source: str, rows_done: int, loaded: int, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    print(f"{source}: {rows_done} rows done, {loaded} loaded ({loaded / max(elapsed, 1e-9):.0f} rows/s)")
+
+
+async def ingest_papers(path: str, embeddings: str = None, title_embeddings: str = None, pagerank: str = None,
+                        chunk_rows: int = None) -> int:
+    """
+    Loads papers and their embeddings into the `papers` table with COPY.
+
+    Every chunk is copied into a temporary table with `copy_records_to_table`, which sends the
+    vectors in pgvector's binary format, and then upserted into `papers` on `doi`. Existing
+    values are kept for the columns the input does not provide, so embeddings or relevance can
+    be (re)loaded on their own. The number of source records done is stored in
+    `ingest_checkpoints` in the same transaction as the rows, so an interrupted load resumes
+    after its last committed chunk, without duplicates.
+
+    Args:
+        path (str): The papers JSON (see `read_papers`), with 'doi', 'id', 'title' and 'abstract'.
+                    Records without a doi are skipped.
+        embeddings (str, optional): A `.npy` file of abstract embeddings, whose row i belongs to
+                                    the i-th record of `path` (see `embed_corpus.py`).
+        title_embeddings (str, optional): A `.npy` file of title embeddings, aligned the same way.
+        pagerank (str, optional): A `Paper,PageRank` CSV, loaded as `relevance` (0 for the
+                                  papers it does not list).
+        chunk_rows (int, optional): Records per chunk. Defaults to INGEST_CHUNK_ROWS.
+
+    Returns:
+        int: The number of papers loaded by this call.
+    """
+    chunk_rows = chunk_rows or ingest_chunk_rows
+    vectors = np.load(embeddings, mmap_mode="r") if embeddings else None
+    title_vectors = np.load(title_embeddings, mmap_mode="r") if title_embeddings else None
+    relevance = read_pagerank(pagerank) if pagerank else None
+    dimensions = next((v.shape[1] for v in (vectors, title_vectors) if v is not None), 1024)
+    source = f"papers:{os.path.realpath(path)}"
+
+    started = time.perf_counter()
+    loaded = 0
+    async with acquire() as conn:
+        await ensure_ingest_tables(conn, dimensions)
+        # Each chunk commits together with its checkpoint, so a crash can only lose whole chunks.
+        await conn.execute("SET synchronous_commit TO off")
+        rows_done = await _get_checkpoint(conn, source)
+        if rows_done:
+            print(f"{source}: resuming after {rows_done} rows")
+
+        for chunk in _chunks(islice(read_papers(path), rows_done, None), chunk_rows):
+            start, end = rows_done, rows_done + len(chunk)
+            for name, array in (("embeddings", vectors), ("title embeddings", title_vectors)):
+                if array is not None and len(array) < end:
+                    raise ValueError(f"The {name} have {len(array)} rows, fewer than the papers in {path}")
+            chunk_vectors = np.asarray(vectors[start:end], dtype=np.float32) if vectors is not None else None
+            chunk_title_vectors = np.asarray(title_vectors[start:end], dtype=np.float32) if title_vectors is not None else None
+
+            records = []
+            for i, paper in enumerate(chunk):
+                doi = paper.get("doi")
+                if not doi:
+                    continue
+                records.append((
+                    str(doi),
+                    str(paper["id"]) if paper.get("id") is not None else None,
+                    paper.get("title"),
+                    paper.get("abstract"),
+                    relevance.get(doi, 0.0) if relevance is not None else None,
+                    chunk_vectors[i] if chunk_vectors is not None else None,
+                    chunk_title_vectors[i] if chunk_title_vectors is not None else None,
+                ))
+
+            async with conn.transaction():
+                await conn.execute("CREATE TEMP TABLE papers_stage (LIKE papers) ON COMMIT DROP")
+                await conn.copy_records_to_table("papers_stage", records=records, columns=PAPER_COLUMNS)
+                await conn.execute(
+                    """
+                    INSERT INTO papers (doi, id, title, abstract, relevance, embedding, title_embedding)
+                    SELECT DISTINCT ON (doi) doi, id, title, abstract, relevance, embedding, title_embedding
+                    FROM papers_stage
+                    ORDER BY doi
+                    ON CONFLICT (doi) DO UPDATE SET
+                        id = coalesce(EXCLUDED.id, papers.id),
+                        title = coalesce(EXCLUDED.title, papers.title),
+                        abstract = coalesce(EXCLUDED.abstract, papers.abstract),
+                        relevance = coalesce(EXCLUDED.relevance, papers.relevance),
+                        embedding = coalesce(EXCLUDED.embedding, papers.embedding),
+                        title_embedding = coalesce(EXCLUDED.title_embedding, papers.title_embedding)
+                    """
+                )
+                await _set_checkpoint(conn, source, end)
+            rows_done = end
+            loaded += len(records)
+            _report(source, rows_done, loaded, started)
+        await conn.execute("ANALYZE papers")
+    return loaded
+
+
+def read_citations(path: str) -> Iterator[tuple[str, str]]:
+    """Reads the (source_paper, cited_by) pairs of a citation shard, in file order."""
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            yield row.get("source_paper"), row.get("cited_by")
+
+
+async def ingest_citations(pattern: str = "data/citation_connections_*.csv", chunk_rows: int = None) -> int:
+    """
+    Loads the citation shards into the `citations` table with COPY.
+
+    Shards are loaded in sorted order, each chunk in one transaction together with its
+    checkpoint, so rerunning the command skips the shards and rows already loaded.
+
+    Args:
+        pattern (str): Glob matching the shard files written by `document_extraction/citation_search.py`.
+        chunk_rows (int, optional): Rows per chunk. Defaults to INGEST_CHUNK_ROWS.
+
+    Returns:
+        int: The number of citations loaded by this call.
+    """
+    chunk_rows = chunk_rows or ingest_chunk_rows
+    started = time.perf_counter()
+    loaded = 0
+    async with acquire() as conn:
+        await ensure_ingest_tables(conn)
+        await conn.execute("SET synchronous_commit TO off")
+        for path in sorted(glob.glob(pattern)):
+            source = f"citations:{os.path.realpath(path)}"
+            rows_done = await _get_checkpoint(conn, source)
+            for chunk in _chunks(islice(read_citations(path), rows_done, None), chunk_rows):
+                records = [(source_paper, cited_by) for source_paper, cited_by in chunk if source_paper and cited_by]
+                async with conn.transaction():
+                    await conn.copy_records_to_table("citations", records=records, columns=CITATION_COLUMNS)
+                    await _set_checkpoint(conn, source, rows_done + len(chunk))
+                rows_done += len(chunk)
+                loaded += len(records)
+                _report(source, rows_done, loaded, started)
+        await conn.execute("ANALYZE citations")
+    return loaded
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bulk load papers, embeddings and citations into Postgres with COPY.")
+    parser.add_argument("--papers", help="papers JSON, e.g. data/ml_papers.json")
+    parser.add_argument("--embeddings", help=".npy abstract embeddings, one row per record of --papers")
+    parser.add_argument("--title-embeddings", help=".npy title embeddings, one row per record of --papers")
+    parser.add_argument("--pagerank", help="PageRank CSV loaded as relevance, e.g. data/pagerank_results.csv")
+    parser.add_argument("--citations", help="glob of citation CSV shards, e.g. 'data/citation_connections_*.csv'")
+    parser.add_argument("--chunk-rows", type=int, default=None)
+    parser.add_argument("--drop-indexes", action="store_true",
+                        help="drop the ANN and text indexes before loading, which makes large loads much faster")
+    parser.add_argument("--no-indexes", action="store_true", help="do not build the indexes after loading")
+    parser.add_argument("--index-method", choices=["hnsw", "ivfflat"], default="hnsw")
+    args = parser.parse_args()
+    if not args.papers and not args.citations:
+        parser.error("nothing to load, give --papers and/or --citations")
+
+    if args.drop_indexes:
+        await drop_vector_indexes()
+        await drop_text_indexes()
+    if args.papers:
+        print(f"Loaded {await ingest_papers(args.papers, args.embeddings, args.title_embeddings, args.pagerank, args.chunk_rows)} papers")
+    if args.citations:
+        print(f"Loaded {await ingest_citations(args.citations, args.chunk_rows)} citations")
+    # Indexes are built once over the loaded rows instead of being maintained row by row.
+    if args.papers and not args.no_indexes:
+        print(await create_vector_indexes(args.index_method))
+        print(await create_text_indexes())
+    await close_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
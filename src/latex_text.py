@@ -0,0 +1,236 @@
+# latex_text.py
+
+import argparse
+import math
+import os
+import re
+from tiered_cache import TieredCache
+
+# Target size of a chunk, and the chunk cache: in-memory papers and an optional SQLite file.
+chunk_tokens = int(os.getenv("CHUNK_TOKENS", "512"))
+chunk_cache_size = int(os.getenv("CHUNK_CACHE_SIZE", "256"))
+chunk_cache_path = os.getenv("CHUNK_CACHE_PATH")
+
+# Rough number of characters per token of English text, used for token estimates.
+CHARS_PER_TOKEN = 4
+# Bumped whenever the cleanup or chunking changes, so stale cached chunks are not reused.
+PIPELINE_VERSION = 1
+
+# Environments dropped with their content: floats, bibliographies, code and display math.
+DROPPED_ENVIRONMENTS = (
+    "figure", "table", "wrapfigure", "tikzpicture", "thebibliography", "algorithm", "algorithmic",
+    "lstlisting", "verbatim", "minted", "comment", "equation", "align", "gather", "multline",
+    "eqnarray", "displaymath", "tabular",
+)
+# Commands dropped with their arguments.
+DROPPED_COMMANDS = (
+    "label", "ref", "eqref", "autoref", "cref", "Cref", "pageref", "cite", "citep", "citet", "citealp",
+    "citeauthor", "citeyear", "nocite", "includegraphics", "bibliography", "bibliographystyle",
+    "input", "include", "vspace", "hspace", "newcommand", "renewcommand", "providecommand",
+    "DeclareMathOperator", "newtheorem", "usepackage", "documentclass", "setlength", "addtolength",
+    "thanks", "affiliation", "email", "address", "author", "date", "url", "href",
+)
+SECTION_COMMANDS = ("chapter", "section")
+
+_BRACED = r"\{((?:[^{}]|\{(?:[^{}]|\{[^{}]*\})*\})*)\}"
+_SECTION_MARK = "\x00SECTION\x00"
+
+_chunk_cache: TieredCache = None
+
+
+class Chunk:
+    def __init__(self, paper_id: str, index: int, section: str, text: str) -> None:
+        self.paper_id: str = paper_id
+        self.index: int = index
+        self.section: str = section
+        self.text: str = text
+        self.tokens: int = estimate_tokens(text)
+
+    def __repr__(self):
+        return f"paper_id: {self.paper_id}, index: {self.index}, section: {self.section}, tokens: {self.tokens}\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of LLM tokens of `text` from its length."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def latex_to_text(tex: str) -> str:
+    """
+    Reduces LaTeX source to its readable content.
+
+    Comments, preambles, macro definitions, floats, display math, bibliographies and references
+    are removed, and formatting commands are replaced by their content. Section headings are
+    kept as markers that `split_sections` splits on, and paragraphs stay separated by blank
+    lines.
+    """
+    text = re.sub(r"(?<!\\)%.*", "", tex)
+    text = re.sub(r"\\documentclass.*?\\begin\{document\}", "", text, flags=re.S)
+    text = re.sub(r"\\end\{document\}", "", text)
+
+    environments = "|".join(DROPPED_ENVIRONMENTS)
+    text = re.sub(r"\\begin\{((?:" + environments + r")\*?)\}.*?\\end\{\1\}", "\n", text, flags=re.S)
+    text = re.sub(r"\\\[.*?\\\]|\$\$.*?\$\$", " ", text, flags=re.S)
+    text = re.sub(r"\\(?:def|let)\\[a-zA-Z@]+[^{\n]*(?:" + _BRACED + ")?", "", text)
+
+    sections = "|".join(SECTION_COMMANDS)
+    text = re.sub(r"\\(?:" + sections + r")(?![a-zA-Z])\*?(?:\[[^\]]*\])?" + _BRACED,
+                  lambda m: f"\n\n{_SECTION_MARK}{' '.join(m.group(1).split())}\n\n", text)
+    text = re.sub(r"\\(?:sub)+section\*?(?:\[[^\]]*\])?" + _BRACED, lambda m: f"\n\n{m.group(1)}.\n\n", text)
+    text = re.sub(r"\\paragraph\*?" + _BRACED, r"\n\n\1. ", text)
+    text = re.sub(r"\\footnote(?:\[[^\]]*\])?" + _BRACED, r" (\1)", text)
+
+    dropped = "|".join(DROPPED_COMMANDS)
+    text = re.sub(r"\\(?:" + dropped + r")(?![a-zA-Z])\*?(?:\[[^\]]*\])*(?:" + _BRACED + r")*", "", text)
+    text = re.sub(r"\\begin\{abstract\}", f"\n\n{_SECTION_MARK}Abstract\n\n", text)
+    text = re.sub(r"\\(?:begin|end)\{[^}]*\}(?:\[[^\]]*\])?", "\n", text)
+    text = re.sub(r"\\item\s*(?:\[([^\]]*)\])?", lambda m: f"\n- {m.group(1) + ' ' if m.group(1) else ''}", text)
+
+    # Formatting commands keep their content, innermost first.
+    previous = None
+    while previous != text:
+        previous = text
+        text = re.sub(r"\\[a-zA-Z]+\*?(?:\[[^\]]*\])?\{([^{}]*)\}", r"\1", text)
+    text = re.sub(r"\\\\|\\newline", "\n", text)
+    text = re.sub(r"\\([%&$#_{}])", r"\1", text)
+    text = re.sub(r"\\[a-zA-Z@]+\*?", "", text)
+    text = text.replace("~", " ").replace("{", "").replace("}", "")
+
+    paragraphs = (" ".join(p.split()) for p in re.split(r"\n\s*\n", text))
+    return "\n\n".join(p for p in paragraphs if p)
+
+
+def split_sections(text: str) -> list[tuple[str, str]]:
+    """Splits the output of `latex_to_text` into (section title, body) pairs. Text before the first section has an empty title."""
+    parts = text.split(_SECTION_MARK)
+    sections = [("", parts[0].strip())] if parts[0].strip() else []
+    for part in parts[1:]:
+        title, _, body = part.partition("\n\n")
+        if body.strip():
+            sections.append((title.strip(), body.strip()))
+    return sections
+
+
+def _split_long(paragraph: str, max_chars: int) -> list[str]:
+    """Splits a paragraph longer than `max_chars` at sentence ends, or at spaces if a sentence is too long."""
+    pieces, current = [], ""
+    for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_text(paper_id: str, text: str, max_tokens: int = None) -> list[Chunk]:
+    """
+    Splits the output of `latex_to_text` into chunks of at most about `max_tokens` tokens.
+
+    Chunks never span two sections. Within a section, whole paragraphs are packed together and
+    only paragraphs that are too long on their own are split.
+    """
+    max_chars = (max_tokens or chunk_tokens) * CHARS_PER_TOKEN
+    chunks = []
+    for section, body in split_sections(text):
+        current = ""
+        for paragraph in body.split("\n\n"):
+            for piece in _split_long(paragraph, max_chars) if len(paragraph) > max_chars else [paragraph]:
+                if current and len(current) + 2 + len(piece) > max_chars:
+                    chunks.append(Chunk(paper_id, len(chunks), section, current))
+                    current = piece
+                else:
+                    current = f"{current}\n\n{piece}" if current else piece
+        if current:
+            chunks.append(Chunk(paper_id, len(chunks), section, current))
+    return chunks
+
+
+def get_chunk_cache() -> TieredCache:
+    """Returns the process-wide chunk cache, configured from the CHUNK_CACHE_* variables."""
+    global _chunk_cache
+    if _chunk_cache is None:
+        _chunk_cache = TieredCache(chunk_cache_size, path=chunk_cache_path)
+    return _chunk_cache
+
+
+def prepare_document(paper_id: str, tex: str, max_tokens: int = None) -> list[Chunk]:
+    """
+    Converts the LaTeX source of a paper into chunks, reusing cached chunks of the same source.
+
+    Args:
+        paper_id (str): The id of the paper, as returned by `get_whole_documents`.
+        tex (str): Its LaTeX source.
+        max_tokens (int, optional): The target chunk size. Defaults to CHUNK_TOKENS.
+
+    Returns:
+        list[Chunk]: The chunks of the paper in reading order.
+    """
+    max_tokens = max_tokens or chunk_tokens
+    cache = get_chunk_cache()
+    # Keyed by content, so a new version of a paper is never served stale chunks.
+    key = TieredCache.make_key("chunks", PIPELINE_VERSION, max_tokens, paper_id, TieredCache.make_key(tex))
+    chunks = cache.get(key)
+    if chunks is None:
+        chunks = chunk_text(paper_id, latex_to_text(tex), max_tokens)
+        cache.set(key, chunks)
+    return chunks
+
+
+def prepare_documents(documents: dict[str, str], max_tokens: int = None) -> dict[str, list[Chunk]]:
+    """Applies `prepare_document` to the output of `get_whole_documents`, and prints the token savings."""
+    prepared = {paper_id: prepare_document(paper_id, tex, max_tokens) for paper_id, tex in documents.items()}
+    raw_tokens = sum(estimate_tokens(tex) for tex in documents.values())
+    text_tokens = sum(chunk.tokens for chunks in prepared.values() for chunk in chunks)
+    print(f"Prepared {len(documents)} documents: ~{raw_tokens} tokens of LaTeX, ~{text_tokens} tokens of text")
+    return prepared
+
+
+def chunks_to_text(chunks: list[Chunk]) -> str:
+    """Joins chunks back into a document for the LLM context, with a heading per section."""
+    parts, section = [], None
+    for chunk in chunks:
+        if chunk.section != section:
+            section = chunk.section
+            if section:
+                parts.append(f"SECTION: {section}")
+        parts.append(chunk.text)
+    return "\n\n".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the chunks and token estimates of arXiv papers or .tex files.")
+    parser.add_argument("sources", nargs="+", help="arXiv ids or paths of .tex files")
+    parser.add_argument("--max-tokens", type=int, default=None)
+    parser.add_argument("--show", action="store_true", help="print the chunks")
+    args = parser.parse_args()
+
+    documents = {}
+    for source in args.sources:
+        if os.path.exists(source):
+            with open(source, "r", errors="replace") as f:
+                documents[source] = f.read()
+    ids = [source for source in args.sources if source not in documents]
+    if ids:
+        from query_arxiv import get_whole_documents
+        documents.update(get_whole_documents(ids))
+
+    for paper_id, chunks in prepare_documents(documents, args.max_tokens).items():
+        print(f"{paper_id}: ~{estimate_tokens(documents[paper_id])} tokens of LaTeX, "
+              f"~{sum(chunk.tokens for chunk in chunks)} tokens of text in {len(chunks)} chunks")
+        if args.show:
+            for chunk in chunks:
+                print(f"--- {chunk.index} [{chunk.section}] ~{chunk.tokens} tokens\n{chunk.text}")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,13 @@
 # main_page.py
 import streamlit as st
-import streamlit as st
-import asyncio
-from database_endpoints import get_papers, get_related_papers
-from query_arxiv import get_whole_documents
-from anthropic_client import AnthropicClient
+from embedding_model import prewarm
 import os
 
+# Page modules (and the database and model code behind them) are only imported when their page
+# is opened. The embedding model is loaded in the background so the first query does not wait.
+if os.getenv("EMBEDDING_PREWARM", "1") == "1":
+    prewarm()
+
 # Function to switch pages using session state
 def switch_page(page):
     st.session_state.active_page = page
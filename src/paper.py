@@ -0,0 +1,35 @@
+# paper.py
+
+class Paper:
+    def __init__(self, doi, id:str=None, title:str=None, abstract:str=None, similarity:float=None, title_similarity:float=None, date:str=None, content:str=None, text_rank:float=None, relevance:float=None, hybrid_score:float=None) -> None:
+        self.id: str = id
+        self.doi: str = doi
+        self.title: str = title
+        self.abstract: str = abstract
+        self.similarity: float = similarity
+        self.title_similarity: float = title_similarity
+        self.date = date
+        self.content: str = content
+        self.text_rank: float = text_rank
+        self.relevance: float = relevance
+        self.hybrid_score: float = hybrid_score
+    
+    def from_dict(object: dict) -> None:
+        return Paper(doi=object.get('doi'),
+                       id=object.get('id', None),
+                       abstract=object.get('abstract', None),
+                       title=object.get('title', None),
+                       similarity=object.get('similarity', None),
+                       title_similarity=object.get('title_similarity', None),
+                       content=object.get('content', None),
+                       date=object.get('date', None),
+                       text_rank=object.get('text_rank', None),
+                       relevance=object.get('relevance', None),
+                       hybrid_score=object.get('hybrid_score', None)
+        )
+
+    def __str__(self) -> str:
+        return f"doi: {self.doi}"
+    
+    def __repr__(self):
+        return f"doi: {self.doi}, id: {self.id}, title: {self.title}\n"
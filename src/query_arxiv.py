@@ -1,9 +1,27 @@
 import arxiv
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from document_cache import DocumentCache, get_document_cache
+import gzip
+import io
 import json
 import tarfile
 # import requests
 import os
-import shutil
+import re
+import urllib.request
+
+# Maximum number of papers downloaded and extracted at the same time.
+arxiv_max_workers = int(os.getenv("ARXIV_MAX_WORKERS", "4"))
+# Maximum amount of LaTeX read from the source of one paper. Larger sources are truncated.
+arxiv_max_document_mb = float(os.getenv("ARXIV_MAX_DOCUMENT_MB", "10"))
+arxiv_download_timeout = float(os.getenv("ARXIV_DOWNLOAD_TIMEOUT", "60"))
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class NoLatexSource(Exception):
+    """The source served for a paper is not gzipped LaTeX, e.g. the PDF of a PDF-only submission."""
 
 
 # Function to search arXiv using IDs
@@ -18,51 +36,223 @@ def search_arxiv_by_id(ids, client):
     return results
 
 
-def extract_tex_files(tar_path, extract_path='.', max_retries=5):
-    """Extract .tex files from a tar.gz archive and return a list of extracted file paths."""
-    tex_file_paths = []  # List to store paths of extracted .tex files
-    retry_count = 0
-    
-    while retry_count < max_retries:
+def iter_tex_members(fileobj, paper_id, max_bytes=None):
+    """
+    Streams the .tex files out of a gzipped arXiv source, without writing anything to disk.
+
+    The source is read front to back exactly once, so `fileobj` can be an HTTP response. arXiv
+    serves either a tarball or, for single-file submissions, the gzipped .tex file itself.
+
+    Args:
+        fileobj: A binary file-like object with the gzipped source.
+        paper_id (str): The id the yielded records are tagged with.
+        max_bytes (int, optional): The maximum total size of the .tex files read from this
+                                   source (ARXIV_MAX_DOCUMENT_MB by default). Files past the
+                                   cap are truncated or skipped.
+
+    Yields:
+        tuple[str, str, str]: (paper_id, member name, decoded text), in archive order.
+
+    Raises:
+        NoLatexSource: If the source is not gzipped at all.
+        EOFError: If the source ends early, e.g. because the download was cut off.
+    """
+    remaining = max_bytes or int(arxiv_max_document_mb * 1024 * 1024)
+    if not hasattr(fileobj, "peek"):
+        fileobj = io.BufferedReader(fileobj)
+    magic = fileobj.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)]
+    if len(magic) < len(GZIP_MAGIC):
+        raise EOFError(f"The source of {paper_id} ended after {len(magic)} bytes")
+    if magic != GZIP_MAGIC:
+        raise NoLatexSource(f"The source of {paper_id} is not gzipped")
+    stream = io.BufferedReader(gzip.GzipFile(fileobj=fileobj, mode="rb"))
+    header = stream.peek(tarfile.BLOCKSIZE)[:tarfile.BLOCKSIZE]
+
+    if header[257:262] != b"ustar":
+        # A single gzipped .tex file
+        data = stream.read(remaining + 1)
+        if len(data) > remaining:
+            print(f'Truncated the source of {paper_id} to {remaining} bytes')
+        yield paper_id, f"{paper_id}.tex", data[:remaining].decode("utf-8", errors="replace")
+        return
+
+    with tarfile.open(fileobj=stream, mode="r|") as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.endswith(".tex"):
+                continue
+            if remaining <= 0:
+                print(f'Skipped {member.name} of {paper_id}: size cap reached')
+                continue
+            data = tar.extractfile(member).read(remaining)
+            remaining -= len(data)
+            yield paper_id, member.name, data.decode("utf-8", errors="replace")
+
+
+def stream_tex_files(paper, max_bytes=None, timeout=None):
+    """
+    Downloads the source of an arXiv paper and lazily yields its .tex files.
+
+    Yields:
+        tuple[str, str, str]: (short id with version, member name, decoded text).
+    """
+    # Sources are served from export.arxiv.org, as `arxiv.Result.download_source` does.
+    url = paper.pdf_url.replace("/pdf/", "/src/").replace("//arxiv.org/", "//export.arxiv.org/")
+    with urllib.request.urlopen(url, timeout=timeout or arxiv_download_timeout) as response:
+        yield from iter_tex_members(response, paper.get_short_id(), max_bytes=max_bytes)
+
+
+def _strip_version(arxiv_id: str) -> str:
+    return re.sub(r"v\d+$", "", arxiv_id)
+
+
+def _lookup_papers(ids, client) -> dict:
+    """
+    Looks up the arXiv metadata of `ids` and maps each requested id to its result.
+
+    The ids are looked up in one request. If that fails, for example because one id is malformed,
+    they are looked up one at a time so the other papers are still found.
+    """
+    try:
+        results = search_arxiv_by_id(ids, client)
+    except Exception as e:
+        print(f'Batch lookup failed ({e}), looking papers up one at a time')
+        results = []
+        for arxiv_id in ids:
+            try:
+                results.extend(search_arxiv_by_id([arxiv_id], client))
+            except Exception as e:
+                print(f'Error looking up {arxiv_id}: {e}')
+
+    by_id = {}
+    for paper in results:
+        short_id = paper.get_short_id()
+        by_id[short_id] = paper
+        by_id.setdefault(_strip_version(short_id), paper)
+    return {arxiv_id: by_id[arxiv_id] for arxiv_id in ids if arxiv_id in by_id}
+
+
+def fetch_document(paper, cache: DocumentCache = None, max_retries=3):
+    """
+    Streams the .tex files of one arXiv paper, joins them and stores the result in the cache.
+
+    A paper without usable source is recorded as missing in the cache, so it is not downloaded
+    again until the entry expires (see `DocumentCache.is_missing`). Failed or truncated downloads
+    and broken archives are retried instead, and never recorded as missing.
+
+    Returns:
+        str: The LaTeX source of the paper. Empty if it has no .tex files.
+    """
+    cache = cache or get_document_cache()
+    short_id = paper.get_short_id()
+    for attempt in range(1, max_retries + 1):
         try:
-            with tarfile.open(tar_path, 'r:gz') as tar:
-                for member in tar.getmembers():
-                    if member.name.endswith('.tex'):
-                        try:
-                            tar.extract(member, path=extract_path)
-                            print(f'Extracted: {member.name}')
-                            
-                            file_path = os.path.join(extract_path, member.name)
-                            tex_file_paths.append(file_path)  # Add extracted file path to list
-                        except Exception as e:
-                            print(f'Error processing {member.name}: {e}')
-            break  # Exit loop if successful
+            texts = [text for _, _, text in stream_tex_files(paper)]
+            break
+        except NoLatexSource as e:
+            # E.g. a PDF-only submission. Retrying does not help.
+            print(f'No LaTeX source for {short_id}: {e}')
+            cache.put_missing(short_id)
+            return ""
         except Exception as e:
-            retry_count += 1
-            print(f'Attempt {retry_count} failed: {e}')
-            if retry_count >= max_retries:
-                print("Max retries reached. Exiting.")
-    
-    return tex_file_paths  # Return the list of extracted .tex files
-
-def get_whole_documents(ids):
+            print(f'Attempt {attempt} for {short_id} failed: {e}')
+            if attempt == max_retries:
+                raise
+    print(f'Extracted {len(texts)} .tex files of {short_id}')
+    if not texts:
+        cache.put_missing(short_id)
+        return ""
+
+    doc = "\n".join(texts) + "\n"
+    cache.put(short_id, doc)
+    return doc
+
+
+def iter_whole_documents(ids, max_workers=None):
+    """
+    Fetches the LaTeX sources of several arXiv papers in parallel.
+
+    Papers already in the document cache are returned without any network request; an id without
+    version matches the newest cached version. Papers recently found to have no source are skipped. The others are fetched on a thread pool of at most
+    `max_workers` threads (ARXIV_MAX_WORKERS by default). Each paper succeeds or fails on its own:
+    a failed download is reported and skipped without affecting the others.
+
+    Args:
+        ids (list[str]): arXiv ids, with or without version. Empty ids are ignored.
+        max_workers (int, optional): The maximum number of concurrent downloads.
+
+    Yields:
+        tuple[str, str]: (requested id, its LaTeX source), cached papers first, then in the order
+                         the downloads complete.
+    """
+    ids = list(dict.fromkeys(i for i in ids if i))
+    if not ids:
+        return
+    cache = get_document_cache()
+    missing = []
+    for arxiv_id in ids:
+        doc = cache.read(arxiv_id)
+        if doc is None:
+            if not cache.is_missing(arxiv_id):
+                missing.append(arxiv_id)
+        else:
+            yield arxiv_id, doc
+    if not missing:
+        return
+
     client = arxiv.Client()
-    arxiv_results = search_arxiv_by_id(ids, client)
-    dirpath = "./data/extracted_data"
-    
-    all_tex_file_paths = []  # List to accumulate all extracted .tex file paths
+    papers = _lookup_papers(missing, client)
+
+    with ThreadPoolExecutor(max_workers=max_workers or arxiv_max_workers) as executor:
+        futures = {executor.submit(fetch_document, paper, cache): arxiv_id
+                   for arxiv_id, paper in papers.items()}
+        for future in as_completed(futures):
+            arxiv_id = futures[future]
+            try:
+                doc = future.result()
+            except Exception as e:
+                print(f'Error fetching {arxiv_id}: {e}')
+                continue
+            if doc:
+                yield arxiv_id, doc
+
+
+def get_whole_documents(ids, max_workers=None):
+    """
+    Fetches the LaTeX sources of several arXiv papers in parallel.
 
-    for i, paper in enumerate(arxiv_results, start=1):
-        filename = f"d{i}.tar.gz"
-        paper.download_source(dirpath=dirpath, filename=filename)
-        print(f'Downloaded: {filename}')
-        
-        # Extract .tex files and get their paths
-        tex_file_paths = extract_tex_files(os.path.join(dirpath, filename), extract_path=dirpath)
-        all_tex_file_paths.extend(tex_file_paths)  # Append to the main list
-        
-        print(f'Extracted {len(tex_file_paths)} .tex files from {filename}')
+    Returns:
+        dict[str, str]: The LaTeX source of every paper that could be fetched, keyed by requested
+                        id, in the order of `ids`.
+    """
+    documents = dict(iter_whole_documents(ids, max_workers=max_workers))
+    return {arxiv_id: documents[arxiv_id] for arxiv_id in ids if arxiv_id in documents}
 
-    return all_tex_file_paths  # Return the list of all extracted .tex file paths
 
+async def aiter_whole_documents(ids, max_workers=None):
+    """
+    Fetches the LaTeX sources of several arXiv papers in parallel without blocking the event loop.
+
+    Like `iter_whole_documents`, papers are yielded as soon as their download completes, so the
+    caller can process the first papers while the others are still being fetched.
+
+    Yields:
+        tuple[str, str]: (requested id, its LaTeX source).
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def produce():
+        try:
+            for item in iter_whole_documents(ids, max_workers=max_workers):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        finally:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except RuntimeError:
+                pass  # The loop is closed, nobody is waiting anymore.
 
+    producer = loop.run_in_executor(None, produce)
+    while (item := await queue.get()) is not done:
+        yield item
+    await producer
@@ -1,17 +1,44 @@
 import streamlit as st
 import asyncio
-from database_endpoints import get_papers, get_related_papers
-from query_arxiv import get_whole_documents
-from anthropic_client import AnthropicClient
+from database_endpoints import get_chunk_embeddings, get_papers, get_related_papers, get_relevant_passages
+from query_arxiv import aiter_whole_documents
+from latex_text import chunks_to_text, prepare_document
+from anthropic_client import DEFAULT_MAX_TOKENS, DEFAULT_MODEL, get_client
+from response_cache import cache_response, get_cached_response
+from event_loop import iterate, run, submit
 import os
 
-async def fetch_papers_async(query):
-    return await get_papers(query, 3)
+async def stream_claude_async(api_key, context_docs, query):
+    claud_client = get_client(api_key=api_key)
+    async for text in claud_client.stream_response(context_docs, query):
+        yield text
 
 
-async def call_claude_async(api_key, context_docs, query):
-    claud_client = AnthropicClient(api_key=api_key)
-    return await asyncio.to_thread(claud_client.get_response, context_docs, query)
+async def build_context(query, papers):
+    """
+    Builds the context of the prompt from the full texts of `papers`.
+
+    Papers are downloaded in parallel off the event loop, and each one is chunked and its
+    passages embedded as soon as it arrives, while the others are still downloading. A paper
+    that cannot be fetched is simply left out. Only the passages most relevant to the question
+    go into the context, up to a token budget, and the papers keep their ranking order.
+    """
+    papers_by_id = {paper.id: paper for paper in papers if paper.id}
+    chunks = {}
+    embedding_tasks = []
+    async for paper_id, tex in aiter_whole_documents(list(papers_by_id)):
+        chunks[paper_id] = await asyncio.to_thread(prepare_document, paper_id, tex)
+        if chunks[paper_id]:
+            embedding_tasks.append(asyncio.create_task(get_chunk_embeddings(papers_by_id[paper_id].doi, chunks[paper_id])))
+    await asyncio.gather(*embedding_tasks)
+
+    passages = await get_relevant_passages(query, papers, chunks)
+    context = ""
+    for paper_id, paper_chunks in passages.items():
+        paper = papers_by_id[paper_id]
+        context+="\nTITLE: "+str(paper.title) + "\nDOI: "+str(paper.doi) +  "\nDOCUMENT\n "+chunks_to_text(paper_chunks)
+    return context
+
 
 def render_query_page():
     """Render the Query Page UI."""
@@ -46,43 +73,44 @@ def render_query_page():
             st.session_state.current_query = query
             st.session_state.show_input = False  # Hide input after submission
 
-            # Async function to handle fetching and processing
-            async def handle_query():
+            # The async stages run on the shared event loop, Streamlit is only called from here
+            def handle_query():
                 with st.spinner("Fetching papers..."):
-                    six_papers = await get_papers(query)
-                    st.session_state.papers, st.session_state.citations = await get_related_papers(query, six_papers)
-                    ids = [paper.id for paper in six_papers]
+                    six_papers = run(get_papers(query))
                     dois = [paper.doi for paper in six_papers]
-                    titles =  [paper.title for paper in six_papers]
-                    context = ""
-                with st.spinner("Fetching documents..."):
-                    max_len = len(titles)
-                    while max_len > 0:
-                        try:
-                            ids = ids[:max_len]
-                            dois = dois[:max_len]
-                            titles = titles[:max_len]
-                            llm_context_docs = get_whole_documents(ids) # The good stuff (list)
-                            for i in range(len(llm_context_docs)):
-                                with open(llm_context_docs[i], "r") as f:
-                                    doc=f.read()
-                                context+="\nTITLE: "+str(titles[i]) + "\nDOI: "+str(dois[i]) +  "\nDOCUMENT\n "+str(doc)
-                            break
-                        except:
-                            max_len -= 1
-
-                with st.spinner("Calling Claude..."):
-                    api_key = os.getenv("CLAUDE_API_KEY")
-                    response = await call_claude_async(api_key, context, query)
-                    st.session_state.claude_response = response  # Store response
 
-                # Display Claude's response
-                st.markdown("---")
-                st.markdown("### Claude's Response")
-                st.write(st.session_state.claude_response)  # Display the response
+                # The citation graph is only needed by the graph page, so it is expanded while the
+                # answer is being prepared instead of before it.
+                related = submit(get_related_papers(query, six_papers))
+                try:
+                    # Display Claude's response as it is generated
+                    st.markdown("---")
+                    st.markdown("### Claude's Response")
+                    placeholder = st.empty()
+
+                    # A question already answered with the same papers skips the documents and Claude.
+                    response = get_cached_response(query, dois, DEFAULT_MODEL, DEFAULT_MAX_TOKENS)
+                    if response is None:
+                        with st.spinner("Fetching documents..."):
+                            context = run(build_context(query, six_papers))
+
+                        response = ""
+                        with st.spinner("Calling Claude..."):
+                            api_key = os.getenv("CLAUDE_API_KEY")
+                            for text in iterate(stream_claude_async(api_key, context, query)):
+                                response += text
+                                placeholder.markdown(response + "▌")
+                        cache_response(query, dois, DEFAULT_MODEL, DEFAULT_MAX_TOKENS, response)
+                    placeholder.markdown(response)
+                    st.session_state.claude_response = response  # Store response
+                finally:
+                    try:
+                        with st.spinner("Expanding the citation graph..."):
+                            st.session_state.papers, st.session_state.citations = related.result()
+                    except Exception as e:
+                        print(f"Error expanding the citation graph: {e}")
 
-            # Run the async process
-            asyncio.run(handle_query())
+            handle_query()
 
     # If user wants to ask another question, reset the input field
     if not st.session_state.show_input:
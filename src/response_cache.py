@@ -0,0 +1,83 @@
+# response_cache.py
+
+from embedding_cache import get_cached_embedding, normalize_query
+from embedding_model import model_key
+import numpy as np
+import os
+from tiered_cache import TieredCache
+
+# In-memory answers, lifetime in seconds (0 keeps answers until evicted) and an optional SQLite
+# file shared across restarts and processes.
+response_cache_size = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+response_cache_ttl = float(os.getenv("RESPONSE_CACHE_TTL", "86400")) or None
+response_cache_path = os.getenv("RESPONSE_CACHE_PATH")
+# Cosine similarity between question embeddings above which the answer to a different question
+# is reused, e.g. 0.97. 0 disables these semantic hits.
+response_cache_similarity = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+
+_response_cache: TieredCache = None
+
+
+def get_response_cache() -> TieredCache:
+    """Returns the process-wide response cache, configured from the RESPONSE_CACHE_* variables."""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = TieredCache(response_cache_size, ttl=response_cache_ttl, path=response_cache_path)
+    return _response_cache
+
+
+def response_key(question: str, dois: list[str], model: str, max_tokens: int) -> str:
+    """The cache key of an answer: the normalized question, the context papers, the model and the answer length."""
+    return TieredCache.make_key("response", normalize_query(question), *sorted(d for d in dois if d), model, max_tokens)
+
+
+def _question_embedding(question: str) -> np.ndarray:
+    # Only reuses the embedding computed for retrieval, the cache never runs the model itself.
+    embedding = get_cached_embedding(question, model_key(), "retrieval.query")
+    if embedding is None:
+        return None
+    return embedding / np.linalg.norm(embedding)
+
+
+def get_cached_response(question: str, dois: list[str], model: str, max_tokens: int, similarity: float = None) -> str:
+    """
+    Returns a cached answer to `question` given the same context papers, or None.
+
+    With a similarity threshold (RESPONSE_CACHE_SIMILARITY by default), an answer cached in
+    memory for another question is also returned if the embeddings of the two questions are at
+    least that similar, and it was generated by the same model with the same `max_tokens`.
+    """
+    cache = get_response_cache()
+    entry = cache.get(response_key(question, dois, model, max_tokens))
+    if entry is not None:
+        return entry["response"]
+
+    similarity = response_cache_similarity if similarity is None else similarity
+    embedding = _question_embedding(question) if similarity else None
+    if embedding is None:
+        return None
+    best, best_similarity = None, similarity
+    for _, entry in cache.items():
+        if entry["model"] != model or entry["max_tokens"] != max_tokens or entry["embedding"] is None:
+            continue
+        entry_similarity = float(entry["embedding"] @ embedding)
+        if entry_similarity >= best_similarity:
+            best, best_similarity = entry, entry_similarity
+    if best is not None:
+        print(f"Reusing the answer to '{best['question']}' (similarity {best_similarity:.3f})")
+        return best["response"]
+    return None
+
+
+def cache_response(question: str, dois: list[str], model: str, max_tokens: int, response: str) -> None:
+    """Stores the answer to `question` given the context papers `dois`."""
+    if not response:
+        return
+    get_response_cache().set(response_key(question, dois, model, max_tokens), {
+        "question": question,
+        "dois": sorted(d for d in dois if d),
+        "model": model,
+        "max_tokens": max_tokens,
+        "response": response,
+        "embedding": _question_embedding(question),
+    })
@@ -1,7 +1,7 @@
 # search_page.py
 import streamlit as st
 import json
-from anthropic_client import AnthropicClient
+from anthropic_client import get_client
 from dotenv import load_dotenv
 import os
 
@@ -12,9 +12,8 @@ load_dotenv()
 if 'messages' not in st.session_state:
     st.session_state.messages = [{"role": "assistant", "content": "Welcome to I-Cite!"}]
 
-# Initialize the Anthropic client
+# The Anthropic client is shared with the other pages, see `get_client`
 api_key = os.getenv("CLAUDE_API_KEY")
-anthropic_client = AnthropicClient(api_key=api_key)
 
 def render_search_page():
     """Render the Search Page UI."""
@@ -27,7 +26,7 @@ def render_search_page():
 
     if question:
         docs = "Ramanujam is the goat."
-        msg = anthropic_client.get_response(docs, question)
+        msg = get_client(api_key).get_response(docs, question)
         st.session_state.messages.append({"role": "user", "content": question})
         st.session_state.messages.append({"role": "assistant", "content": msg})
         st.chat_message("assistant").write(msg)
@@ -1,34 +1,67 @@
 import streamlit as st
-import asyncio
-from database_endpoints import fetch_substring_match
+from database_endpoints import fetch_full_text_match, fetch_fuzzy_title_match, fetch_substring_match
+from event_loop import run
 # from some_module import foo  # Import your function that retrieves papers
 
+PAGE_SIZE = 20
+
+# Matching modes and the function that retrieves one page of papers for each
+MATCHING_MODES = {
+    "Title contains": fetch_substring_match,
+    "Keywords in title and abstract": fetch_full_text_match,
+    "Title (typo tolerant)": fetch_fuzzy_title_match,
+}
+
 def render_text_matching_page():
     st.markdown("<h1 style='text-align: center;'>Text Matching</h1>", unsafe_allow_html=True)
     st.markdown("<h3 style='text-align: center;'>Enter a substring to find matching papers</h3>", unsafe_allow_html=True)
 
+    if 'text_matching_page' not in st.session_state:
+        st.session_state.text_matching_page = 0
+
     # Text input for the query
     query = st.text_input("Enter your query:", "")
+    mode = st.radio("Matching mode:", list(MATCHING_MODES), horizontal=True)
 
     if st.button('Search'):
-        if query:
-            async def test():
-                # Call the foo() function with the query
-                results = await fetch_substring_match(query)  # Replace with your actual function to fetch papers
-
-                if results:
-                    st.markdown("<h3 style='text-align: center;'>Matching Papers</h3>", unsafe_allow_html=True)
-
-                    # Display the results
-                    for paper in results:
-                        st.markdown(f"**Title:** {paper.title}")
-                        st.markdown(f"**DOI:** {paper.doi}")
-                        st.markdown(f"**Abstract:** {paper.abstract}")
-                        st.markdown("---")  # Separator between papers
-                else:
-                    st.markdown("No matching papers found.")
-            asyncio.run(test())
-        else:
+        st.session_state.text_matching_page = 0
+        st.session_state.text_matching_search = (query, mode)
+        if not query:
             st.warning("Please enter a query.")
 
+    # The last search stays on screen while paging through its results
+    search = st.session_state.get('text_matching_search')
+    if search and search[0]:
+        query, mode = search
+        page = st.session_state.text_matching_page
+        # Call the foo() function with the query, on the shared event loop.
+        # One extra paper is fetched to know whether there is a next page.
+        results = run(MATCHING_MODES[mode](query, limit=PAGE_SIZE + 1, offset=page * PAGE_SIZE))
+        has_next = len(results) > PAGE_SIZE
+        results = results[:PAGE_SIZE]
+
+        if results:
+            st.markdown("<h3 style='text-align: center;'>Matching Papers</h3>", unsafe_allow_html=True)
+
+            # Display the results
+            for paper in results:
+                st.markdown(f"**Title:** {paper.title}")
+                st.markdown(f"**DOI:** {paper.doi}")
+                st.markdown(f"**Abstract:** {paper.abstract}")
+                st.markdown("---")  # Separator between papers
+        else:
+            st.markdown("No matching papers found.")
+
+        col1, col2, col3 = st.columns([1, 1, 1])
+        with col1:
+            if page > 0 and st.button("Previous page"):
+                st.session_state.text_matching_page -= 1
+                st.rerun()
+        with col2:
+            st.markdown(f"<p style='text-align: center;'>Page {page + 1}</p>", unsafe_allow_html=True)
+        with col3:
+            if has_next and st.button("Next page"):
+                st.session_state.text_matching_page += 1
+                st.rerun()
+
 # To render this page, the main_page.py will call `render_text_matching_page()`
@@ -0,0 +1,155 @@
+# text_search.py
+
+from collections import Counter
+import math
+import numpy as np
+import re
+
+# Common English words ignored by the full text search, like Postgres' english configuration does.
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both but
+by can did do does doing down during each few for from further had has have having he her here hers herself him
+himself his how i if in into is it its itself just me more most my myself no nor not now of off on once only or
+other our ours ourselves out over own same she should so some such than that the their theirs them themselves then
+there these they this those through to too under until up very was we were what when where which while who whom
+why will with you your yours yourself yourselves
+""".split())
+
+# The full text search document of a paper in SQL: title matches (weight A) rank above abstract
+# matches (weight B). The GIN index created by `database_indexes.create_text_indexes` is built
+# on exactly this expression, so queries must use it verbatim to be served by the index.
+SEARCH_VECTOR_SQL = ("(setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+                     "setweight(to_tsvector('english', coalesce(abstract, '')), 'B'))")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercases `text` and splits it into alphanumeric words, without stopwords."""
+    return [t for t in re.findall(r"[a-z0-9]+", (text or "").lower()) if t not in STOPWORDS]
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _csr(keys: list[int], rows: list[int], values: list[float], nbr_keys: int):
+    """Groups (key, row, value) triples by key into CSR arrays: indptr, rows and values."""
+    keys = np.asarray(keys, dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+    indptr = np.zeros(nbr_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=nbr_keys), out=indptr[1:])
+    return indptr, np.asarray(rows, dtype=np.int32)[order], np.asarray(values, dtype=np.float32)[order]
+
+
+class LocalTextIndex:
+    """
+    In-memory inverted indexes over paper titles and abstracts, for searching without a database.
+
+    Full text search ranks papers with BM25 over title and abstract words, counting title words
+    twice, much like the weighted `tsvector` of the database. Substring search narrows the titles
+    down with a trigram index, like `pg_trgm`, and only checks the candidates. Postings are kept
+    in CSR arrays, so a search touches only the postings of the query's terms.
+    """
+
+    def __init__(self, papers: list[dict], k1: float = 1.2, b: float = 0.75) -> None:
+        """
+        Args:
+            papers (list[dict]): The papers, with at least 'title' and optionally 'abstract' and
+                                 'relevance'. Search results are row numbers into this list.
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 document length normalization.
+        """
+        self.papers = papers
+        self.k1 = k1
+        self.b = b
+        self.titles = [(p.get("title") or "").lower() for p in papers]
+
+        self.vocabulary: dict[str, int] = {}
+        terms, rows, counts = [], [], []
+        lengths = np.zeros(len(papers), dtype=np.float32)
+        for row, paper in enumerate(papers):
+            words = tokenize(paper.get("title")) * 2 + tokenize(paper.get("abstract"))
+            lengths[row] = len(words)
+            for word, count in Counter(words).items():
+                terms.append(self.vocabulary.setdefault(word, len(self.vocabulary)))
+                rows.append(row)
+                counts.append(count)
+        self._term_indptr, self._term_rows, self._term_counts = _csr(terms, rows, counts, len(self.vocabulary))
+        self._lengths = lengths
+        self._avg_length = float(lengths.mean()) if len(papers) else 0.0
+
+        self.trigram_ids: dict[str, int] = {}
+        grams, rows = [], []
+        for row, title in enumerate(self.titles):
+            for gram in trigrams(title):
+                grams.append(self.trigram_ids.setdefault(gram, len(self.trigram_ids)))
+                rows.append(row)
+        self._gram_indptr, self._gram_rows, _ = _csr(grams, rows, [0] * len(rows), len(self.trigram_ids))
+
+        relevance = np.array([p.get("relevance") or 0.0 for p in papers], dtype=np.float32)
+        # Substring matches are listed by decreasing relevance, like the database query.
+        self._relevance_rank = np.empty(len(papers), dtype=np.int64)
+        self._relevance_rank[np.argsort(-relevance, kind="stable")] = np.arange(len(papers))
+
+    def search(self, query: str, k: int = 20, offset: int = 0) -> list[tuple[int, float]]:
+        """
+        Ranks the papers matching any word of `query` by BM25.
+
+        Returns:
+            list[tuple[int, float]]: (row, score) pairs of one page of results, best first.
+        """
+        scores = np.zeros(len(self.papers), dtype=np.float32)
+        matched = False
+        for word in set(tokenize(query)):
+            term = self.vocabulary.get(word)
+            if term is None:
+                continue
+            start, end = self._term_indptr[term], self._term_indptr[term + 1]
+            rows, counts = self._term_rows[start:end], self._term_counts[start:end]
+            idf = math.log(1 + (len(self.papers) - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[rows] / self._avg_length)
+            scores[rows] += idf * counts * (self.k1 + 1) / (counts + norm)
+            matched = True
+        if not matched:
+            return []
+
+        hits = np.flatnonzero(scores)
+        n = min(offset + k, len(hits))
+        if n <= 0:
+            return []
+        if n < len(hits):
+            # Keep every tie of the n-th score, so pages are cut at the same place every time.
+            kth = np.partition(-scores[hits], n - 1)[n - 1]
+            hits = hits[-scores[hits] <= kth]
+        top = hits[np.lexsort((hits, -scores[hits]))][offset:offset + k]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def substring(self, query: str, k: int = 20, offset: int = 0) -> list[int]:
+        """
+        Finds the papers whose title contains `query`, case-insensitively.
+
+        Returns:
+            list[int]: The rows of one page of matches, by decreasing relevance.
+        """
+        query = query.lower()
+        grams = trigrams(query)
+        if grams:
+            candidates = None
+            postings = []
+            for gram in grams:
+                gram_id = self.trigram_ids.get(gram)
+                if gram_id is None:
+                    return []
+                postings.append(self._gram_rows[self._gram_indptr[gram_id]:self._gram_indptr[gram_id + 1]])
+            for rows in sorted(postings, key=len):
+                candidates = rows if candidates is None else np.intersect1d(candidates, rows, assume_unique=True)
+                if not len(candidates):
+                    return []
+        else:
+            # Too short for trigrams, every title is a candidate.
+            candidates = np.arange(len(self.papers))
+
+        matches = np.array([row for row in candidates if query in self.titles[row]], dtype=np.int64)
+        if not len(matches):
+            return []
+        matches = matches[np.argsort(self._relevance_rank[matches], kind="stable")]
+        return [int(row) for row in matches[offset:offset + k]]
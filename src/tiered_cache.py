@@ -0,0 +1,135 @@
+# tiered_cache.py
+
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+class TieredCache:
+    """
+    A thread-safe key/value cache with a bounded in-memory LRU tier and an optional SQLite tier.
+
+    Lookups check memory first, then disk; disk hits are promoted back to memory. Both tiers
+    evict their least recently used entries past their size bound, and entries older than `ttl`
+    seconds are treated as misses and dropped. Values are pickled on disk, so anything picklable
+    (NumPy arrays, strings, dicts) can be stored.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = None, path: str = None, max_disk_entries: int = 100000) -> None:
+        """
+        Args:
+            max_entries (int): The maximum number of entries kept in memory.
+            ttl (float, optional): The lifetime of an entry in seconds. Entries never expire if None.
+            path (str, optional): A SQLite file for the persistent tier. Memory only if None.
+            max_disk_entries (int): The maximum number of entries kept on disk.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, created REAL, accessed REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS cache_accessed_idx ON cache (accessed)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Hashes the parts of a composite key into a fixed-size string key."""
+        return hashlib.sha256("\x00".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key: str, default=None):
+        """Returns the cached value for `key`, or `default` on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if not self._expired(row[1], now):
+                        self._db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        value = pickle.loads(row[0])
+                        self._remember(key, value, row[1])
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value
+                    self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value) -> None:
+        """Stores `value` under `key` in every tier."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, pickle.dumps(value), now, now)
+                )
+                self._db.execute(
+                    """
+                    DELETE FROM cache WHERE key IN (
+                        SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_disk_entries,)
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, value, created: float) -> None:
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def items(self):
+        """Returns a snapshot of the unexpired (key, value) pairs held in memory."""
+        now = time.time()
+        with self._lock:
+            return [(k, v) for k, (v, created) in self._memory.items() if not self._expired(created, now)]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters and the number of entries held in memory."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "entries": len(self._memory),
+        }
@@ -0,0 +1,233 @@
+# vector_search.py
+
+from abc import ABC, abstractmethod
+import asyncio
+import json
+import numpy as np
+import os
+from paper import Paper
+
+
+class VectorIndex(ABC):
+    """
+    Interface of the similarity search backends behind `get_papers` and `get_related_papers`.
+
+    Both methods return `Paper` objects with `similarity` (and `title_similarity` when title
+    embeddings are available) set to the cosine similarity with the query embedding.
+    """
+
+    @abstractmethod
+    async def search(self, embedding, k: int, offset: int = 0, **kwargs) -> list[Paper]:
+        """Returns the papers ranked `offset` .. `offset + k` by similarity to `embedding`."""
+
+    @abstractmethod
+    async def similarity_for(self, embedding, dois: list[str]) -> list[Paper]:
+        """Returns the papers among `dois`, sorted by descending similarity to `embedding`."""
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class LocalVectorIndex(VectorIndex):
+    """
+    In-process exact (or IVF approximate) cosine search over a NumPy embedding matrix.
+
+    The rows are L2-normalized once when the index is saved, so a search is a matrix product
+    followed by `argpartition`. The matrix is memory-mapped and scored in row batches (upcast to
+    float32), so a float16 index of the whole corpus does not need to fit in memory at once.
+
+    An index directory contains:
+        papers.json             the paper metadata, one object per row
+        embeddings.npy          the normalized abstract embeddings
+        title_embeddings.npy    the normalized title embeddings (optional)
+        ivf_centroids.npy       the IVF coarse quantizer (optional, see `build_ivf`)
+        ivf_assignments.npy     the IVF list of every row (optional)
+    """
+
+    def __init__(self, embeddings: np.ndarray, papers: list[dict], title_embeddings: np.ndarray = None,
+                 batch_size: int = 65536, nprobe: int = 8) -> None:
+        self.embeddings = embeddings
+        self.title_embeddings = title_embeddings
+        self.papers = papers
+        self.doi_to_row = {p["doi"]: i for i, p in enumerate(papers)}
+        self.batch_size = batch_size
+        self.nprobe = nprobe
+        self.centroids: np.ndarray = None
+        self._list_indptr: np.ndarray = None
+        self._list_rows: np.ndarray = None
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "LocalVectorIndex":
+        """Memory-maps an index directory written by `save` (and optionally `build_ivf`)."""
+        with open(os.path.join(path, "papers.json")) as f:
+            papers = json.load(f)
+        embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        title_path = os.path.join(path, "title_embeddings.npy")
+        title_embeddings = np.load(title_path, mmap_mode="r") if os.path.exists(title_path) else None
+        index = cls(embeddings, papers, title_embeddings, **kwargs)
+
+        centroids_path = os.path.join(path, "ivf_centroids.npy")
+        if os.path.exists(centroids_path):
+            index._set_ivf(np.load(centroids_path), np.load(os.path.join(path, "ivf_assignments.npy")))
+        return index
+
+    @staticmethod
+    def save(path: str, papers: list[dict], embeddings: np.ndarray, title_embeddings: np.ndarray = None,
+             dtype: str = "float16") -> None:
+        """
+        Writes an index directory.
+
+        Args:
+            path (str): The directory to write, created if needed.
+            papers (list[dict]): One metadata dict per row, with at least 'doi', and optionally
+                                 'id', 'title', 'abstract' and 'date'.
+            embeddings (np.ndarray): The abstract embeddings, one row per paper.
+            title_embeddings (np.ndarray, optional): The title embeddings, one row per paper.
+            dtype (str): "float16" halves the size of the matrices, "float32" keeps full precision.
+        """
+        os.makedirs(path, exist_ok=True)
+        # Files from a previous export would no longer line up with the new rows.
+        for name in ("title_embeddings.npy", "ivf_centroids.npy", "ivf_assignments.npy"):
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+        with open(os.path.join(path, "papers.json"), "w") as f:
+            json.dump(papers, f)
+        np.save(os.path.join(path, "embeddings.npy"), _normalize(embeddings).astype(dtype))
+        if title_embeddings is not None:
+            np.save(os.path.join(path, "title_embeddings.npy"), _normalize(title_embeddings).astype(dtype))
+
+    def build_ivf(self, nlist: int = None, iterations: int = 10, sample_size: int = 50000,
+                  path: str = None, seed: int = 0) -> None:
+        """
+        Trains a spherical k-means coarse quantizer so searches only score `nprobe` of `nlist` lists.
+
+        Args:
+            nlist (int, optional): The number of lists. Defaults to sqrt(rows).
+            iterations (int): The number of k-means iterations. Defaults to 10.
+            sample_size (int): The number of rows the centroids are trained on. Defaults to 50000.
+            path (str, optional): An index directory to persist the quantizer to.
+            seed (int): The random seed of the centroid initialization and sampling.
+        """
+        rng = np.random.default_rng(seed)
+        rows = len(self.papers)
+        nlist = nlist or max(int(np.sqrt(rows)), 1)
+        sample = np.sort(rng.choice(rows, size=min(sample_size, rows), replace=False))
+        train = np.asarray(self.embeddings[sample], dtype=np.float32)
+        centroids = train[rng.choice(len(train), size=min(nlist, len(train)), replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(train @ centroids.T, axis=1)
+            for c in range(len(centroids)):
+                members = train[assignments == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = _normalize(centroids)
+
+        assignments = np.empty(rows, dtype=np.int32)
+        for start in range(0, rows, self.batch_size):
+            batch = np.asarray(self.embeddings[start:start + self.batch_size], dtype=np.float32)
+            assignments[start:start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+        self._set_ivf(centroids, assignments)
+
+        if path:
+            np.save(os.path.join(path, "ivf_centroids.npy"), centroids)
+            np.save(os.path.join(path, "ivf_assignments.npy"), assignments)
+
+    def _set_ivf(self, centroids: np.ndarray, assignments: np.ndarray) -> None:
+        self.centroids = centroids
+        self._list_rows = np.argsort(assignments, kind="stable")
+        self._list_indptr = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=len(centroids)), out=self._list_indptr[1:])
+
+    def _candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        lists = np.argsort(-(self.centroids @ query))[:nprobe]
+        rows = [self._list_rows[self._list_indptr[l]:self._list_indptr[l + 1]] for l in lists]
+        return np.sort(np.concatenate(rows))
+
+    def top_k(self, queries: np.ndarray, k: int, nprobe: int = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the `k` most similar rows for a batch of queries.
+
+        Args:
+            queries (np.ndarray): One query embedding per row, or a single embedding.
+            k (int): The number of rows to return per query.
+            nprobe (int, optional): The number of IVF lists scored per query when the index has an
+                                    IVF quantizer. Defaults to the index's `nprobe`; 0 forces an
+                                    exact search.
+
+        Returns:
+            np.ndarray: The row numbers, shape (queries, k), best first.
+            np.ndarray: The cosine similarities, same shape.
+        """
+        queries = _normalize(np.atleast_2d(queries))
+        nprobe = self.nprobe if nprobe is None else nprobe
+        k = min(k, len(self.papers))
+        if self.centroids is not None and nprobe:
+            results = []
+            for q in queries:
+                candidates = self._candidates(q, nprobe)
+                # Too few candidates in the probed lists, fall back to an exact search.
+                results.append(self._top_k_rows(q[None, :], candidates if len(candidates) >= k else None, k))
+            return np.vstack([r[0] for r in results]), np.vstack([r[1] for r in results])
+        return self._top_k_rows(queries, None, k)
+
+    def _top_k_rows(self, queries: np.ndarray, rows: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        total = len(self.papers) if rows is None else len(rows)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, total, self.batch_size):
+            if rows is None:
+                batch_rows = np.arange(start, min(start + self.batch_size, total))
+                batch = self.embeddings[start:start + self.batch_size]
+            else:
+                batch_rows = rows[start:start + self.batch_size]
+                batch = self.embeddings[batch_rows]
+            scores = queries @ np.asarray(batch, dtype=np.float32).T
+            # Keep only the batch's top k per query before merging with the running best.
+            if scores.shape[1] > k:
+                keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                batch_rows = batch_rows[keep]
+            else:
+                batch_rows = np.broadcast_to(batch_rows, scores.shape)
+            best_rows = np.hstack([best_rows, batch_rows])
+            best_scores = np.hstack([best_scores, scores])
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def _paper(self, row: int, query: np.ndarray, similarity: float) -> Paper:
+        paper = Paper.from_dict(self.papers[row])
+        paper.similarity = float(similarity)
+        if self.title_embeddings is not None:
+            paper.title_similarity = float(np.asarray(self.title_embeddings[row], dtype=np.float32) @ query)
+        return paper
+
+    def _search(self, embedding, k: int, offset: int, nprobe: int) -> list[Paper]:
+        query = _normalize(embedding)
+        rows, scores = self.top_k(query, k + offset, nprobe=nprobe)
+        return [self._paper(r, query, s) for r, s in zip(rows[0][offset:], scores[0][offset:])]
+
+    def _similarity_for(self, embedding, dois: list[str]) -> list[Paper]:
+        query = _normalize(embedding)
+        rows = [self.doi_to_row[doi] for doi in dict.fromkeys(dois) if doi in self.doi_to_row]
+        if not rows:
+            return []
+        scores = np.asarray(self.embeddings[np.sort(rows)], dtype=np.float32) @ query
+        papers = [self._paper(r, query, s) for r, s in zip(np.sort(rows), scores)]
+        papers.sort(key=lambda p: p.similarity, reverse=True)
+        return papers
+
+    # The scoring reads the memory-mapped matrix and runs on a worker thread, so it does not block
+    # the event loop shared by every session.
+    async def search(self, embedding, k: int, offset: int = 0, nprobe: int = None, **kwargs) -> list[Paper]:
+        return await asyncio.to_thread(self._search, embedding, k, offset, nprobe)
+
+    async def similarity_for(self, embedding, dois: list[str]) -> list[Paper]:
+        return await asyncio.to_thread(self._similarity_for, embedding, dois)
@@ -0,0 +1,7 @@
+# conftest.py
+
+import os
+import sys
+
+# The modules of src/ import each other by their flat names, as when run from src/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
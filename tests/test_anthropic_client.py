@@ -0,0 +1,171 @@
+# test_anthropic_client.py
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import threading
+
+anthropic = pytest.importorskip("anthropic")
+import anthropic_client
+from anthropic_client import AnthropicClient, FakeAnthropicClient
+import httpx
+
+
+def rate_limited() -> Exception:
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    return anthropic.RateLimitError("rate limited", response=httpx.Response(429, request=request), body=None)
+
+
+class ScriptedStream:
+    """Stands in for the SDK's message stream: yields `deltas`, then raises `error` if given."""
+
+    def __init__(self, deltas: list[str], error: Exception = None) -> None:
+        self.deltas = deltas
+        self.error = error
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    @property
+    async def text_stream(self):
+        for delta in self.deltas:
+            yield delta
+        if self.error is not None:
+            raise self.error
+
+
+class ScriptedSDK:
+    """Stands in for `anthropic.AsyncAnthropic`, answering each request with the next stream."""
+
+    def __init__(self, *streams: ScriptedStream) -> None:
+        self.streams = list(streams)
+        self.requests = []
+        self.messages = self
+
+    def stream(self, **kwargs) -> ScriptedStream:
+        self.requests.append(kwargs)
+        return self.streams.pop(0)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(anthropic_client, "_limiter", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(anthropic_client, "anthropic_backoff_base", 0.0)
+    return AnthropicClient("test-key", max_retries=2)
+
+
+def collect(stream) -> list[str]:
+    async def consume():
+        return [text async for text in stream]
+    return asyncio.run(consume())
+
+
+def test_fake_client_streams_its_answer_word_by_word():
+    fake = FakeAnthropicClient(response="Sparse attention scales linearly.")
+    deltas = collect(fake.stream_response("docs", "How does it scale?"))
+    assert deltas == ["Sparse", " attention", " scales", " linearly."]
+    assert "".join(deltas) == fake.get_response("docs", "How does it scale?")
+    assert len(fake.prompts) == 2 and "How does it scale?" in fake.prompts[0] and "docs" in fake.prompts[0]
+
+
+def test_fake_client_default_answer_describes_the_prompt():
+    fake = FakeAnthropicClient(delay=0.001)
+    answer = "".join(collect(fake.stream_response("x" * 42, "Why?")))
+    assert answer == "This is a fake answer to: Why?. The context had 42 characters."
+
+
+def test_get_client_returns_one_fake_client_per_key(monkeypatch):
+    monkeypatch.setattr(anthropic_client, "anthropic_client_kind", "fake")
+    monkeypatch.setattr(anthropic_client, "_clients", {})
+    fake = anthropic_client.get_client("key")
+    assert isinstance(fake, FakeAnthropicClient)
+    assert anthropic_client.get_client("key") is fake
+    assert anthropic_client.get_client("other") is not fake
+
+
+def test_stream_response_yields_the_deltas(client, monkeypatch):
+    sdk = ScriptedSDK(ScriptedStream(["Hello", ", ", "world"]))
+    monkeypatch.setattr(client, "_get_async_client", lambda: sdk)
+    assert collect(client.stream_response("docs", "question", max_tokens=10)) == ["Hello", ", ", "world"]
+    assert sdk.requests[0]["max_tokens"] == 10
+    assert "question" in sdk.requests[0]["messages"][0]["content"]
+    stats = client.metrics.stats()
+    assert (stats["calls"], stats["errors"], stats["retries"]) == (1, 0, 0)
+    assert stats["first_token_p50"] is not None
+    # The limiter slot is given back.
+    assert anthropic_client._limiter.acquire(blocking=False)
+
+
+def test_stream_response_retries_rate_limits_before_the_first_token(client, monkeypatch):
+    sdk = ScriptedSDK(ScriptedStream([], rate_limited()), ScriptedStream(["Hello"]))
+    monkeypatch.setattr(client, "_get_async_client", lambda: sdk)
+    assert collect(client.stream_response("docs", "question")) == ["Hello"]
+    assert len(sdk.requests) == 2
+    assert client.metrics.stats()["retries"] == 1
+
+
+def test_stream_response_does_not_retry_after_text_was_sent(client, monkeypatch):
+    sdk = ScriptedSDK(ScriptedStream(["Hel"], rate_limited()), ScriptedStream(["Hello"]))
+    monkeypatch.setattr(client, "_get_async_client", lambda: sdk)
+    received = []
+
+    async def consume():
+        async for text in client.stream_response("docs", "question"):
+            received.append(text)
+
+    with pytest.raises(anthropic.RateLimitError):
+        asyncio.run(consume())
+    assert received == ["Hel"]
+    assert len(sdk.requests) == 1
+    assert client.metrics.stats()["errors"] == 1
+    assert anthropic_client._limiter.acquire(blocking=False)
+
+
+def test_stream_response_gives_up_after_max_retries(client, monkeypatch):
+    sdk = ScriptedSDK(*(ScriptedStream([], rate_limited()) for _ in range(3)))
+    monkeypatch.setattr(client, "_get_async_client", lambda: sdk)
+    with pytest.raises(anthropic.RateLimitError):
+        collect(client.stream_response("docs", "question"))
+    assert len(sdk.requests) == 3
+    assert client.metrics.stats()["retries"] == 2
+    assert anthropic_client._limiter.acquire(blocking=False)
+
+
+def test_stream_response_releases_the_limiter_when_the_reader_stops_early(client, monkeypatch):
+    sdk = ScriptedSDK(ScriptedStream(["a", "b", "c"]))
+    monkeypatch.setattr(client, "_get_async_client", lambda: sdk)
+
+    async def read_one():
+        stream = client.stream_response("docs", "question")
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(read_one()) == "a"
+    assert anthropic_client._limiter.acquire(blocking=False)
+
+
+
+def test_waiting_for_the_limiter_leaves_the_default_executor_free(client):
+    anthropic_client._limiter.acquire()
+
+    async def wait():
+        loop = asyncio.get_running_loop()
+        # A single default thread: a limiter wait on it would starve `to_thread`.
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=1))
+        waiters = [asyncio.create_task(anthropic_client._acquire_limiter()) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        try:
+            assert await asyncio.wait_for(asyncio.to_thread(lambda: "prepared"), timeout=1) == "prepared"
+        finally:
+            # Lets the waiters through one at a time, so no worker thread is left blocked.
+            for _ in range(len(waiters)):
+                anthropic_client._limiter.release()
+                await asyncio.wait(waiters, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+                waiters = [waiter for waiter in waiters if not waiter.done()]
+        assert waiters == []
+
+    asyncio.run(wait())
@@ -0,0 +1,81 @@
+# test_chunk_retrieval.py
+
+import asyncio
+from latex_text import Chunk
+import numpy as np
+from paper import Paper
+import pytest
+
+# database_endpoints needs the database driver and the app's dependencies.
+database_endpoints = pytest.importorskip("database_endpoints")
+
+
+@pytest.fixture
+def chunk_store(monkeypatch):
+    """Resets the chunk store state and counts the calls to `ensure_chunk_table`."""
+    calls = []
+    monkeypatch.setattr(database_endpoints, "vector_backend", "pgvector")
+    monkeypatch.setattr(database_endpoints, "_chunk_store_enabled", None)
+    monkeypatch.setattr(database_endpoints, "_locks", {})
+
+    def ensure_chunk_table(error: Exception = None):
+        async def ensure():
+            calls.append(error)
+            await asyncio.sleep(0.01)
+            if error is not None:
+                raise error
+        monkeypatch.setattr(database_endpoints, "ensure_chunk_table", ensure)
+        return calls
+    return ensure_chunk_table
+
+
+def check_concurrently(nbr_tasks: int = 8) -> list[bool]:
+    async def check():
+        return await asyncio.gather(*(database_endpoints._chunk_store_available() for _ in range(nbr_tasks)))
+    return asyncio.run(check())
+
+
+def test_chunk_table_is_created_once_by_concurrent_papers(chunk_store):
+    calls = chunk_store()
+    assert check_concurrently() == [True] * 8
+    assert len(calls) == 1
+    assert check_concurrently() == [True] * 8
+    assert len(calls) == 1
+
+
+def test_chunk_store_is_disabled_once_after_a_failure(chunk_store, capsys):
+    calls = chunk_store(RuntimeError("permission denied"))
+    assert check_concurrently() == [False] * 8
+    assert len(calls) == 1
+    database_endpoints._disable_chunk_store(RuntimeError("again"))
+    assert capsys.readouterr().out.count("not stored in paper_chunks") == 1
+
+
+def test_chunk_store_is_not_used_with_the_local_backend(chunk_store, monkeypatch):
+    calls = chunk_store()
+    monkeypatch.setattr(database_endpoints, "vector_backend", "local")
+    assert check_concurrently() == [False] * 8
+    assert calls == []
+
+
+def test_relevant_passages_fit_the_token_budget(monkeypatch):
+    query = np.array([1.0, 0.0], dtype=np.float32)
+    # The similarity of each chunk to the query is its first coordinate.
+    directions = {"a": [0.9, 0.1, 0.5], "b": [0.8, 0.95]}
+    chunks = {pid: [Chunk(pid, i, "", "word " * 40) for i in range(len(d))] for pid, d in directions.items()}
+
+    async def get_embeding(text):
+        return query
+
+    async def get_chunk_embeddings(doi, paper_chunks):
+        d = directions[paper_chunks[0].paper_id]
+        return np.array([[x, np.sqrt(1 - x * x)] for x in d], dtype=np.float32)
+
+    monkeypatch.setattr(database_endpoints, "_get_embeding", get_embeding)
+    monkeypatch.setattr(database_endpoints, "get_chunk_embeddings", get_chunk_embeddings)
+    papers = [Paper("10.1/a", id="a"), Paper("10.1/b", id="b"), Paper("10.1/c", id="c")]
+
+    passages = asyncio.run(database_endpoints.get_relevant_passages("q", papers, chunks, token_budget=150))
+    assert {pid: [c.index for c in selected] for pid, selected in passages.items()} == {"a": [0], "b": [0, 1]}
+    assert list(passages) == ["a", "b"]
+    assert asyncio.run(database_endpoints.get_relevant_passages("q", papers, chunks, token_budget=10)) == {}
@@ -0,0 +1,164 @@
+# test_citation_index.py
+
+import asyncio
+import numpy as np
+import pytest
+from citation_index import CitationGraph
+
+
+def random_citations(nbr_papers=60, nbr_citations=300, seed=0) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, nbr_papers, size=(nbr_citations, 2))
+    return [{"id": i + 1, "source_paper": f"10.1/{s}", "cited_by": f"10.1/{c}"} for i, (s, c) in enumerate(pairs)]
+
+
+def scan_references(citations: list[dict], doi: str) -> list[str]:
+    return [c["source_paper"] for c in citations if c["cited_by"] == doi]
+
+
+def scan_cited_by(citations: list[dict], doi: str) -> list[str]:
+    return [c["cited_by"] for c in citations if c["source_paper"] == doi]
+
+
+def assert_same_neighbours(graph: CitationGraph, citations: list[dict]) -> None:
+    for node, doi in enumerate(graph.dois):
+        assert [graph.dois[p] for _, p in graph.references(node)] == scan_references(citations, doi)
+        assert [graph.dois[p] for _, p in graph.cited_by(node)] == scan_cited_by(citations, doi)
+        for edge, _ in graph.references(node) + graph.cited_by(node):
+            assert graph.citation(edge) in [{"source_paper": c["source_paper"], "cited_by": c["cited_by"]}
+                                            for c in citations]
+
+
+def naive_bfs(dois: list[str], citations: list[dict], max_papers: int) -> tuple[set[str], list[dict]]:
+    """The quadratic scan over the citation records that `_bfs` replaced."""
+    based_on, future_work, followed = set(dois), set(dois), []
+
+    def full_before():
+        return len(dois) + len(based_on) >= max_papers
+
+    def full_after():
+        return len(dois) + len(based_on) + len(future_work) >= max_papers
+
+    queue = list(dois)
+    for boi in queue:
+        for c in citations:
+            if full_before():
+                break
+            if c["cited_by"] == boi and c["source_paper"] not in based_on:
+                queue.append(c["source_paper"])
+                based_on.add(c["source_paper"])
+                followed.append(c)
+    queue = list(dois)
+    for boi in queue:
+        for c in citations:
+            if full_after():
+                break
+            if c["source_paper"] == boi and c["cited_by"] not in future_work:
+                queue.append(c["cited_by"])
+                future_work.add(c["cited_by"])
+                followed.append(c)
+    return (based_on | future_work) - set(dois), followed
+
+
+def test_neighbours_match_a_scan_of_the_records():
+    citations = random_citations()
+    graph = CitationGraph.from_records(citations)
+    assert graph.nbr_citations == len(citations)
+    assert graph.watermark == len(citations)
+    assert_same_neighbours(graph, citations)
+
+
+def test_incomplete_records_are_skipped():
+    citations = random_citations(nbr_citations=50)
+    graph = CitationGraph.from_records(citations + [{"source_paper": None, "cited_by": "10.1/0"},
+                                                    {"source_paper": "10.1/0", "cited_by": ""}])
+    assert graph.nbr_citations == len(citations)
+    assert_same_neighbours(graph, citations)
+
+
+def test_added_citations_are_visible_before_and_after_compaction():
+    citations = random_citations(nbr_citations=400)
+    graph = CitationGraph.from_records(citations[:300])
+    graph.compact_ratio = 1.0
+
+    added = [dict(c, source_paper=c["source_paper"].replace("10.1/", "10.2/")) if c["id"] % 7 == 0 else c
+             for c in citations[300:]]
+    assert graph.add_citations(added) == len(added)
+    assert graph.watermark == 400
+    assert graph._delta_sources
+    assert_same_neighbours(graph, citations[:300] + added)
+
+    graph.compact()
+    assert not graph._delta_sources
+    assert_same_neighbours(graph, citations[:300] + added)
+
+
+def test_add_citations_compacts_past_the_ratio():
+    citations = random_citations(nbr_citations=200)
+    graph = CitationGraph.from_records(citations[:100])
+    graph.add_citations(citations[100:])
+    assert not graph._delta_sources
+    assert_same_neighbours(graph, citations)
+
+
+def test_from_csv_reads_the_shards_in_order(tmp_path):
+    citations = random_citations(nbr_citations=40)
+    for shard, part in enumerate((citations[:25], citations[25:])):
+        with open(tmp_path / f"citation_connections_{shard}.csv", "w") as f:
+            f.write("source_paper,cited_by\n")
+            f.writelines(f"{c['source_paper']},{c['cited_by']}\n" for c in part)
+    graph = CitationGraph.from_csv(str(tmp_path / "citation_connections_*.csv"))
+    assert graph.watermark is None
+    assert_same_neighbours(graph, citations)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("max_papers", [5, 17, 40])
+def test_bfs_matches_the_record_scan(seed, max_papers):
+    # database_endpoints needs the database driver and the app's dependencies.
+    database_endpoints = pytest.importorskip("database_endpoints")
+    citations = random_citations(nbr_papers=40, nbr_citations=120, seed=seed)
+    graph = CitationGraph.from_records(citations)
+    dois = ["10.1/1", "10.1/2", "10.9/not-in-graph"]
+
+    related, followed = database_endpoints._bfs(dois, graph, max_papers=max_papers)
+    expected_related, expected_followed = naive_bfs(dois, citations, max_papers)
+    assert sorted(related) == sorted(expected_related)
+    assert followed == [{"source_paper": c["source_paper"], "cited_by": c["cited_by"]} for c in expected_followed]
+
+
+def test_concurrent_callers_build_and_refresh_the_graph_once(monkeypatch):
+    database_endpoints = pytest.importorskip("database_endpoints")
+    citations = random_citations(nbr_citations=100)
+    table = citations[:80]
+    calls = {"all": 0, "since": 0}
+
+    async def fetch_all_citations():
+        calls["all"] += 1
+        await asyncio.sleep(0.01)
+        return list(table)
+
+    async def fetch_citations_since(watermark):
+        calls["since"] += 1
+        await asyncio.sleep(0.01)
+        return [c for c in table if c["id"] > watermark], len(table)
+
+    monkeypatch.setattr(database_endpoints, "_fetch_all_citations", fetch_all_citations)
+    monkeypatch.setattr(database_endpoints, "_fetch_citations_since", fetch_citations_since)
+    monkeypatch.setattr(database_endpoints, "citation_graph_csv", None)
+    monkeypatch.setattr(database_endpoints, "_citation_graph", None)
+    monkeypatch.setattr(database_endpoints, "_locks", {})
+
+    async def get_graphs():
+        return await asyncio.gather(*(database_endpoints._get_citation_graph() for _ in range(8)))
+
+    graphs = asyncio.run(get_graphs())
+    assert calls == {"all": 1, "since": 0}
+    assert all(graph is graphs[0] for graph in graphs)
+
+    table = citations
+    monkeypatch.setattr(database_endpoints, "_citation_graph_checked", 0.0)
+    graphs = asyncio.run(get_graphs())
+    assert calls == {"all": 1, "since": 1}
+    assert graphs[0].watermark == 100
+    assert_same_neighbours(graphs[0], citations)
@@ -0,0 +1,40 @@
+# test_document_cache.py
+
+from document_cache import DocumentCache
+import os
+import time
+
+
+def test_document_cache_finds_the_newest_version(tmp_path):
+    cache = DocumentCache(str(tmp_path))
+    cache.put("2401.00001v1", "first")
+    cache.put("2401.00001v10", "tenth")
+    cache.put("math/0501001v2", "old style")
+    assert cache.read("2401.00001v1") == "first"
+    assert cache.read("2401.00001") == "tenth"
+    assert cache.read("math/0501001") == "old style"
+    assert cache.read("2401.00002") is None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_document_cache_evicts_the_least_recently_used(tmp_path):
+    cache = DocumentCache(str(tmp_path), max_bytes=25)
+    cache.put("1v1", "a" * 10)
+    os.utime(cache.path("1v1"), (1, 1))
+    cache.put("2v1", "b" * 10)
+    cache.put("3v1", "c" * 10)
+    assert cache.read("1v1") is None
+    assert cache.read("2v1") == "b" * 10 and cache.read("3v1") == "c" * 10
+
+
+def test_document_cache_missing_markers_expire(tmp_path):
+    cache = DocumentCache(str(tmp_path), missing_ttl=60)
+    assert not cache.is_missing("2401.00001")
+    cache.put_missing("2401.00001v2")
+    assert cache.is_missing("2401.00001v2") and cache.is_missing("2401.00001")
+    assert cache.read("2401.00001") is None
+
+    stale = time.time() - 120
+    os.utime(cache.path("2401.00001v2", ".missing"), (stale, stale))
+    assert not cache.is_missing("2401.00001")
+    assert not os.path.exists(cache.path("2401.00001v2", ".missing"))
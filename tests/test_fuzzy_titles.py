@@ -0,0 +1,84 @@
+# test_fuzzy_titles.py
+
+import numpy as np
+import pytest
+
+pytest.importorskip("rapidfuzz")
+pytest.importorskip("unidecode")
+from fuzzy_titles import FuzzyTitleIndex, normalize_title, title_grams
+
+PAPERS = [
+    {"title": "Attention Is All You Need", "relevance": 0.9},
+    {"title": "Deep Residual Learning for Image Recognition", "relevance": 0.8},
+    {"title": "BERT: Pre-training of Deep Bidirectional Transformers", "relevance": 0.7},
+    {"title": "Générative Adversarial Nets", "relevance": 0.6},
+    {"title": "Graph Attention Networks", "relevance": 0.5},
+    {"title": "Residual Attention Network for Image Classification", "relevance": 0.4},
+    {"title": None},
+]
+
+
+def random_papers(rows=2000, seed=0) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    words = ["graph", "neural", "network", "attention", "residual", "learning", "deep", "sparse",
+             "transformer", "vision", "language", "model", "retrieval", "embedding", "diffusion", "kernel"]
+    return [{"title": " ".join(rng.choice(words, size=rng.integers(3, 8))), "relevance": float(rng.random())}
+            for _ in range(rows)]
+
+
+def test_normalize_title():
+    assert normalize_title("Générative  Adversarial-Nets!") == "generative adversarial nets"
+    assert normalize_title(None) == ""
+
+
+def test_title_grams_skip_stopwords():
+    assert title_grams("all of it") == set()
+    assert title_grams("nets") == {"  n", " ne", "net", "ets", "ts "}
+
+
+@pytest.mark.parametrize("query, row", [
+    ("Atention is all you need", 0),
+    ("deep residual lerning for image recognition", 1),
+    ("BERT pretraining of deep bidirectional transformers", 2),
+    ("generative adversarial nets", 3),
+    ("GRAPH ATTENTION NETWROKS", 4),
+])
+def test_search_finds_titles_despite_typos(query, row):
+    results = FuzzyTitleIndex(PAPERS).search(query)
+    assert results[0][0] == row
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+
+def test_search_without_a_match():
+    index = FuzzyTitleIndex(PAPERS)
+    assert index.search("quantum chromodynamics") == []
+    assert index.search("the of and") == []
+    assert index.search("") == []
+
+
+def test_score_cutoff():
+    index = FuzzyTitleIndex(PAPERS)
+    assert all(score >= 95 for _, score in index.search("graph attention networks", score_cutoff=95))
+    assert len(index.search("attention", score_cutoff=0, k=100)) > len(index.search("attention", score_cutoff=95, k=100))
+
+
+def test_candidates_are_capped_by_shared_trigrams():
+    papers = random_papers()
+    index = FuzzyTitleIndex(papers, max_candidates=50)
+    query = normalize_title(papers[7]["title"])
+    rows = index._candidates(query)
+    assert len(rows) == 50
+    assert 7 in rows
+    grams = title_grams(query)
+    shared = [len(grams & title_grams(title)) for title in index.titles]
+    assert min(shared[row] for row in rows) >= sorted(shared, reverse=True)[49]
+
+
+def test_pages_partition_the_matches():
+    papers = random_papers()
+    index = FuzzyTitleIndex(papers, max_candidates=300)
+    everything = index.search("sparse graph attention", k=len(papers), score_cutoff=50)
+    assert len(everything) > 30
+    pages = [index.search("sparse graph attention", k=10, offset=offset, score_cutoff=50)
+             for offset in range(0, len(everything), 10)]
+    assert [match for page in pages for match in page] == everything
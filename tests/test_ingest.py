@@ -0,0 +1,63 @@
+# test_ingest.py
+
+import io
+import json
+import pytest
+
+# ingest needs the database driver.
+ingest = pytest.importorskip("ingest")
+
+PAPERS = [
+    {"doi": "10.1/a", "id": "2401.00001", "title": "Attention, again", "abstract": "Uses \"quotes\" and ]brackets[", "relevance": 0.5},
+    {"doi": "10.1/b", "id": None, "title": "Ünïcode {titles}", "abstract": "Line\nbreaks", "relevance": 12},
+    {"doi": "10.1/c", "id": "2401.00003", "title": "", "abstract": None, "relevance": -1.25e-3},
+]
+
+
+def pandas_dump(papers: list[dict]) -> dict:
+    return {name: {str(i): paper[name] for i, paper in enumerate(papers)} for name in papers[0]}
+
+
+@pytest.mark.parametrize("text", [
+    json.dumps(PAPERS),
+    json.dumps(PAPERS, indent=2),
+    "\n  " + json.dumps(PAPERS, ensure_ascii=False) + "\n",
+    "\n".join(json.dumps(paper) for paper in PAPERS) + "\n",
+    "\n\n".join(json.dumps(paper, ensure_ascii=False) for paper in PAPERS),
+    json.dumps(pandas_dump(PAPERS)),
+    json.dumps(pandas_dump(PAPERS), indent=2),
+], ids=["array", "indented array", "padded array", "json lines", "json lines with blank lines", "pandas", "indented pandas"])
+def test_read_papers_formats(tmp_path, text):
+    path = tmp_path / "papers.json"
+    path.write_text(text)
+    assert list(ingest.read_papers(str(path))) == PAPERS
+
+
+def test_read_papers_single_record(tmp_path):
+    path = tmp_path / "papers.json"
+    path.write_text(json.dumps(PAPERS[0], indent=2))
+    assert list(ingest.read_papers(str(path))) == [PAPERS[0]]
+    path.write_text("")
+    assert list(ingest.read_papers(str(path))) == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1 << 20])
+@pytest.mark.parametrize("value", [[], PAPERS, [1, 23, 456.5, -7e10, True, None, "x", [1, [2]], {}], [12345678901234567890]])
+def test_json_array_across_chunks(chunk_size, value):
+    for text in (json.dumps(value), json.dumps(value, indent=4)):
+        assert list(ingest._iter_json_array(io.StringIO(text), chunk_size)) == value
+
+
+@pytest.mark.parametrize("text", ["[1, 2", "[1 2]", '[{"a": 1}', "[", "{}"])
+def test_json_array_errors(text):
+    with pytest.raises(json.JSONDecodeError):
+        list(ingest._iter_json_array(io.StringIO(text), 2))
+
+
+def test_json_array_is_read_incrementally():
+    text = json.dumps(PAPERS * 1000)
+    f = io.StringIO(text)
+    records = ingest._iter_json_array(f, chunk_size=256)
+    assert next(records) == PAPERS[0]
+    assert f.tell() <= 512 < len(text)
+    assert len(list(records)) == 3 * 1000 - 1
@@ -0,0 +1,101 @@
+# test_latex_text.py
+
+import latex_text
+from latex_text import Chunk, chunk_text, chunks_to_text, estimate_tokens, latex_to_text, split_sections
+import pytest
+from tiered_cache import TieredCache
+
+TEX = r"""
+\documentclass{article}
+\usepackage{amsmath}
+\newcommand{\R}{\mathbb{R}}
+\begin{document}
+\title{A Paper}
+\author{Someone \thanks{Somewhere}}
+\maketitle
+\begin{abstract}
+We study \emph{sparse} attention.% a comment
+\end{abstract}
+\section{Introduction}\label{sec:intro}
+Transformers~\cite{vaswani2017} are \textbf{widely used}\footnote{See the survey.}. A 100\% improvement
+is reported in Section~\ref{sec:results}.
+\begin{equation}
+  y = \sum_i x_i
+\end{equation}
+Inline math $x$ is kept.
+
+\subsection{Background}
+\begin{itemize}
+\item First point
+\item[(b)] Second point
+\end{itemize}
+\begin{figure}[t]
+  \includegraphics{plot.pdf}
+  \caption{A plot.}
+\end{figure}
+\section*{Results}
+It \textit{works}.
+\begin{thebibliography}{9}
+\bibitem{vaswani2017} Attention is all you need.
+\end{thebibliography}
+\end{document}
+"""
+
+
+def test_latex_to_text_keeps_the_readable_content():
+    text = latex_to_text(TEX)
+    assert "sparse attention." in text
+    assert "Transformers are widely used (See the survey.)." in text
+    assert "A 100% improvement is reported in Section ." in text
+    assert "Background." in text
+    assert "- First point" in text and "- (b) Second point" in text
+    assert "Inline math $x$ is kept." in text
+    assert "It works." in text
+
+
+@pytest.mark.parametrize("dropped", ["a comment", "amsmath", "mathbb", "vaswani2017", "sec:intro", "sum_i",
+                                     "plot.pdf", "A plot.", "Attention is all you need", "Somewhere", "\\", "{", "}"])
+def test_latex_to_text_drops_markup(dropped):
+    assert dropped not in latex_to_text(TEX)
+
+
+def test_split_sections():
+    sections = split_sections(latex_to_text(TEX))
+    assert [title for title, _ in sections] == ["", "Abstract", "Introduction", "Results"]
+    assert dict(sections)["Results"] == "It works."
+
+
+def test_unsectioned_text_has_an_empty_title():
+    assert split_sections(latex_to_text("Just a paragraph.\n\nAnd another.")) == [
+        ("", "Just a paragraph.\n\nAnd another.")
+    ]
+
+
+@pytest.mark.parametrize("max_tokens", [8, 32, 128])
+def test_chunks_stay_within_their_section_and_size(max_tokens):
+    paragraphs = "\n\n".join(f"Sentence {i} of paragraph {p} is here." * (p + 1) for p in range(6) for i in range(3))
+    text = latex_to_text(f"\\section{{One}}\n{paragraphs}\n\\section{{Two}}\nShort.")
+    chunks = chunk_text("2401.00001v1", text, max_tokens)
+
+    assert [c.index for c in chunks] == list(range(len(chunks)))
+    assert {c.section for c in chunks} == {"One", "Two"}
+    assert chunks[-1].section == "Two" and chunks[-1].text == "Short."
+    for chunk in chunks:
+        assert chunk.paper_id == "2401.00001v1"
+        assert len(chunk.text) <= max_tokens * latex_text.CHARS_PER_TOKEN
+        assert chunk.tokens == estimate_tokens(chunk.text)
+    # Chunking only regroups the words of each section.
+    for title, body in split_sections(text):
+        assert " ".join(c.text for c in chunks if c.section == title).split() == body.split()
+
+
+def test_chunks_to_text_adds_a_heading_per_section():
+    chunks = [Chunk("p", 0, "", "Preface."), Chunk("p", 1, "Intro", "One."), Chunk("p", 2, "Intro", "Two.")]
+    assert chunks_to_text(chunks) == "Preface.\n\nSECTION: Intro\n\nOne.\n\nTwo."
+
+
+def test_prepare_document_reuses_cached_chunks(monkeypatch):
+    monkeypatch.setattr(latex_text, "_chunk_cache", TieredCache(8))
+    first = latex_text.prepare_document("p", TEX, max_tokens=64)
+    assert latex_text.prepare_document("p", TEX, max_tokens=64) is first
+    assert latex_text.prepare_document("p", TEX + "\nMore.", max_tokens=64) is not first
@@ -0,0 +1,113 @@
+# test_query_arxiv.py
+
+from document_cache import DocumentCache
+import gzip
+import io
+import pytest
+import tarfile
+
+query_arxiv = pytest.importorskip("query_arxiv")
+
+
+class FakePaper:
+    def __init__(self, short_id: str) -> None:
+        self.short_id = short_id
+        self.pdf_url = f"http://arxiv.org/pdf/{short_id}"
+
+    def get_short_id(self) -> str:
+        return self.short_id
+
+
+def make_tarball(files: dict[str, str]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, text in files.items():
+            data = text.encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def serve(monkeypatch, *payloads: bytes) -> list[str]:
+    """Makes the downloads return `payloads` in turn. Returns the list of requested URLs."""
+    requested = []
+
+    def urlopen(url, timeout=None):
+        requested.append(url)
+        return io.BytesIO(payloads[min(len(requested), len(payloads)) - 1])
+
+    monkeypatch.setattr(query_arxiv.urllib.request, "urlopen", urlopen)
+    return requested
+
+
+def test_fetch_document_caches_the_source(tmp_path, monkeypatch):
+    cache = DocumentCache(str(tmp_path))
+    requested = serve(monkeypatch, make_tarball({"main.tex": "Hello", "sec/intro.tex": "World", "fig.png": "x"}))
+    assert query_arxiv.fetch_document(FakePaper("2401.00001v1"), cache) == "Hello\nWorld\n"
+    assert requested == ["http://export.arxiv.org/src/2401.00001v1"]
+    assert cache.read("2401.00001") == "Hello\nWorld\n"
+
+
+@pytest.mark.parametrize("payload", [b"%PDF-1.5 not a LaTeX source", make_tarball({"figure.png": "x"})])
+def test_fetch_document_records_papers_without_source(tmp_path, monkeypatch, payload):
+    cache = DocumentCache(str(tmp_path))
+    requested = serve(monkeypatch, payload)
+    assert query_arxiv.fetch_document(FakePaper("2401.00001v1"), cache) == ""
+    assert len(requested) == 1
+    assert cache.is_missing("2401.00001")
+
+
+@pytest.mark.parametrize("broken", [
+    lambda source: source[:len(source) // 2],
+    lambda source: source[:1],
+    lambda source: b"",
+])
+def test_fetch_document_retries_truncated_downloads(tmp_path, monkeypatch, broken):
+    cache = DocumentCache(str(tmp_path))
+    source = make_tarball({"main.tex": "Hello " * 5000})
+    requested = serve(monkeypatch, broken(source), source)
+    assert query_arxiv.fetch_document(FakePaper("2401.00001v1"), cache) == "Hello " * 5000 + "\n"
+    assert len(requested) == 2
+    assert not cache.is_missing("2401.00001")
+
+
+def test_fetch_document_does_not_record_failed_downloads(tmp_path, monkeypatch):
+    cache = DocumentCache(str(tmp_path))
+    source = make_tarball({"main.tex": "Hello " * 5000})
+    requested = serve(monkeypatch, source[:100])
+    with pytest.raises(EOFError):
+        query_arxiv.fetch_document(FakePaper("2401.00001v1"), cache, max_retries=2)
+    assert len(requested) == 2
+    assert not cache.is_missing("2401.00001")
+
+
+def test_iter_whole_documents_skips_cached_and_missing_papers(tmp_path, monkeypatch):
+    cache = DocumentCache(str(tmp_path))
+    cache.put("2401.00001v1", "cached")
+    cache.put_missing("2401.00002v1")
+    monkeypatch.setattr(query_arxiv, "get_document_cache", lambda: cache)
+    monkeypatch.setattr(query_arxiv.arxiv, "Client", lambda: pytest.fail("no paper should be looked up"))
+    assert list(query_arxiv.iter_whole_documents(["2401.00001", "2401.00002", ""])) == [("2401.00001", "cached")]
+
+
+def test_iter_tex_members_streams_the_tex_files_of_a_tarball():
+    source = make_tarball({"main.tex": "Hello", "fig.png": "x", "sec/intro.tex": "Wörld"})
+    assert list(query_arxiv.iter_tex_members(io.BytesIO(source), "p")) == [
+        ("p", "main.tex", "Hello"), ("p", "sec/intro.tex", "Wörld")
+    ]
+
+
+def test_iter_tex_members_reads_a_single_gzipped_file():
+    source = gzip.compress(b"\\documentclass{article} Hello")
+    assert list(query_arxiv.iter_tex_members(io.BytesIO(source), "p")) == [
+        ("p", "p.tex", "\\documentclass{article} Hello")
+    ]
+
+
+def test_iter_tex_members_caps_the_bytes_read():
+    source = make_tarball({"a.tex": "a" * 60, "b.tex": "b" * 60, "c.tex": "c" * 60})
+    members = list(query_arxiv.iter_tex_members(io.BytesIO(source), "p", max_bytes=100))
+    assert [(name, len(text)) for _, name, text in members] == [("a.tex", 60), ("b.tex", 40)]
+    single = list(query_arxiv.iter_tex_members(io.BytesIO(gzip.compress(b"x" * 200)), "p", max_bytes=100))
+    assert len(single[0][2]) == 100
@@ -0,0 +1,105 @@
+# test_query_page.py
+
+from paper import Paper
+import pytest
+import response_cache
+from tiered_cache import TieredCache
+
+pytest.importorskip("streamlit")
+from streamlit.testing.v1 import AppTest
+
+# query_page imports the database, arXiv and Claude clients.
+query_page = pytest.importorskip("query_page")
+from anthropic_client import FakeAnthropicClient
+
+PAPERS = [Paper("10.1/a", id="a", title="Linear attention"), Paper("10.1/b", id="b", title="Sparse attention")]
+
+
+def page():
+    import query_page
+    query_page.render_query_page()
+
+
+class RecordingClient(FakeAnthropicClient):
+    """A fake Claude client that logs each delta it sends."""
+
+    def __init__(self, events: list, response: str) -> None:
+        super().__init__(response=response)
+        self.events = events
+
+    async def stream_response(self, context_docs, query, **kwargs):
+        async for text in super().stream_response(context_docs, query, **kwargs):
+            self.events.append(("sent", text))
+            yield text
+
+
+@pytest.fixture
+def app(monkeypatch):
+    """Runs the Query page without a database, arXiv or Claude. Returns the logged events."""
+    events = []
+
+    async def get_papers(query):
+        return PAPERS
+
+    async def get_related_papers(query, papers):
+        return papers, [("10.1/a", "10.1/b")]
+
+    async def build_context(query, papers):
+        events.append(("context", [paper.id for paper in papers]))
+        return "TITLE: Linear attention"
+
+    stream = query_page.iterate
+
+    def iterate(agen):
+        for text in stream(agen):
+            events.append(("shown", text))
+            yield text
+
+    client = RecordingClient(events, "Attention can be computed in linear time.")
+    monkeypatch.setattr(query_page, "get_papers", get_papers)
+    monkeypatch.setattr(query_page, "get_related_papers", get_related_papers)
+    monkeypatch.setattr(query_page, "build_context", build_context)
+    monkeypatch.setattr(query_page, "get_client", lambda api_key=None: client)
+    monkeypatch.setattr(query_page, "iterate", iterate)
+    monkeypatch.setattr(response_cache, "_response_cache", TieredCache(8))
+    monkeypatch.setattr(response_cache, "response_cache_similarity", 0.0)
+    return events, client
+
+
+def ask(question: str) -> AppTest:
+    at = AppTest.from_function(page, default_timeout=30)
+    at.run()
+    at.chat_input[0].set_value(question).run()
+    assert not at.exception
+    return at
+
+
+def test_the_answer_is_streamed_into_the_page(app):
+    events, client = app
+    at = ask("How does linear attention scale?")
+    answer = "Attention can be computed in linear time."
+    assert at.session_state.claude_response == answer
+    assert answer in [markdown.value for markdown in at.markdown]
+    assert [paper.doi for paper in at.session_state.papers] == ["10.1/a", "10.1/b"]
+    assert at.session_state.citations == [("10.1/a", "10.1/b")]
+    assert "How does linear attention scale?" in client.prompts[0]
+    assert events[0] == ("context", ["a", "b"])
+
+
+def test_each_delta_is_shown_before_the_next_one_is_requested(app):
+    events, _ = app
+    ask("How does linear attention scale?")
+    deltas = "Attention can be computed in linear time.".split(" ")
+    deltas = [deltas[0]] + [" " + word for word in deltas[1:]]
+    expected = [event for text in deltas for event in (("sent", text), ("shown", text))]
+    assert events[1:] == expected
+
+
+def test_a_cached_answer_skips_the_documents_and_claude(app):
+    events, client = app
+    ask("How does linear attention scale?")
+    events.clear()
+    at = ask("How does linear attention scale?")
+    assert at.session_state.claude_response == "Attention can be computed in linear time."
+    assert events == []
+    assert len(client.prompts) == 1
@@ -0,0 +1,94 @@
+# test_text_search.py
+
+from collections import Counter
+import math
+import numpy as np
+import pytest
+from text_search import LocalTextIndex, tokenize
+
+PAPERS = [
+    {"title": "Attention Is All You Need", "abstract": "The transformer, based solely on attention.", "relevance": 0.9},
+    {"title": "Graph Neural Networks", "abstract": "Message passing networks with attention over neighbours.", "relevance": 0.5},
+    {"title": "Deep Residual Learning", "abstract": "Residual networks ease the training of deep networks.", "relevance": 0.8},
+    {"title": "Residual Attention Networks", "abstract": "Attention modules stacked in a residual network.", "relevance": 0.1},
+    {"title": "A Survey of Transformers", "abstract": None, "relevance": None},
+    {"title": None, "abstract": "An untitled paper about graph attention."},
+]
+
+
+def random_papers(rows=300, seed=0) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    words = ["graph", "neural", "network", "attention", "residual", "learning", "deep", "sparse",
+             "transformer", "vision", "language", "model", "retrieval", "embedding", "the", "of"]
+    return [{"title": " ".join(rng.choice(words, size=rng.integers(2, 7))),
+             "abstract": " ".join(rng.choice(words, size=rng.integers(5, 40))),
+             "relevance": float(rng.random())} for _ in range(rows)]
+
+
+def bm25(papers: list[dict], query: str, k1=1.2, b=0.75) -> dict[int, float]:
+    docs = [Counter(tokenize(p.get("title")) * 2 + tokenize(p.get("abstract"))) for p in papers]
+    avg_length = sum(sum(d.values()) for d in docs) / len(docs)
+    scores = {}
+    for word in set(tokenize(query)):
+        nbr_docs = sum(1 for d in docs if word in d)
+        if not nbr_docs:
+            continue
+        idf = math.log(1 + (len(docs) - nbr_docs + 0.5) / (nbr_docs + 0.5))
+        for row, d in enumerate(docs):
+            if word in d:
+                norm = k1 * (1 - b + b * sum(d.values()) / avg_length)
+                scores[row] = scores.get(row, 0.0) + idf * d[word] * (k1 + 1) / (d[word] + norm)
+    return scores
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("The Attention, is ALL you need!") == ["attention", "need"]
+    assert tokenize(None) == []
+
+
+@pytest.mark.parametrize("query", ["attention", "residual networks", "graph attention transformer", "deep the of"])
+def test_search_matches_bm25(query):
+    papers = random_papers()
+    expected = bm25(papers, query)
+    results = LocalTextIndex(papers).search(query, k=len(papers))
+    assert [row for row, _ in results] == sorted(expected, key=lambda row: (-expected[row], row))
+    for row, score in results:
+        assert score == pytest.approx(expected[row], rel=1e-4)
+
+
+def test_title_matches_rank_above_abstract_matches():
+    papers = [{"title": "sparse models", "abstract": "graph learning methods"},
+              {"title": "graph models", "abstract": "sparse learning methods"}]
+    assert [row for row, _ in LocalTextIndex(papers).search("graph")] == [1, 0]
+
+
+def test_search_without_known_words():
+    index = LocalTextIndex(PAPERS)
+    assert index.search("quantum") == []
+    assert index.search("the of") == []
+
+
+def test_search_pages_partition_the_results():
+    papers = random_papers()
+    index = LocalTextIndex(papers)
+    everything = index.search("graph attention", k=len(papers))
+    pages = [index.search("graph attention", k=7, offset=offset) for offset in range(0, len(everything), 7)]
+    assert [result for page in pages for result in page] == everything
+
+
+def test_substring_is_case_insensitive_by_relevance():
+    index = LocalTextIndex(PAPERS)
+    assert index.substring("ATTENTION") == [0, 3]
+    assert index.substring("residual") == [2, 3]
+    assert index.substring("network") == [1, 3]
+    assert index.substring("no such title") == []
+
+
+@pytest.mark.parametrize("query", ["ne", "graph n", "attention", "work gr", "deep learning", "xyz"])
+def test_substring_matches_a_scan_of_the_titles(query):
+    papers = random_papers()
+    index = LocalTextIndex(papers)
+    expected = sorted((row for row, p in enumerate(papers) if query in p["title"].lower()),
+                      key=lambda row: -papers[row]["relevance"])
+    assert index.substring(query, k=len(papers)) == expected
+    assert index.substring(query, k=5, offset=3) == expected[3:8]
@@ -0,0 +1,60 @@
+# test_tiered_cache.py
+
+import embedding_cache
+from embedding_cache import cache_embedding, get_cached_embedding, normalize_query
+import numpy as np
+import pytest
+from tiered_cache import TieredCache
+import time
+
+
+def test_tiered_cache_evicts_the_least_recently_used():
+    cache = TieredCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 1
+
+
+def test_tiered_cache_expires_entries(monkeypatch):
+    cache = TieredCache(ttl=10)
+    cache.set("a", 1)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("a", "missing") == "missing"
+    assert cache.items() == []
+
+
+def test_tiered_cache_disk_tier(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = TieredCache(max_entries=1, path=path, max_disk_entries=2)
+    cache.set("a", np.arange(3))
+    cache.set("b", "text")
+    cache.set("c", {"k": 1})
+    # "a" was the least recently used entry on disk.
+    reopened = TieredCache(path=path)
+    assert reopened.get("a") is None
+    assert reopened.get("b") == "text"
+    assert reopened.get("c") == {"k": 1}
+    assert reopened.stats()["disk_hits"] == 2
+    assert TieredCache.make_key("x", 1) == TieredCache.make_key("x", "1") != TieredCache.make_key("x1")
+
+
+def test_normalize_query_folds_whitespace_and_unicode_but_not_case():
+    assert normalize_query("  sparse\tattention \n") == "sparse attention"
+    assert normalize_query("ﬁne\u00a0tuning") == "fine tuning"
+    assert normalize_query("GAN") != normalize_query("gan")
+
+
+def test_cached_embeddings_are_read_only(monkeypatch):
+    monkeypatch.setattr(embedding_cache, "_embedding_cache", TieredCache(8))
+    assert get_cached_embedding("sparse attention", "model", "retrieval.query") is None
+    stored = cache_embedding("sparse attention", "model", "retrieval.query", [1.0, 2.0])
+    cached = get_cached_embedding(" sparse  attention", "model", "retrieval.query")
+    assert cached is stored and cached.dtype == np.float32
+    with pytest.raises(ValueError):
+        cached[0] = 0.0
+    assert get_cached_embedding("sparse attention", "model", "retrieval.passage") is None
@@ -0,0 +1,111 @@
+# test_vector_search.py
+
+import asyncio
+import numpy as np
+import pytest
+import threading
+from vector_search import LocalVectorIndex, VectorIndex
+
+
+def make_index(tmp_path, rows=500, dimensions=32, batch_size=64, titles=True) -> tuple[LocalVectorIndex, np.ndarray]:
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((rows, dimensions)).astype(np.float32)
+    title_embeddings = rng.standard_normal((rows, dimensions)).astype(np.float32) if titles else None
+    papers = [{"doi": f"10.1/{i}", "title": f"Paper {i}"} for i in range(rows)]
+    LocalVectorIndex.save(str(tmp_path), papers, embeddings, title_embeddings, dtype="float32")
+    return LocalVectorIndex.load(str(tmp_path), batch_size=batch_size), embeddings
+
+
+def brute_force(embeddings: np.ndarray, query: np.ndarray) -> np.ndarray:
+    return embeddings @ query / (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query))
+
+
+@pytest.mark.parametrize("k, offset", [(1, 0), (10, 0), (10, 25), (100, 0), (500, 0)])
+def test_search_matches_brute_force(tmp_path, k, offset):
+    index, embeddings = make_index(tmp_path)
+    query = np.random.default_rng(1).standard_normal(embeddings.shape[1]).astype(np.float32)
+    scores = brute_force(embeddings, query)
+    expected = np.argsort(-scores, kind="stable")[offset:offset + k]
+
+    papers = asyncio.run(index.search(query, k, offset))
+    assert [p.doi for p in papers] == [f"10.1/{i}" for i in expected]
+    np.testing.assert_allclose([p.similarity for p in papers], scores[expected], rtol=1e-5, atol=1e-6)
+
+
+def test_top_k_of_a_batch_of_queries(tmp_path):
+    index, embeddings = make_index(tmp_path, batch_size=37)
+    queries = np.random.default_rng(2).standard_normal((4, embeddings.shape[1])).astype(np.float32)
+    rows, scores = index.top_k(queries, 15)
+    assert rows.shape == scores.shape == (4, 15)
+    for q, query in enumerate(queries):
+        expected = np.argsort(-brute_force(embeddings, query), kind="stable")[:15]
+        assert rows[q].tolist() == expected.tolist()
+
+
+def test_title_similarity(tmp_path):
+    index, _ = make_index(tmp_path)
+    query = np.random.default_rng(3).standard_normal(32).astype(np.float32)
+    title_embeddings = np.load(tmp_path / "title_embeddings.npy")
+    for paper in asyncio.run(index.search(query, 5)):
+        row = int(paper.doi.split("/")[1])
+        assert paper.title_similarity == pytest.approx(brute_force(title_embeddings[row:row + 1], query)[0], abs=1e-5)
+
+
+def test_ivf_probing_every_list_is_exact(tmp_path):
+    index, embeddings = make_index(tmp_path, titles=False)
+    index.build_ivf(nlist=8, path=str(tmp_path))
+    query = np.random.default_rng(4).standard_normal(embeddings.shape[1]).astype(np.float32)
+    expected = np.argsort(-brute_force(embeddings, query), kind="stable")[:20]
+
+    rows, _ = index.top_k(query, 20, nprobe=8)
+    assert rows[0].tolist() == expected.tolist()
+    # The quantizer is persisted with the index.
+    reloaded = LocalVectorIndex.load(str(tmp_path))
+    assert reloaded.centroids is not None
+    assert reloaded.top_k(query, 20, nprobe=8)[0][0].tolist() == expected.tolist()
+
+
+def test_ivf_results_come_from_the_probed_lists(tmp_path):
+    index, embeddings = make_index(tmp_path, titles=False)
+    index.build_ivf(nlist=8)
+    query = np.random.default_rng(5).standard_normal(embeddings.shape[1]).astype(np.float32)
+    candidates = index._candidates(query / np.linalg.norm(query), 2)
+    rows, scores = index.top_k(query, 10, nprobe=2)
+    assert set(rows[0].tolist()) <= set(candidates.tolist())
+    assert list(scores[0]) == sorted(scores[0], reverse=True)
+
+
+def test_similarity_for(tmp_path):
+    index, embeddings = make_index(tmp_path)
+    query = np.random.default_rng(6).standard_normal(embeddings.shape[1]).astype(np.float32)
+    scores = brute_force(embeddings, query)
+    papers = asyncio.run(index.similarity_for(query, ["10.1/7", "10.1/3", "10.9/unknown", "10.1/7"]))
+    assert sorted(p.doi for p in papers) == ["10.1/3", "10.1/7"]
+    assert [p.similarity for p in papers] == sorted((p.similarity for p in papers), reverse=True)
+    for paper in papers:
+        assert paper.similarity == pytest.approx(scores[int(paper.doi.split("/")[1])], abs=1e-5)
+
+
+def test_vector_index_is_abstract():
+    class SearchOnly(VectorIndex):
+        async def search(self, embedding, k, offset=0, **kwargs):
+            return []
+
+    with pytest.raises(TypeError):
+        VectorIndex()
+    with pytest.raises(TypeError):
+        SearchOnly()
+
+
+def test_search_runs_off_the_event_loop_thread(tmp_path):
+    index, embeddings = make_index(tmp_path)
+    threads = []
+    top_k = index.top_k
+    index.top_k = lambda *args, **kwargs: threads.append(threading.get_ident()) or top_k(*args, **kwargs)
+
+    async def search():
+        return await asyncio.gather(index.search(embeddings[0], 3), index.similarity_for(embeddings[0], ["10.1/0"]))
+
+    papers, similar = asyncio.run(search())
+    assert papers[0].doi == similar[0].doi == "10.1/0"
+    assert threads and threading.get_ident() not in threads